@@ -3,6 +3,10 @@ ASGI config for GovFlow project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the project through this application (e.g. ``uvicorn GovFlow.asgi:application``)
+for the notification stream at /notifications/stream/: under WSGI that view
+answers 204 and pages fall back to polling /notifications/api/.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
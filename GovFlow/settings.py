@@ -64,7 +64,6 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
-                'GovFlowApp.context_processors.user_documents',
             ],
         },
     },
@@ -145,6 +144,55 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Shared between worker processes (e.g. the office directory version).
+# Point this at Redis or Memcached when running on more than one host; their
+# incr() is atomic, the file cache's is a read and a rewrite.
+# MAX_ENTRIES stays well above the number of staff (one unread count each), so
+# culling never evicts the directory version or the purge checkpoint.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'django_cache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+# QR codes are rendered on demand by the document_qr view and cached here
+# (content-addressed, safe to delete at any time). Run `manage.py
+# prune_qr_cache` daily to drop images unused for QR_CACHE_MAX_AGE_DAYS and
+# keep the directory under QR_CACHE_MAX_MB.
+QR_CACHE_DIR = BASE_DIR / 'qr_cache'
+QR_CACHE_MAX_AGE_DAYS = 30
+QR_CACHE_MAX_MB = 500
+
+# Also keep a PNG per document in MEDIA_ROOT/qr_codes/ (rendered by
+# `manage.py process_qr_jobs`). Off by default.
+QR_CODE_FILES = False
+
+# PDF reports are rendered by `manage.py process_report_jobs`, at most
+# REPORT_WORKERS at a time, so month-end bursts don't tie up web workers.
+# Each user may have REPORT_JOBS_PER_USER reports queued or running.
+REPORT_WORKERS = 2
+REPORT_JOBS_PER_USER = 3
+
+# Rendered reports are cached in MEDIA_ROOT/report_cache/. Reports for
+# periods that have ended are kept until late history invalidates them;
+# open periods are re-rendered after REPORT_CACHE_TTL seconds.
+REPORT_CACHE_TTL = 300
+
+# Unread notification counts for the header badge are cached per user and
+# recounted from the database at least every NOTIFICATION_COUNT_TTL seconds
+# (or by the reconcile_unread_counts command).
+NOTIFICATION_COUNT_TTL = 900
+
+# Unread notifications of the same kind and link sent to the same user within
+# this many seconds are merged into one row with a count (0 disables).
+NOTIFICATION_COALESCE_WINDOW = 600
+
+# Read notifications older than this many days are removed by
+# `manage.py purge_notifications` (run it daily from cron).
+NOTIFICATION_RETENTION_DAYS = 90
+
 
 TEMPLATES[0]["OPTIONS"]["context_processors"] += [
     "GovFlowApp.context_processors.notifications",
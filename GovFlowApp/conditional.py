@@ -0,0 +1,75 @@
+"""
+Conditional GET for read-only AJAX endpoints that the pages poll or re-open.
+
+@conditional_poll(state_func) asks state_func(request, *args, **kwargs) for a
+cheap description of everything the response depends on, turns it into an
+ETag, and answers a matching If-None-Match (or If-Modified-Since) with 304
+without calling the view, so unchanged polls skip the queries and template
+render behind the full response.
+
+With poll_interval=(minimum, maximum) the response also carries an
+X-Poll-Interval hint in seconds: clients send back the interval they used in
+the same header, and the hint doubles on every unchanged poll, up to the
+maximum, and drops back to the minimum as soon as something changes.
+"""
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+POLL_INTERVAL_HEADER = "X-Poll-Interval"
+
+
+def make_etag(parts):
+    return '"%s"' % hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def next_poll_interval(request, changed, minimum, maximum):
+    if changed:
+        return minimum
+    try:
+        previous = int(request.headers.get(POLL_INTERVAL_HEADER, minimum))
+    except ValueError:
+        previous = minimum
+    return max(minimum, min(previous * 2, maximum))
+
+
+def conditional_poll(state_func, poll_interval=None):
+    """
+    state_func returns (parts, last_modified) - `parts` any repr()-stable value
+    that changes whenever the response would, `last_modified` an aware datetime
+    or None - or None to skip conditional handling (e.g. the object is gone and
+    the view should produce its own 404).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+            state = state_func(request, *args, **kwargs)
+            if state is None:
+                return view(request, *args, **kwargs)
+
+            parts, last_modified = state
+            etag = make_etag(parts)
+            last_modified = int(last_modified.timestamp()) if last_modified else None
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            changed = response is None
+            if changed:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+
+            response["ETag"] = etag
+            if last_modified is not None:
+                response["Last-Modified"] = http_date(last_modified)
+            # Let the browser keep the body but revalidate on every request
+            response["Cache-Control"] = "private, no-cache"
+            if poll_interval:
+                response[POLL_INTERVAL_HEADER] = str(next_poll_interval(request, changed, *poll_interval))
+            return response
+        return wrapper
+    return decorator
@@ -1,30 +1,16 @@
 from .models import Notification
+from .unread import unread_count
 
 
 def notifications(request):
     if request.user.is_authenticated:
-        unread = Notification.objects.filter(
-            recipient=request.user, is_read=False
-        )
+        # The count comes from the cache; the latest five are only queried
+        # when there is something unread and the template actually renders them
+        count = unread_count(request.user)
         return {
-            "notification_count": unread.count(),
-            "notifications": unread[:5],
+            "notification_count": count,
+            "notifications": Notification.objects.filter(
+                recipient=request.user, is_read=False
+            ).order_by("-created_at")[:5] if count else [],
         }
     return {}
-
-
-from .models import Document
-from django.db.models import Q
-
-def user_documents(request):
-    """
-    Provides documents for the current user to populate dropdowns, e.g., per-document report.
-    """
-    if request.user.is_authenticated:
-        documents = Document.objects.filter(
-            Q(sender=request.user) | Q(current_office=request.user)
-        ).order_by('-created_at')
-        return {
-            "user_documents": documents
-        }
-    return {}
\ No newline at end of file
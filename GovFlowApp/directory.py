@@ -0,0 +1,55 @@
+"""
+Office directory for the forward/return dropdowns: users grouped by department.
+
+Each process keeps the grouped directory in memory together with the version
+it was built at. The current version lives in the shared cache and is
+replaced after every committed change to a User or UserProfile, so every
+worker process rebuilds on its next request after a change.
+"""
+import threading
+import time
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+
+
+VERSION_KEY = "govflow:office-directory:version"
+
+_lock = threading.Lock()
+_directory = {"version": None, "departments": {}}
+
+
+def directory_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_directory_version():
+    """Invalidate every process's directory once the current transaction commits."""
+    # A fresh unique value rather than incr(): two concurrent bumps can never collapse into one
+    transaction.on_commit(lambda: cache.set(VERSION_KEY, time.time_ns(), timeout=None))
+
+
+def office_directory():
+    """Return {department: [users]} for the current directory version."""
+    # Read the version before the users, so a change committed meanwhile triggers another rebuild
+    version = directory_version()
+    if _directory["version"] == version:
+        return _directory["departments"]
+
+    with _lock:
+        if _directory["version"] != version:
+            departments = defaultdict(list)
+            users = User.objects.select_related("userprofile").exclude(
+                userprofile__department__isnull=True
+            ).exclude(userprofile__department="")
+            for u in users:
+                departments[u.userprofile.department].append(u)
+            _directory["departments"] = dict(departments)
+            _directory["version"] = version
+    return _directory["departments"]
@@ -0,0 +1,62 @@
+"""
+In-process pub/sub that wakes open notification streams.
+
+A notification stream (views.notification_stream) subscribes for its user and
+sleeps until either publish() wakes it or its poll interval runs out; on each
+wake-up it checks the database for changes. publish() only reaches streams in
+the same process, so with several worker processes the interval poll is what
+picks up changes committed elsewhere.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+
+_lock = threading.Lock()
+_subscribers = defaultdict(set)
+
+
+class Subscription:
+    """Context manager registering the current event loop task for a user's wake-ups."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    def __enter__(self):
+        with _lock:
+            _subscribers[self.user_id].add(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        with _lock:
+            subscribers = _subscribers.get(self.user_id)
+            if subscribers is not None:
+                subscribers.discard(self)
+                if not subscribers:
+                    del _subscribers[self.user_id]
+
+    def wake(self):
+        # publish() runs in sync code on another thread, never on this loop
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:
+            pass  # loop already closed
+
+    async def wait(self, timeout):
+        """Sleep until woken or `timeout` seconds pass; True if woken."""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self.event.clear()
+        return True
+
+
+def publish(user_ids):
+    """Wake every stream in this process that belongs to one of `user_ids`."""
+    with _lock:
+        subscriptions = [s for user_id in user_ids for s in _subscribers.get(user_id, ())]
+    for subscription in subscriptions:
+        subscription.wake()
@@ -0,0 +1,215 @@
+"""
+Bulk document registration from CSV or Excel.
+
+Rows are read, validated and inserted one batch at a time with bulk_create,
+using a block of reserved tracking IDs and bulk-written initial history, so
+only a batch of rows is held in memory. All batches run in one transaction:
+a file that turns out to be undecodable or malformed part way through
+registers nothing (ImportFileError). Invalid rows go to a per-row error
+report instead of aborting the import.
+"""
+import csv
+import io
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from .models import (
+    Document, DocumentHistory, DocumentSearch, OfficeDayRollup, QRCodeJob, ReportArtifact, TrackingSequence,
+)
+from .qr import render_qr_bytes, store_cached_qr
+
+
+IMPORT_EXTENSIONS = (".csv", ".xlsx")
+ERROR_REPORT_COLUMNS = ["row", "error", "title", "priority", "description"]
+
+# Accept both the stored values and the labels shown in the UI
+PRIORITY_ALIASES = {
+    "high": "High", "urgent": "High",
+    "medium": "Medium", "standard": "Medium",
+    "low": "Low", "routine": "Low",
+}
+
+
+class ImportFileError(Exception):
+    """The upload cannot be read as a whole (wrong encoding, not a workbook, malformed CSV)."""
+
+
+class ImportResult:
+    def __init__(self, max_errors=None):
+        self.created = 0
+        self.failed = 0
+        self.errors = []  # (row number, raw row, message), the first `max_errors` of them
+        self.max_errors = max_errors
+
+    def add_error(self, number, row, message):
+        self.failed += 1
+        if self.max_errors is None or len(self.errors) < self.max_errors:
+            self.errors.append((number, row, message))
+
+
+def iter_rows(fileobj, filename):
+    """
+    Yield (row number, {column: value}) pairs without loading the whole file.
+    Raises ImportFileError when the file cannot be decoded or parsed.
+    """
+    if filename.lower().endswith(".xlsx"):
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+
+        try:
+            workbook = load_workbook(fileobj, read_only=True, data_only=True)
+        except (zipfile.BadZipFile, InvalidFileException, KeyError, OSError):
+            raise ImportFileError("The file is not a valid Excel (.xlsx) workbook.")
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(cell).strip().lower() if cell is not None else "" for cell in next(rows, ())]
+        for number, values in enumerate(rows, start=2):
+            if all(value is None for value in values):
+                continue
+            yield number, {
+                column: "" if value is None else str(value).strip()
+                for column, value in zip(header, values) if column
+            }
+        workbook.close()
+    else:
+        reader = csv.DictReader(io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline=""))
+        number = 1
+        try:
+            for number, row in enumerate(reader, start=2):
+                yield number, {
+                    (column or "").strip().lower(): (value or "").strip()
+                    for column, value in row.items() if isinstance(value, str) or value is None
+                }
+        except UnicodeDecodeError:
+            raise ImportFileError(
+                f"The file is not UTF-8 text (first unreadable data after row {number}). "
+                "Save it as \"CSV UTF-8\" and try again."
+            )
+        except csv.Error as error:
+            raise ImportFileError(f"The CSV file could not be parsed after row {number}: {error}.")
+
+
+def clean_row(row):
+    """Return (cleaned values, list of error messages) for one input row."""
+    errors = []
+
+    title = row.get("title", "")
+    if not title:
+        errors.append("title is required")
+    elif len(title) > Document._meta.get_field("title").max_length:
+        errors.append("title is longer than 255 characters")
+
+    raw_priority = row.get("priority", "") or "Medium"
+    priority = PRIORITY_ALIASES.get(raw_priority.lower())
+    if priority is None:
+        errors.append(f"unknown priority '{raw_priority}'")
+
+    description = row.get("description", "")
+    if not description:
+        errors.append("description is required")
+
+    return {"title": title, "priority": priority, "description": description}, errors
+
+
+def import_documents(fileobj, filename, sender, batch_size=500, render_qr=False, workers=None, max_errors=None):
+    """
+    Register every valid row as a document sent by `sender`. ImportFileError
+    means nothing was inserted. Only the first `max_errors` failed rows are
+    kept for the error report (all of them by default); `failed` counts all.
+    With `render_qr`, QR codes are rendered in a process pool once the import
+    has committed.
+
+    The tracking ID sequence row stays locked until the import commits, so
+    other registrations wait for it.
+    """
+    result = ImportResult(max_errors)
+    render_ids = []
+    with transaction.atomic():
+        batch = []
+        for number, row in iter_rows(fileobj, filename):
+            cleaned, errors = clean_row(row)
+            if errors:
+                result.add_error(number, row, "; ".join(errors))
+                continue
+            batch.append(cleaned)
+            if len(batch) == batch_size:
+                render_ids += insert_valid_rows(batch, sender, result, render_qr)
+                batch = []
+        if batch:
+            render_ids += insert_valid_rows(batch, sender, result, render_qr)
+
+    for start in range(0, len(render_ids), batch_size):
+        documents = Document.objects.select_related("sender", "current_office").filter(
+            pk__in=render_ids[start:start + batch_size]
+        )
+        render_qr_codes(list(documents), workers=workers)
+    return result
+
+
+def insert_valid_rows(rows, sender, result, render_qr):
+    """Insert one batch; returns the ids to render after commit when `render_qr`."""
+    documents = insert_batch(rows, sender)
+    result.created += len(documents)
+    if render_qr:
+        return [document.pk for document in documents]
+    if settings.QR_CODE_FILES:
+        QRCodeJob.objects.bulk_create([QRCodeJob(document=document) for document in documents])
+    return []
+
+
+@transaction.atomic
+def insert_batch(rows, sender):
+    # Reserved inside the transaction, so a failed batch leaves no gap in the sequence
+    tracking_ids = TrackingSequence.next_tracking_ids(len(rows))
+    documents = Document.objects.bulk_create([
+        Document(tracking_id=tracking_id, sender=sender, current_office=sender, **row)
+        for tracking_id, row in zip(tracking_ids, rows)
+    ])
+    # bulk_create skips post_save, so write what create_initial_history would have
+    entries = DocumentHistory.objects.bulk_create([
+        DocumentHistory(
+            document=document,
+            action=document.status,
+            from_office=None,
+            to_office=sender,
+            note="Document created",
+            performed_by=sender,
+        )
+        for document in documents
+    ])
+    OfficeDayRollup.record(entries)
+    DocumentSearch.refresh([document.pk for document in documents])
+    transaction.on_commit(lambda: ReportArtifact.invalidate_for(entries))
+    return documents
+
+
+def render_qr_codes(documents, workers=None):
+    """
+    Render QR codes in a process pool. Stored as per-document files when
+    QR_CODE_FILES is on, otherwise used to warm the on-demand QR cache.
+    """
+    payloads = [document.qr_payload() for document in documents]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        images = list(pool.map(render_qr_bytes, payloads, chunksize=16))
+
+    if settings.QR_CODE_FILES:
+        for document, content in zip(documents, images):
+            document.qr_code.save(f"QR_{document.tracking_id}.png", ContentFile(content), save=False)
+            document.qr_ready = True
+            document.qr_fingerprint = document.compute_qr_fingerprint()
+        Document.objects.bulk_update(documents, ["qr_code", "qr_ready", "qr_fingerprint"], batch_size=500)
+    else:
+        for payload, content in zip(payloads, images):
+            store_cached_qr(payload, "png", "medium", content)
+
+
+def write_error_report(errors, out):
+    writer = csv.writer(out)
+    writer.writerow(ERROR_REPORT_COLUMNS)
+    for number, row, message in errors:
+        writer.writerow([
+            number, message, row.get("title", ""), row.get("priority", ""), row.get("description", ""),
+        ])
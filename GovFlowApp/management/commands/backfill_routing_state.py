@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from GovFlowApp.models import Document
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized routing pointers on Document from DocumentHistory."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Number of documents to process per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        ids = list(Document.objects.order_by("pk").values_list("pk", flat=True))
+
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            with transaction.atomic():
+                documents = Document.objects.filter(pk__in=batch).prefetch_related("history")
+                for document in documents:
+                    document.refresh_routing_state()
+                    document.save_routing_state()
+            self.stdout.write(f"Processed {min(start + batch_size, len(ids))}/{len(ids)} documents")
+
+        self.stdout.write(self.style.SUCCESS(f"Routing state rebuilt for {len(ids)} documents."))
@@ -0,0 +1,46 @@
+import os
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from GovFlowApp.importer import IMPORT_EXTENSIONS, ImportFileError, import_documents, write_error_report
+
+
+class Command(BaseCommand):
+    help = "Register documents in bulk from a CSV or Excel file (columns: title, priority, description)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or .xlsx file to import.")
+        parser.add_argument("--sender", required=True, help="Username the documents are registered for.")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--errors", help="Where to write the per-row error report (default: <path>.errors.csv).")
+        parser.add_argument("--workers", type=int, default=None, help="QR rendering processes (default: CPU count).")
+        parser.add_argument("--no-qr", action="store_true", help="Skip QR rendering; codes render on demand.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not path.lower().endswith(IMPORT_EXTENSIONS):
+            raise CommandError(f"Unsupported file type; expected one of {', '.join(IMPORT_EXTENSIONS)}.")
+
+        try:
+            sender = User.objects.get(username=options["sender"])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named '{options['sender']}'.")
+
+        with open(path, "rb") as fileobj:
+            try:
+                result = import_documents(
+                    fileobj, os.path.basename(path), sender,
+                    batch_size=options["batch_size"],
+                    render_qr=not options["no_qr"],
+                    workers=options["workers"],
+                )
+            except ImportFileError as error:
+                raise CommandError(f"{error} Nothing was imported.")
+
+        self.stdout.write(self.style.SUCCESS(f"Registered {result.created} documents."))
+        if result.errors:
+            errors_path = options["errors"] or f"{path}.errors.csv"
+            with open(errors_path, "w", newline="", encoding="utf-8") as out:
+                write_error_report(result.errors, out)
+            self.stdout.write(self.style.WARNING(f"{result.failed} rows failed; see {errors_path}"))
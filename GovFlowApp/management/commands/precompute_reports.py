@@ -0,0 +1,104 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from .process_report_jobs import init_worker
+
+
+def precompute_user(user_id, month_year, formats, force):
+    """
+    Render one user's monthly report in each format into the artifact store.
+    Returns (user_id, {format: seconds, or None if it was already cached}, error).
+    """
+    from GovFlowApp.reports import Report, build_artifact, cached_artifact
+
+    timings = {}
+    try:
+        user = User.objects.get(pk=user_id)
+        report = Report(user, "monthly", {"month_year": month_year})
+        for fmt in formats:
+            if not force and cached_artifact(report, fmt):
+                timings[fmt] = None
+                continue
+            started = time.perf_counter()
+            build_artifact(report, fmt)
+            timings[fmt] = time.perf_counter() - started
+    except Exception as error:
+        return user_id, timings, repr(error)
+    finally:
+        connections.close_all()
+    return user_id, timings, None
+
+
+class Command(BaseCommand):
+    help = (
+        "Render every active user's monthly report (Excel and PDF by default) for the "
+        "previous month into the report artifact store. Safe to re-run: reports already "
+        "in the store are skipped, so an interrupted run resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--month", help="Month to render as YYYY-MM (default: the previous month).")
+        parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+        parser.add_argument("--formats", nargs="+", default=["xlsx", "pdf"], choices=["csv", "xlsx", "pdf"])
+        parser.add_argument("--nice", type=int, default=10, help="Niceness increment for worker processes.")
+        parser.add_argument("--force", action="store_true", help="Re-render reports that are already stored.")
+
+    def handle(self, *args, **options):
+        month_year = options["month"] or self.previous_month()
+        try:
+            year, month = map(int, month_year.split("-"))
+            if date(year, month, 1) >= timezone.localdate().replace(day=1):
+                raise CommandError(f"{month_year} has not ended yet; only closed months are precomputed.")
+        except ValueError:
+            raise CommandError("--month must look like YYYY-MM.")
+
+        user_ids = list(User.objects.filter(is_active=True).order_by("pk").values_list("pk", flat=True))
+        self.stdout.write(f"Precomputing {month_year} reports ({', '.join(options['formats'])}) for {len(user_ids)} users")
+
+        rendered = skipped = failed = 0
+        started = time.perf_counter()
+
+        # Workers open their own connections; don't share this one across fork
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=options["workers"], initializer=init_worker, initargs=(options["nice"],)
+        ) as pool:
+            futures = [
+                pool.submit(precompute_user, user_id, month_year, options["formats"], options["force"])
+                for user_id in user_ids
+            ]
+            for future in as_completed(futures):
+                user_id, timings, error = future.result()
+                if error:
+                    failed += 1
+                    self.stderr.write(f"user {user_id}: failed: {error}")
+                    continue
+                if all(seconds is None for seconds in timings.values()):
+                    skipped += 1
+                else:
+                    rendered += 1
+                details = "  ".join(
+                    f"{fmt} {'cached' if seconds is None else f'{seconds:.2f}s'}" for fmt, seconds in timings.items()
+                )
+                self.stdout.write(f"user {user_id}: {details}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{rendered} rendered, {skipped} already stored, {failed} failed "
+            f"in {time.perf_counter() - started:.1f}s"
+        ))
+        if failed:
+            raise CommandError(f"{failed} users failed; re-run to retry them.")
+
+    @staticmethod
+    def previous_month():
+        first_of_month = timezone.localdate().replace(day=1)
+        year, month = (first_of_month.year - 1, 12) if first_of_month.month == 1 else (
+            first_of_month.year, first_of_month.month - 1
+        )
+        return f"{year}-{month:02d}"
@@ -0,0 +1,66 @@
+import time
+import traceback
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from GovFlowApp.models import QRCodeJob
+from GovFlowApp.qr import render_document_qr
+
+
+class Command(BaseCommand):
+    help = "Render pending document QR codes in the background."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Drain the queue once and exit.")
+        parser.add_argument("--batch-size", type=int, default=20)
+        parser.add_argument("--sleep", type=float, default=2.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument(
+            "--stale-after", type=int, default=600,
+            help="Seconds after which a Running job is assumed abandoned and requeued.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            self.requeue_stale(options["stale_after"])
+            processed = self.run_batch(options["batch_size"])
+            if options["once"] and not processed:
+                break
+            if not processed:
+                time.sleep(options["sleep"])
+
+    def requeue_stale(self, seconds):
+        cutoff = timezone.now() - timedelta(seconds=seconds)
+        QRCodeJob.objects.filter(status="Running", updated_at__lt=cutoff).update(status="Pending")
+
+    def run_batch(self, batch_size):
+        job_ids = list(
+            QRCodeJob.objects.filter(status="Pending", run_after__lte=timezone.now())
+            .order_by("run_after")
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        processed = 0
+        for job_id in job_ids:
+            # Claim with a conditional UPDATE so several workers can share the queue
+            claimed = QRCodeJob.objects.filter(pk=job_id, status="Pending").update(
+                status="Running", attempts=F("attempts") + 1, updated_at=timezone.now()
+            )
+            if not claimed:
+                continue
+            processed += 1
+            job = QRCodeJob.objects.select_related(
+                "document__sender", "document__current_office"
+            ).get(pk=job_id)
+            try:
+                render_document_qr(job.document)
+            except Exception:
+                job.retry_later(traceback.format_exc())
+                self.stderr.write(f"QR render failed for {job.document.tracking_id} (attempt {job.attempts})")
+            else:
+                job.delete()
+                self.stdout.write(f"QR ready for {job.document.tracking_id}")
+        return processed
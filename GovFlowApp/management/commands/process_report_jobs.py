@@ -0,0 +1,107 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+from django.utils import timezone
+
+from GovFlowApp.models import ReportJob
+
+
+def init_worker(niceness):
+    # Spawned (non-fork) workers start without Django configured
+    if not apps.ready:
+        django.setup()
+    if niceness:
+        os.nice(niceness)  # keep renders behind web traffic on a shared host
+
+
+def run_job(job_id):
+    from GovFlowApp.reports import run_report_job
+
+    try:
+        return run_report_job(job_id)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Render queued PDF reports in a local process pool. At most --workers "
+        "reports render at once; the rest wait in the queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=settings.REPORT_WORKERS)
+        parser.add_argument("--once", action="store_true", help="Drain the queue once and exit.")
+        parser.add_argument("--sleep", type=float, default=2.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument("--nice", type=int, default=10, help="Niceness increment for worker processes.")
+        parser.add_argument(
+            "--stale-after", type=int, default=900,
+            help="Seconds without progress after which a Running job is assumed abandoned and requeued.",
+        )
+
+    def handle(self, *args, **options):
+        workers = max(1, options["workers"])
+        running = {}  # future -> job id
+
+        # Workers open their own connections; don't share this one across fork
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(options["nice"],)) as pool:
+            while True:
+                close_old_connections()
+                self.requeue_stale(options["stale_after"], exclude=running.values())
+
+                # Only claim as many jobs as there are free workers, so the cap holds
+                for job_id in self.claim(workers - len(running)):
+                    running[pool.submit(run_job, job_id)] = job_id
+
+                if not running:
+                    if options["once"]:
+                        break
+                    time.sleep(options["sleep"])
+                    continue
+
+                done, _ = wait(running, timeout=options["sleep"], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        _, ok = future.result()
+                    except Exception as error:
+                        # The worker process itself died; record it on the job
+                        ReportJob.objects.filter(pk=job_id).update(
+                            status="Failed", error=repr(error), finished_at=timezone.now()
+                        )
+                        ok = False
+                    if ok:
+                        self.stdout.write(f"Report job {job_id} done")
+                    else:
+                        self.stderr.write(f"Report job {job_id} failed")
+
+    def requeue_stale(self, seconds, exclude=()):
+        cutoff = timezone.now() - timedelta(seconds=seconds)
+        ReportJob.objects.filter(status="Running", updated_at__lt=cutoff).exclude(
+            pk__in=list(exclude)
+        ).update(status="Pending", progress=0)
+
+    def claim(self, slots):
+        if slots <= 0:
+            return []
+        job_ids = list(
+            ReportJob.objects.filter(status="Pending")
+            .order_by("created_at")
+            .values_list("pk", flat=True)[:slots]
+        )
+        claimed = []
+        for job_id in job_ids:
+            # Conditional UPDATE so several worker commands can share the queue
+            if ReportJob.objects.filter(pk=job_id, status="Pending").update(
+                status="Running", updated_at=timezone.now()
+            ):
+                claimed.append(job_id)
+        return claimed
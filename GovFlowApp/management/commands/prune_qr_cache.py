@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from GovFlowApp.qr import prune_qr_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete QR images from QR_CACHE_DIR that have not been served for --days, "
+        "then the least recently served ones until the cache fits in --max-mb. "
+        "Deleted images are rendered again on their next request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=float, default=getattr(settings, "QR_CACHE_MAX_AGE_DAYS", 30),
+            help="Keep images served within this many days (default: QR_CACHE_MAX_AGE_DAYS).",
+        )
+        parser.add_argument(
+            "--max-mb", type=float, default=getattr(settings, "QR_CACHE_MAX_MB", 500),
+            help="Size cap for the whole cache in MiB (default: QR_CACHE_MAX_MB).",
+        )
+
+    def handle(self, *args, **options):
+        if options["days"] <= 0 or options["max_mb"] <= 0:
+            raise CommandError("--days and --max-mb must be positive.")
+        deleted, freed = prune_qr_cache(
+            max_age=options["days"] * 24 * 3600, max_bytes=int(options["max_mb"] * 1024 ** 2)
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{deleted} cached QR images deleted ({freed / 1024 ** 2:.1f} MiB) from {settings.QR_CACHE_DIR}"
+        ))
@@ -0,0 +1,83 @@
+from datetime import date, datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from GovFlowApp.models import DocumentHistory, OfficeDayRollup, UserProfile
+from GovFlowApp.reports import with_next_timestamps
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the office/day dwell rollup for a date range from DocumentHistory, "
+        "a few days per transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="First day (YYYY-MM-DD); default: the first history entry.")
+        parser.add_argument("--end", help="Last day, inclusive (YYYY-MM-DD); default: today.")
+        parser.add_argument("--days-per-batch", type=int, default=7)
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options["start"]) if options["start"] else self.first_day()
+            end = date.fromisoformat(options["end"]) if options["end"] else timezone.localdate()
+        except ValueError:
+            raise CommandError("--start and --end must look like YYYY-MM-DD.")
+        if start is None:
+            self.stdout.write("No history to roll up.")
+            return
+
+        departments = dict(UserProfile.objects.exclude(department=None).values_list("user_id", "department"))
+        step = timedelta(days=max(1, options["days_per_batch"]))
+        day = start
+        while day <= end:
+            batch_end = min(day + step, end + timedelta(days=1))
+            rows = self.rebuild(day, batch_end, departments)
+            self.stdout.write(f"{day} .. {batch_end - timedelta(days=1)}: {rows} office/day rows")
+            day = batch_end
+
+    @staticmethod
+    def first_day():
+        first = DocumentHistory.objects.order_by("timestamp").values_list("timestamp", flat=True).first()
+        return timezone.localdate(first) if first else None
+
+    @transaction.atomic
+    def rebuild(self, first_day, end_day, departments):
+        """Replace the rollup rows of [first_day, end_day) and return how many were written."""
+        start_dt = timezone.make_aware(datetime.combine(first_day, time.min))
+        end_dt = timezone.make_aware(datetime.combine(end_day, time.min))
+
+        # Entries of the window plus every later entry of the same documents,
+        # which supplies the end of stays that run past the window
+        histories = DocumentHistory.objects.filter(
+            document_id__in=DocumentHistory.objects.filter(
+                timestamp__gte=start_dt, timestamp__lt=end_dt
+            ).values("document_id"),
+            timestamp__gte=start_dt,
+        ).only("document_id", "action", "from_office_id", "to_office_id", "timestamp")
+
+        rows = {}
+        for entry, next_timestamp in with_next_timestamps(histories):
+            office_id = OfficeDayRollup.office_of(entry)
+            if entry.timestamp >= end_dt or not office_id:
+                continue
+            key = (office_id, timezone.localdate(entry.timestamp))
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = OfficeDayRollup(
+                    office_id=office_id, date=key[1], department=departments.get(office_id, "")
+                )
+            field = OfficeDayRollup.ACTION_FIELDS.get(entry.action, "other_count")
+            setattr(row, field, getattr(row, field) + 1)
+            row.documents_held += 1
+            if next_timestamp is not None:
+                seconds = max(0, int((next_timestamp - entry.timestamp).total_seconds()))
+                row.stays_ended += 1
+                row.total_dwell_seconds += seconds
+                row.max_dwell_seconds = max(row.max_dwell_seconds, seconds)
+
+        OfficeDayRollup.objects.filter(date__gte=first_day, date__lt=end_day).delete()
+        OfficeDayRollup.objects.bulk_create(rows.values(), batch_size=1000)
+        return len(rows)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from GovFlowApp.models import Document, DocumentSearch
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the document search rows (title, description, tracking ID, sender "
+        "name, history notes) from the documents, a batch per transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options["batch_size"])
+        last_pk = total = 0
+        while True:
+            ids = list(
+                Document.objects.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                DocumentSearch.refresh(ids)
+            total += len(ids)
+            last_pk = ids[-1]
+            self.stdout.write(f"{total} documents indexed (up to id {last_pk})")
+
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt for {total} documents."))
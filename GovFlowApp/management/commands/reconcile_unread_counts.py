@@ -0,0 +1,24 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q
+
+from GovFlowApp.unread import store_unread_counts
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount every active user's unread notifications in one query and overwrite "
+        "the cached header badge counts. Run it from cron to repair any drift."
+    )
+
+    def handle(self, *args, **options):
+        counts = dict(
+            User.objects.filter(is_active=True).annotate(
+                unread=Count("notifications", filter=Q(notifications__is_read=False))
+            ).values_list("pk", "unread")
+        )
+        store_unread_counts(counts)
+        self.stdout.write(self.style.SUCCESS(
+            f"Reconciled unread counts for {len(counts)} users "
+            f"({sum(1 for n in counts.values() if n)} with unread notifications)."
+        ))
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-18 10:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GovFlowApp', '0008_document_routing_state'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['status', '-created_at'], name='document_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['current_office', 'status'], name='document_office_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['priority', '-created_at'], name='document_priority_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='documenthistory',
+            index=models.Index(fields=['document', 'action', 'timestamp'], name='history_doc_action_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='documenthistory',
+            index=models.Index(fields=['to_office', 'action', 'timestamp'], name='history_to_action_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['recipient', '-created_at'], name='notif_unread_recipient_idx'),
+        ),
+    ]
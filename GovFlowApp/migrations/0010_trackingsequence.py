@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-18 10:41
+
+from django.db import migrations, models
+
+
+def seed_sequences(apps, schema_editor):
+    Document = apps.get_model('GovFlowApp', 'Document')
+    TrackingSequence = apps.get_model('GovFlowApp', 'TrackingSequence')
+    last_numbers = {}
+    for tracking_id in Document.objects.values_list('tracking_id', flat=True):
+        try:
+            _, year, number = tracking_id.split('-')
+            year, number = int(year), int(number)
+        except ValueError:
+            continue
+        last_numbers[year] = max(last_numbers.get(year, 0), number)
+    TrackingSequence.objects.bulk_create([
+        TrackingSequence(year=year, last_number=number)
+        for year, number in last_numbers.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GovFlowApp', '0009_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackingSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField(unique=True)),
+                ('last_number', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_sequences, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.5 on 2026-10-18 11:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def mark_existing_ready(apps, schema_editor):
+    Document = apps.get_model('GovFlowApp', 'Document')
+    Document.objects.exclude(qr_code='').exclude(qr_code__isnull=True).update(qr_ready=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GovFlowApp', '0010_trackingsequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='qr_ready',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='QRCodeJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Running', 'Running'), ('Failed', 'Failed')], default='Pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='qr_jobs', to='GovFlowApp.document')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_after'], name='qrjob_status_run_after_idx')],
+            },
+        ),
+        migrations.RunPython(mark_existing_ready, reverse_code=migrations.RunPython.noop),
+    ]
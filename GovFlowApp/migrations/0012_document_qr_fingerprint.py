@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 11:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GovFlowApp', '0011_document_qr_ready_qrcodejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='qr_fingerprint',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
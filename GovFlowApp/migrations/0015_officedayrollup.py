@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GovFlowApp', '0014_reportartifact'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OfficeDayRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('department', models.CharField(blank=True, max_length=100)),
+                ('date', models.DateField()),
+                ('created_count', models.PositiveIntegerField(default=0)),
+                ('forwarded_count', models.PositiveIntegerField(default=0)),
+                ('received_count', models.PositiveIntegerField(default=0)),
+                ('returned_count', models.PositiveIntegerField(default=0)),
+                ('completed_count', models.PositiveIntegerField(default=0)),
+                ('other_count', models.PositiveIntegerField(default=0)),
+                ('documents_held', models.PositiveIntegerField(default=0)),
+                ('stays_ended', models.PositiveIntegerField(default=0)),
+                ('total_dwell_seconds', models.BigIntegerField(default=0)),
+                ('max_dwell_seconds', models.BigIntegerField(default=0)),
+                ('office', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dwell_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'office'], name='officedayrollup_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('office', 'date'), name='officedayrollup_unique_office_date')],
+            },
+        ),
+    ]
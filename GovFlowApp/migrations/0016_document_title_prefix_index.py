@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:52
+
+from django.db import migrations
+
+
+# Serves title__istartswith (UPPER("title"::text) LIKE UPPER('abc%')) for the
+# document typeahead. PostgreSQL only; other backends keep a plain scan.
+INDEX_NAME = 'document_title_upper_prefix_idx'
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = schema_editor.quote_name(apps.get_model('GovFlowApp', 'Document')._meta.db_table)
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON {table} (UPPER("title"::text) text_pattern_ops)'
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GovFlowApp', '0015_officedayrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, reverse_code=drop_index),
+    ]
@@ -0,0 +1,122 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:45
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# The full-text index over GovFlowApp_documentsearch depends on the backend
+# (see GovFlowApp/search.py):
+#  - PostgreSQL: a generated, weighted tsvector column with a GIN index.
+#  - SQLite: an external-content FTS5 table kept in step by triggers.
+# Other backends get neither and search falls back to icontains.
+PG_INDEX_NAME = 'document_search_vector_idx'
+FTS_TABLE = 'document_search_fts'
+FTS_COLUMNS = ['tracking_id', 'title', 'sender_name', 'description', 'notes']
+PG_WEIGHTS = {'tracking_id': 'A', 'title': 'A', 'sender_name': 'B', 'description': 'C', 'notes': 'D'}
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    table = apps.get_model('GovFlowApp', 'DocumentSearch')._meta.db_table
+    quoted = schema_editor.quote_name(table)
+
+    if vendor == 'postgresql':
+        vector = ' || '.join(
+            f"setweight(to_tsvector('simple', coalesce({column}, '')), '{weight}')"
+            for column, weight in PG_WEIGHTS.items()
+        )
+        schema_editor.execute(f'ALTER TABLE {quoted} ADD COLUMN vector tsvector GENERATED ALWAYS AS ({vector}) STORED')
+        schema_editor.execute(f'CREATE INDEX {PG_INDEX_NAME} ON {quoted} USING gin (vector)')
+
+    elif vendor == 'sqlite':
+        columns = ', '.join(FTS_COLUMNS)
+        new = ', '.join(f'new.{column}' for column in FTS_COLUMNS)
+        old = ', '.join(f'old.{column}' for column in FTS_COLUMNS)
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5({columns}, "
+            f"content='{table}', content_rowid='document_id')"
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {quoted} BEGIN '
+            f'INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.document_id, {new}); END'
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {quoted} BEGIN '
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.document_id, {old}); END"
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE ON {quoted} BEGIN '
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.document_id, {old}); "
+            f'INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.document_id, {new}); END'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        table = schema_editor.quote_name(apps.get_model('GovFlowApp', 'DocumentSearch')._meta.db_table)
+        schema_editor.execute(f'DROP INDEX IF EXISTS {PG_INDEX_NAME}')
+        schema_editor.execute(f'ALTER TABLE {table} DROP COLUMN IF EXISTS vector')
+    elif vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def backfill(apps, schema_editor):
+    Document = apps.get_model('GovFlowApp', 'Document')
+    DocumentHistory = apps.get_model('GovFlowApp', 'DocumentHistory')
+    DocumentSearch = apps.get_model('GovFlowApp', 'DocumentSearch')
+
+    last_pk = 0
+    while True:
+        documents = list(
+            Document.objects.filter(pk__gt=last_pk).order_by('pk').values_list(
+                'pk', 'tracking_id', 'title', 'description', 'sender__first_name', 'sender__last_name'
+            )[:1000]
+        )
+        if not documents:
+            break
+        ids = [row[0] for row in documents]
+        notes = defaultdict(list)
+        for document_id, note in DocumentHistory.objects.filter(
+            document_id__in=ids
+        ).exclude(note__isnull=True).exclude(note='').order_by('pk').values_list('document_id', 'note'):
+            notes[document_id].append(note)
+        DocumentSearch.objects.bulk_create([
+            DocumentSearch(
+                document_id=pk,
+                tracking_id=tracking_id,
+                title=title,
+                sender_name=f'{first_name} {last_name}'.strip(),
+                description=description or '',
+                notes='\n'.join(notes[pk]),
+            )
+            for pk, tracking_id, title, description, first_name, last_name in documents
+        ])
+        last_pk = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GovFlowApp', '0017_notification_kind_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSearch',
+            fields=[
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search', serialize=False, to='GovFlowApp.document')),
+                ('tracking_id', models.CharField(max_length=15)),
+                ('title', models.CharField(max_length=255)),
+                ('sender_name', models.CharField(blank=True, max_length=301)),
+                ('description', models.TextField(blank=True)),
+                ('notes', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.RunPython(create_search_index, reverse_code=drop_search_index),
+        migrations.RunPython(backfill, reverse_code=migrations.RunPython.noop),
+    ]
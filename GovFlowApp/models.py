@@ -1,14 +1,20 @@
-import qrcode
-from io import BytesIO
-from django.db import models
+import copy
+import hashlib
+from collections import defaultdict
+from datetime import timedelta
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Concat, Greatest
+from django.db.models.fields.files import FieldFile
 from django.contrib.auth.models import User
 from django.utils import timezone
-from django.core.files import File
 from django.db.models.signals import pre_save, post_delete, post_save
 from django.dispatch import receiver
-from PIL import Image
 from django.conf import settings
-import os
+from django.urls import reverse
+
+from .directory import bump_directory_version
+from .unread import adjust_unread
 
 
 class UserProfile(models.Model):
@@ -43,12 +49,79 @@ def create_user_profile(sender, instance, created, **kwargs):
         UserProfile.objects.create(user=instance)
 
 
+def is_login_stamp(update_fields):
+    # login() saves the user with update_fields=["last_login"]; nothing else changes
+    return update_fields is not None and set(update_fields) <= {"last_login"}
+
+
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
+def save_user_profile(sender, instance, update_fields=None, **kwargs):
+    if is_login_stamp(update_fields):
+        return
     if hasattr(instance, 'userprofile'):
         instance.userprofile.save()
 
 
+@receiver(post_save, sender=User)
+def refresh_sender_search_name(sender, instance, created, update_fields=None, **kwargs):
+    if created or is_login_stamp(update_fields):
+        return
+    name = DocumentSearch.sender_name_of(instance.first_name, instance.last_name)
+    DocumentSearch.objects.filter(document__sender=instance).exclude(sender_name=name).update(sender_name=name)
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=UserProfile)
+def invalidate_office_directory(sender, update_fields=None, **kwargs):
+    if sender is User and is_login_stamp(update_fields):
+        return
+    bump_directory_version()
+
+
+class TrackingSequence(models.Model):
+    """
+    Per-year counter behind the TRK-YYYY-NNNNN tracking IDs.
+    Numbers are handed out with a single UPDATE on the year's row, so concurrent
+    registrations queue on that row lock instead of racing on tracking_id.
+    """
+    year = models.PositiveIntegerField(unique=True)
+    last_number = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.year}: {self.last_number}"
+
+    @classmethod
+    def reserve(cls, count=1, year=None):
+        """Reserve `count` consecutive numbers for `year` and return them as a range."""
+        year = year or timezone.localdate().year
+        with transaction.atomic():
+            updated = cls.objects.filter(year=year).update(last_number=F("last_number") + count)
+            if not updated:
+                cls._start_year(year)
+                cls.objects.filter(year=year).update(last_number=F("last_number") + count)
+            last_number = cls.objects.filter(year=year).values_list("last_number", flat=True).get()
+        return range(last_number - count + 1, last_number + 1)
+
+    @classmethod
+    def next_tracking_ids(cls, count=1, year=None):
+        """Reserve a block of tracking IDs, e.g. for bulk registration."""
+        year = year or timezone.localdate().year
+        return [f"TRK-{year}-{number:05d}" for number in cls.reserve(count, year)]
+
+    @classmethod
+    def _start_year(cls, year):
+        # First registration of the year: continue after any IDs issued before the counter existed
+        last_id = Document.objects.filter(
+            tracking_id__startswith=f"TRK-{year}-"
+        ).aggregate(last=Max("tracking_id"))["last"]
+        start = int(last_id.rsplit("-", 1)[-1]) if last_id else 0
+        try:
+            with transaction.atomic():
+                cls.objects.create(year=year, last_number=start)
+        except IntegrityError:
+            pass  # another request created the row first
+
+
 class Document(models.Model):
     PRIORITY_CHOICES = [
         ("High", "Urgent"),
@@ -72,28 +145,185 @@ class Document(models.Model):
     priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default="Medium")
     description = models.TextField()
     qr_code = models.ImageField(upload_to='qr_codes/', blank=True, null=True)
+    qr_ready = models.BooleanField(default=False)  # set by the QR worker once the image exists
+    qr_fingerprint = models.CharField(max_length=64, blank=True)  # hash of the payload the current image encodes
 
     current_office = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="current_documents")
     created_at = models.DateTimeField(auto_now_add=True)
     received_at = models.DateTimeField(blank=True, null=True)
 
+    # Routing pointers kept in sync with DocumentHistory so the detail page and
+    # the routing views don't have to scan the history table.
+    last_forward = models.ForeignKey("DocumentHistory", on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    last_forwarded_at = models.DateTimeField(blank=True, null=True)
+    intended_recipient = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="incoming_documents")
+    previous_offices = models.JSONField(default=list, blank=True)  # ids of offices that routed the document
+
+    ROUTING_ACTIONS = ("Forwarded", "Returned", "Received")
+    ROUTING_FIELDS = ["last_forward", "last_forwarded_at", "intended_recipient", "received_at", "previous_offices"]
+    # Status and current office are printed in the QR code, so every forward,
+    # receive and return still re-renders it; only saves that leave these alone skip it
+    QR_PAYLOAD_FIELDS = {"tracking_id", "title", "sender", "priority", "status", "description", "current_office"}
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "-created_at"], name="document_status_created_idx"),
+            models.Index(fields=["current_office", "status"], name="document_office_status_idx"),
+            models.Index(fields=["priority", "-created_at"], name="document_priority_created_idx"),
+        ]
+
     def __str__(self):
         return f"{self.tracking_id} - {self.title}"
 
+    @property
+    def is_retractable(self):
+        """True if the last forward exists and has not been received since."""
+        if not self.last_forward_id:
+            return False
+        return not (self.received_at and self.received_at >= self.last_forwarded_at)
+
+    def apply_routing_entry(self, entry):
+        """
+        Fold a single history entry into the routing pointers.
+        Returns the list of routing fields that changed.
+        """
+        changed = []
+        if entry.action == "Forwarded":
+            self.last_forward = entry
+            self.last_forwarded_at = entry.timestamp
+            changed += ["last_forward", "last_forwarded_at"]
+        if entry.action in ("Forwarded", "Returned"):
+            self.intended_recipient_id = entry.to_office_id
+            changed.append("intended_recipient")
+        if entry.action == "Retracted":
+            # The forward was withdrawn: nobody can receive the document until it is routed again
+            self.intended_recipient_id = None
+            changed.append("intended_recipient")
+        if entry.action == "Received":
+            self.received_at = entry.timestamp
+            changed.append("received_at")
+        if entry.action in self.ROUTING_ACTIONS and entry.from_office_id \
+                and entry.from_office_id not in self.previous_offices:
+            self.previous_offices = self.previous_offices + [entry.from_office_id]
+            changed.append("previous_offices")
+        return changed
+
+    def refresh_routing_state(self):
+        """
+        Rebuild the routing pointers from the full history (in memory only).
+        Used by the backfill command and when a history entry is rewritten.
+        """
+        self.last_forward = None
+        self.last_forwarded_at = None
+        self.intended_recipient = None
+        self.received_at = None
+        self.previous_offices = []
+        # history.all() so a prefetch_related("history") is reused
+        for entry in sorted(self.history.all(), key=lambda e: (e.timestamp, e.pk)):
+            self.apply_routing_entry(entry)
+
+    def save_routing_state(self, fields=None):
+        """Write the routing pointers with a plain UPDATE (no QR regeneration)."""
+        fields = fields or self.ROUTING_FIELDS
+        values = {}
+        for name in fields:
+            attname = self._meta.get_field(name).attname
+            values[attname] = getattr(self, attname)
+        Document.objects.filter(pk=self.pk).update(**values)
+        self.remember_loaded_values(values)
+
+    # --- Dirty-field tracking -------------------------------------------
+    # Values as last read from / written to the database, keyed by attname.
+    # Lets save() skip no-op saves and narrow bare saves to what changed.
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = copy.deepcopy(dict(zip(field_names, values)))
+        return instance
+
+    def _tracked_value(self, attname):
+        value = getattr(self, attname)
+        if isinstance(value, FieldFile):
+            return value.name
+        return value
+
+    def remember_loaded_values(self, attnames=None):
+        if attnames is None:
+            attnames = [f.attname for f in self._meta.concrete_fields]
+        loaded = getattr(self, "_loaded_values", None)
+        if loaded is None:
+            loaded = self._loaded_values = {}
+        for attname in attnames:
+            loaded[attname] = copy.deepcopy(self._tracked_value(attname))
+
+    def get_dirty_fields(self):
+        """
+        Names of the concrete fields changed since load, or None if the
+        instance was never loaded from the database.
+        """
+        loaded = getattr(self, "_loaded_values", None)
+        if loaded is None:
+            return None
+        return [
+            f.name for f in self._meta.concrete_fields
+            if f.attname in loaded and self._tracked_value(f.attname) != loaded[f.attname]
+        ]
+
     def save(self, *args, **kwargs):
         # Generate tracking ID if not set
         if not self.tracking_id:
-            current_year = timezone.now().year
-            last_doc = Document.objects.filter(tracking_id__startswith=f"TRK-{current_year}").order_by("id").last()
-            next_number = int(last_doc.tracking_id[-5:]) + 1 if last_doc else 1
-            self.tracking_id = f"TRK-{current_year}-{next_number:05d}"
+            self.tracking_id = TrackingSequence.next_tracking_ids()[0]
 
         # Set current_office automatically if not set
-        if not self.current_office:
-            self.current_office = self.sender  # default to sender
+        if not self.current_office_id:
+            self.current_office_id = self.sender_id  # default to sender
+
+        # A bare save() on a loaded instance only writes the fields that changed
+        if not self._state.adding and not args and kwargs.get("update_fields") is None \
+                and not kwargs.get("force_insert"):
+            dirty = self.get_dirty_fields()
+            if dirty is not None:
+                if not dirty:
+                    return  # nothing changed
+                kwargs["update_fields"] = dirty
+
+        super().save(*args, **kwargs)
 
-        # Generate QR code before saving
-        qr_data = (
+        update_fields = kwargs.get("update_fields")
+        self.remember_loaded_values(
+            None if update_fields is None
+            else [self._meta.get_field(name).attname for name in update_fields]
+        )
+
+        # QR images are served on demand by the document_qr view. Stored PNG files are
+        # optional and rendered by the background worker (manage.py process_qr_jobs),
+        # only when the encoded data actually changed.
+        if settings.QR_CODE_FILES and self.qr_is_stale(kwargs.get("update_fields")):
+            QRCodeJob.enqueue(self)
+
+    @property
+    def qr_available(self):
+        return not settings.QR_CODE_FILES or (self.qr_ready and bool(self.qr_code))
+
+    @property
+    def qr_url(self):
+        if settings.QR_CODE_FILES:
+            return self.qr_code.url if self.qr_code else ""
+        # Versioned by payload so the response can be cached forever
+        version = self.compute_qr_fingerprint()[:16]
+        return f"{reverse('document_qr', args=[self.tracking_id])}?v={version}"
+
+    def qr_is_stale(self, update_fields=None):
+        if update_fields is not None and not self.QR_PAYLOAD_FIELDS.intersection(update_fields):
+            return False
+        return self.compute_qr_fingerprint() != self.qr_fingerprint
+
+    def compute_qr_fingerprint(self):
+        return hashlib.sha256(self.qr_payload().encode("utf-8")).hexdigest()
+
+    def qr_payload(self):
+        return (
             f"Tracking ID: {self.tracking_id}\n"
             f"Title: {self.title}\n"
             f"Sender: {self.sender.get_full_name() if self.sender else 'N/A'}\n"
@@ -103,46 +333,8 @@ class Document(models.Model):
             f"Current Office: {self.current_office.get_full_name() if self.current_office else 'N/A'}"
         )
 
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_H,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(qr_data)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white").convert('RGB')
-
-        # Optional: Add logo in the center
-        logo_path = os.path.join(settings.BASE_DIR, 'GovFlowApp', 'static', 'img', 'mharsmc.png')
-        if os.path.exists(logo_path):
-            logo = Image.open(logo_path)
-            # Resize logo
-            qr_width, qr_height = img.size
-            factor = 4  # logo size ratio
-            logo_size = qr_width // factor
-            logo.thumbnail((logo_size, logo_size), Image.Resampling.LANCZOS)
-            # Center the logo
-            pos = ((qr_width - logo.width) // 2, (qr_height - logo.height) // 2)
-            img.paste(logo, pos, mask=logo if logo.mode == 'RGBA' else None)
-
-
-        # Save QR to memory
-        buffer = BytesIO()
-        img.save(buffer, format="PNG")
-        file_name = f"QR_{self.tracking_id}.png"
-
-        # Delete old QR if exists
-        if self.qr_code:
-            self.qr_code.delete(save=False)
-
-        # Save new QR
-        self.qr_code.save(file_name, File(buffer), save=False)
-        buffer.close()
-
-        super().save(*args, **kwargs)
-
     
+    @transaction.atomic
     def mark_completed(self, completed_by=None, note=None):
         """
         Mark the document as completed.
@@ -166,6 +358,7 @@ class Document(models.Model):
 
 
     # Forward document to another location
+    @transaction.atomic
     def forward_to(self, new_office, forwarded_by=None, note=None):
         """
         Forward the document to a new office.
@@ -187,37 +380,40 @@ class Document(models.Model):
             performed_by=forwarded_by or self.sender
         )
 
-    # Retract document to sender
-    def retract_document(self, retracted_by=None, note=None):
+    # Retract the last forward while it is still in transit
+    @transaction.atomic
+    def retract_document(self, retracted_by, note=None):
         """
-        Retract the document to the sender if it has been forwarded but not received.
+        Withdraw the last forward before it is received.
+        - the forward's history entry is rewritten as 'Retracted' (not deleted).
+        - the document stays with the retracting office and goes back to 'Pending'.
+        - the routing pointers are rebuilt, so nobody can receive it any more.
         """
-        # Check if document has a forward in transit
-        last_forward = self.history.filter(action="Forwarded").order_by("-timestamp").first()
+        last_forward = self.last_forward
         if not last_forward:
             raise ValueError("Document has not been forwarded yet.")
 
         # Cannot retract if it has already been received
-        last_receive = self.history.filter(action="Received").order_by("-timestamp").first()
-        if last_receive and last_receive.timestamp > last_forward.timestamp:
+        if not self.is_retractable:
             raise ValueError("Cannot retract a document that has been received.")
 
-        # Retract: set current office back to sender
-        self.current_office = self.sender
-        self.status = "Pending"  # or "In Transit" depending on your workflow
-        self.save(update_fields=["current_office", "status"])
+        last_forward.action = "Retracted"
+        last_forward.note = note or f"Retracted by {retracted_by.get_full_name()}"
+        last_forward.save(update_fields=["action", "note"])
+        # post_save handlers only act on new entries; the rewritten one changes
+        # the rollup counters and cached reports too
+        OfficeDayRollup.record_action_change(last_forward, "Forwarded")
+        transaction.on_commit(lambda: ReportArtifact.invalidate_for([last_forward]))
+        # The note was replaced, and add_note() only appends
+        DocumentSearch.refresh([self.pk])
 
-        # Log in history
-        DocumentHistory.objects.create(
-            document=self,
-            action="Retracted",
-            from_office=last_forward.to_office,
-            to_office=self.sender,
-            performed_by=retracted_by,
-            note=note or "Document retracted to sender"
-        )
+        self.current_office = retracted_by
+        self.status = "Pending"
+        self.refresh_routing_state()
+        self.save()
 
     # Mark document as received
+    @transaction.atomic
     def mark_received(self, receiving_office, received_by=None, note=None):
         """
         Mark the document as received at the receiving office.
@@ -243,6 +439,94 @@ class Document(models.Model):
         )
 
 
+    # --- Bulk transitions ---------------------------------------------------
+    # Set-based versions of the transition methods for batch screens: one bulk
+    # INSERT of history entries and one bulk UPDATE of the documents.
+
+    @classmethod
+    @transaction.atomic
+    def bulk_mark_received(cls, documents, receiving_office, received_by=None, note=None):
+        """Set-based mark_received(). Returns the created history entries."""
+        entries = [
+            DocumentHistory(
+                document=document,
+                action="Received",
+                from_office_id=document.current_office_id,  # log the previous office
+                to_office=receiving_office,
+                note=note,
+                performed_by=received_by
+            )
+            for document in documents
+        ]
+        for document in documents:
+            document.current_office = receiving_office
+            document.status = "Received"
+        return cls._bulk_record(documents, entries, ["current_office", "status"])
+
+    @classmethod
+    @transaction.atomic
+    def bulk_forward(cls, documents, new_office, forwarded_by, note=None):
+        """Set-based forward_to(); current_office stays with the sender until received."""
+        entries = [
+            DocumentHistory(
+                document=document,
+                action="Forwarded",
+                from_office_id=document.current_office_id,
+                to_office=new_office,
+                note=note,
+                performed_by=forwarded_by
+            )
+            for document in documents
+        ]
+        for document in documents:
+            document.status = "In Transit"
+        return cls._bulk_record(documents, entries, ["status"])
+
+    @classmethod
+    @transaction.atomic
+    def bulk_return(cls, documents, return_to_office, returned_by, note=None):
+        """Set-based version of the return view: hand back to a previous office, in transit."""
+        entries = [
+            DocumentHistory(
+                document=document,
+                action="Returned",
+                from_office_id=document.current_office_id,
+                to_office=return_to_office,
+                note=note,
+                performed_by=returned_by
+            )
+            for document in documents
+        ]
+        for document in documents:
+            document.current_office = return_to_office
+            document.status = "In Transit"
+        return cls._bulk_record(documents, entries, ["current_office", "status"])
+
+    @classmethod
+    def _bulk_record(cls, documents, entries, fields):
+        DocumentHistory.objects.bulk_create(entries)
+
+        # bulk_create skips post_save, so fold the entries into the routing pointers here
+        for document, entry in zip(documents, entries):
+            document.apply_routing_entry(entry)
+
+        fields = fields + cls.ROUTING_FIELDS
+        cls.objects.bulk_update(documents, fields, batch_size=500)
+        attnames = [cls._meta.get_field(name).attname for name in fields]
+        for document in documents:
+            document.remember_loaded_values(attnames)
+
+        if settings.QR_CODE_FILES:
+            QRCodeJob.objects.bulk_create([
+                QRCodeJob(document=document) for document in documents if document.qr_is_stale()
+            ])
+        OfficeDayRollup.record(entries)
+        if any(entry.note for entry in entries):
+            DocumentSearch.refresh([document.pk for document in documents])
+        transaction.on_commit(lambda: ReportArtifact.invalidate_for(entries))
+        return entries
+
+    @transaction.atomic
     def return_document(self, return_to_office, returned_by=None, note=None):
         old_office = self.current_office
         self.current_office = return_to_office
@@ -259,6 +543,7 @@ class Document(models.Model):
         )
 
 
+    @transaction.atomic
     def add_status_update(self, by_user, note):
         if by_user != self.current_office:
             raise PermissionError("Only the current document holder can update status.")
@@ -275,14 +560,20 @@ class Document(models.Model):
 # Signal to delete old QR code when updating
 @receiver(pre_save, sender=Document)
 def delete_old_qr_code_file(sender, instance, **kwargs):
+    if not settings.QR_CODE_FILES:
+        return  # QR codes are served on demand; no file to replace
     if not instance.pk:
         return  # skip if new instance
-    try:
-        old_instance = Document.objects.get(pk=instance.pk)
-    except Document.DoesNotExist:
-        return
-    if old_instance.qr_code and old_instance.qr_code != instance.qr_code:
-        old_instance.qr_code.delete(save=False)
+    loaded = getattr(instance, "_loaded_values", None)
+    if loaded is not None and "qr_code" in loaded:
+        old_name = loaded["qr_code"]  # no need to re-fetch the row
+    else:
+        try:
+            old_name = Document.objects.values_list("qr_code", flat=True).get(pk=instance.pk)
+        except Document.DoesNotExist:
+            return
+    if old_name and old_name != instance.qr_code.name:
+        instance.qr_code.storage.delete(old_name)
 
 # Signal to delete QR code file when deleting the Document
 @receiver(post_delete, sender=Document)
@@ -290,6 +581,51 @@ def delete_qr_code_file(sender, instance, **kwargs):
     if instance.qr_code:
         instance.qr_code.delete(save=False)
 
+class QRCodeJob(models.Model):
+    """
+    Local, DB-backed queue of QR code renders, processed by
+    ``manage.py process_qr_jobs``. Failed renders are retried with backoff.
+    """
+    STATUS_CHOICES = [
+        ("Pending", "Pending"),
+        ("Running", "Running"),
+        ("Failed", "Failed"),
+    ]
+    MAX_ATTEMPTS = 5
+
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name="qr_jobs")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="Pending")
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_after"], name="qrjob_status_run_after_idx"),
+        ]
+
+    def __str__(self):
+        return f"QR for {self.document_id} ({self.status})"
+
+    @classmethod
+    def enqueue(cls, document):
+        # One pending render per document is enough; it reads the latest data when it runs
+        if not cls.objects.filter(document=document, status="Pending").exists():
+            cls.objects.create(document=document)
+
+    def retry_later(self, error):
+        """Record a failed attempt and reschedule with exponential backoff."""
+        self.last_error = error
+        if self.attempts >= self.MAX_ATTEMPTS:
+            self.status = "Failed"
+        else:
+            self.status = "Pending"
+            self.run_after = timezone.now() + timedelta(seconds=30 * 2 ** (self.attempts - 1))
+        self.save(update_fields=["status", "last_error", "run_after", "updated_at"])
+
+
 class DocumentHistory(models.Model):
     ACTION_CHOICES = [
         ("Pending", "Pending"),
@@ -309,6 +645,12 @@ class DocumentHistory(models.Model):
     performed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["document", "action", "timestamp"], name="history_doc_action_ts_idx"),
+            models.Index(fields=["to_office", "action", "timestamp"], name="history_to_action_ts_idx"),
+        ]
+
     def __str__(self):
         return f"{self.document.tracking_id} - {self.action} at {self.timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
 
@@ -324,17 +666,398 @@ def create_initial_history(sender, instance, created, **kwargs):
             performed_by=instance.sender
         )
 
+# Keep the routing pointers on Document in step with every new history entry
+@receiver(post_save, sender=DocumentHistory)
+def update_routing_state(sender, instance, created, **kwargs):
+    if not created:
+        return
+    document = instance.document
+    changed = document.apply_routing_entry(instance)
+    if changed:
+        document.save_routing_state(changed)
+
+
+@receiver(post_save, sender=DocumentHistory)
+def index_history_note(sender, instance, created, **kwargs):
+    if created and instance.note:
+        DocumentSearch.add_note(instance.document_id, instance.note)
+
+
+@receiver(post_save, sender=DocumentHistory)
+def update_office_day_rollup(sender, instance, created, **kwargs):
+    if created:
+        OfficeDayRollup.record([instance])
+
+@receiver(post_save, sender=DocumentHistory)
+def invalidate_cached_reports(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: ReportArtifact.invalidate_for([instance]))
+
 class Notification(models.Model):
     recipient = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="notifications"
     )
     message = models.TextField()
     url = models.CharField(max_length=255, blank=True)
+    kind = models.CharField(max_length=30, blank=True)  # events of one kind can be coalesced
+    count = models.PositiveIntegerField(default=1)  # documents of the events merged into this row
     is_read = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True)  # moved forward when an event is merged in
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Only unread rows are ever filtered on; keep the index small
+            models.Index(
+                fields=["recipient", "-created_at"],
+                condition=models.Q(is_read=False),
+                name="notif_unread_recipient_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"To {self.recipient} - {self.message[:30]}"
+
+
+# Keep the cached unread badge counts in step; bulk_create() and
+# queryset.update() skip these, so their callers adjust the counts themselves
+@receiver(post_save, sender=Notification)
+def count_new_notification(sender, instance, created, **kwargs):
+    if created and not instance.is_read:
+        adjust_unread({instance.recipient_id: 1})
+
+@receiver(post_delete, sender=Notification)
+def uncount_deleted_notification(sender, instance, **kwargs):
+    if not instance.is_read:
+        adjust_unread({instance.recipient_id: -1})
+
+
+class ReportJob(models.Model):
+    """
+    A PDF report rendered in the background by ``manage.py process_report_jobs``.
+    The finished file is kept as ``artifact`` and downloaded from there.
+    """
+    STATUS_CHOICES = [
+        ("Pending", "Pending"),
+        ("Running", "Running"),
+        ("Done", "Done"),
+        ("Failed", "Failed"),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="report_jobs")
+    report_type = models.CharField(max_length=20)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="Pending")
+    progress = models.PositiveSmallIntegerField(default=0)
+    artifact = models.FileField(upload_to="reports/", blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="reportjob_status_created_idx"),
+            models.Index(fields=["user", "status"], name="reportjob_user_status_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.report_type} report for {self.user} ({self.status})"
+
+    def set_progress(self, percent):
+        # Also serves as the heartbeat that keeps a running job from looking abandoned
+        self.progress = percent
+        ReportJob.objects.filter(pk=self.pk).update(progress=percent, updated_at=timezone.now())
+
+    def finish(self):
+        self.status = "Done"
+        self.progress = 100
+        self.error = ""
+        self.finished_at = timezone.now()
+        self.save(update_fields=["status", "progress", "artifact", "error", "finished_at", "updated_at"])
+
+    def fail(self, error):
+        self.status = "Failed"
+        self.error = error
+        self.finished_at = timezone.now()
+        self.save(update_fields=["status", "error", "finished_at", "updated_at"])
+
+
+class ReportArtifact(models.Model):
+    """
+    A rendered report file, cached per (user, report_type, period, format).
+
+    Artifacts of closed periods have no expiry; open periods expire after
+    REPORT_CACHE_TTL. Either kind is dropped when a history entry lands that
+    changes the report (see invalidate_for). Files are content-addressed, so
+    their name doubles as the download ETag.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="report_artifacts")
+    report_type = models.CharField(max_length=20)
+    period = models.CharField(max_length=50)
+    format = models.CharField(max_length=10)
+    period_start = models.DateTimeField(null=True, blank=True)
+    period_end = models.DateTimeField(null=True, blank=True)
+    document = models.ForeignKey(
+        Document, on_delete=models.CASCADE, null=True, blank=True, related_name="report_artifacts"
+    )
+    file = models.FileField(upload_to="report_cache/", max_length=200)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "report_type", "period", "format"], name="reportartifact_unique_key"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["period_start", "period_end"], name="reportartifact_period_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.report_type} {self.period} {self.format} for {self.user}"
+
+    @property
+    def is_fresh(self):
+        return self.expires_at is None or self.expires_at > timezone.now()
+
+    @classmethod
+    def invalidate_for(cls, entries):
+        """
+        Drop artifacts whose report changes because of new history `entries`:
+        periods containing the entries, or the documents' previous entries
+        (whose "days stayed" was still running), and the documents' own reports.
+        """
+        if not entries:
+            return
+        document_ids = {entry.document_id for entry in entries}
+        oldest = min(entry.timestamp for entry in entries)
+        newest = max(entry.timestamp for entry in entries)
+        previous = DocumentHistory.objects.filter(
+            document_id__in=document_ids, timestamp__lt=oldest
+        ).values("document_id").annotate(last=Max("timestamp"))
+        since = min((row["last"] for row in previous), default=oldest)
+
+        stale = cls.objects.filter(
+            models.Q(period_start__lte=newest, period_end__gt=since) |
+            models.Q(document_id__in=document_ids)
+        )
+        names = set(stale.values_list("file", flat=True))
+        if not names:
+            return
+        stale.delete()
+        cls.delete_unreferenced_files(names)
+
+    @classmethod
+    def delete_unreferenced_files(cls, names):
+        # Identical reports share one content-addressed file
+        still_used = set(cls.objects.filter(file__in=names).values_list("file", flat=True))
+        storage = cls._meta.get_field("file").storage
+        for name in names - still_used:
+            storage.delete(name)
+
+
+class OfficeDayRollup(models.Model):
+    """
+    Per office and day: history entries by action and how long documents sat
+    there. An entry starts a stay at its office (to_office, else from_office)
+    that ends at the document's next entry; the stay's seconds are added to
+    the day it started once that next entry is written. Kept up to date as
+    history is written; ``manage.py rebuild_dwell_rollup`` recomputes it.
+    """
+    # action -> counter field; anything else is counted in other_count
+    ACTION_FIELDS = {
+        "Pending": "created_count",
+        "Forwarded": "forwarded_count",
+        "Received": "received_count",
+        "Returned": "returned_count",
+        "Completed": "completed_count",
+    }
+    COUNT_FIELDS = list(ACTION_FIELDS.values()) + ["other_count"]
+
+    office = models.ForeignKey(User, on_delete=models.CASCADE, related_name="dwell_rollups")
+    department = models.CharField(max_length=100, blank=True)
+    date = models.DateField()
+    created_count = models.PositiveIntegerField(default=0)
+    forwarded_count = models.PositiveIntegerField(default=0)
+    received_count = models.PositiveIntegerField(default=0)
+    returned_count = models.PositiveIntegerField(default=0)
+    completed_count = models.PositiveIntegerField(default=0)
+    other_count = models.PositiveIntegerField(default=0)
+    documents_held = models.PositiveIntegerField(default=0)  # stays started that day
+    stays_ended = models.PositiveIntegerField(default=0)  # stays of that day with a known length
+    total_dwell_seconds = models.BigIntegerField(default=0)
+    max_dwell_seconds = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["office", "date"], name="officedayrollup_unique_office_date"),
+        ]
+        indexes = [
+            models.Index(fields=["date", "office"], name="officedayrollup_date_idx"),
+        ]
 
     def __str__(self):
-        return f"To {self.recipient} - {self.message[:30]}"
\ No newline at end of file
+        return f"{self.office} on {self.date}"
+
+    @property
+    def average_dwell_seconds(self):
+        return self.total_dwell_seconds // self.stays_ended if self.stays_ended else None
+
+    @staticmethod
+    def office_of(entry):
+        return entry.to_office_id or entry.from_office_id
+
+    @classmethod
+    def record(cls, entries):
+        """
+        Fold newly written history entries into the rollup: count each entry
+        on its own office/day and close the stay its document's previous entry started.
+        """
+        entries = [entry for entry in entries if entry.pk]
+        if not entries:
+            return
+        previous_ids = dict(
+            DocumentHistory.objects.filter(pk__in=[entry.pk for entry in entries]).annotate(
+                previous_id=Subquery(
+                    DocumentHistory.objects.filter(
+                        document_id=OuterRef("document_id"), pk__lt=OuterRef("pk")
+                    ).order_by("-timestamp", "-id").values("id")[:1]
+                )
+            ).values_list("pk", "previous_id")
+        )
+        previous = DocumentHistory.objects.only(
+            "timestamp", "from_office_id", "to_office_id"
+        ).in_bulk([pk for pk in previous_ids.values() if pk])
+
+        buckets = {}  # (office id, date) -> increments
+
+        def bucket(office_id, timestamp):
+            key = (office_id, timezone.localdate(timestamp))
+            return buckets.setdefault(key, {"counts": {}, "held": 0, "ended": 0, "total": 0, "max": 0})
+
+        for entry in entries:
+            office_id = cls.office_of(entry)
+            if office_id:
+                increments = bucket(office_id, entry.timestamp)
+                field = cls.ACTION_FIELDS.get(entry.action, "other_count")
+                increments["counts"][field] = increments["counts"].get(field, 0) + 1
+                increments["held"] += 1
+
+            before = previous.get(previous_ids.get(entry.pk))
+            if before is not None and cls.office_of(before):
+                seconds = max(0, int((entry.timestamp - before.timestamp).total_seconds()))
+                increments = bucket(cls.office_of(before), before.timestamp)
+                increments["ended"] += 1
+                increments["total"] += seconds
+                increments["max"] = max(increments["max"], seconds)
+
+        for (office_id, date), increments in buckets.items():
+            cls.bump(office_id, date, increments)
+
+    @classmethod
+    def record_action_change(cls, entry, old_action):
+        """Move an entry rewritten in place (a retracted forward) from its old action's counter to the new one."""
+        old_field = cls.ACTION_FIELDS.get(old_action, "other_count")
+        new_field = cls.ACTION_FIELDS.get(entry.action, "other_count")
+        office_id = cls.office_of(entry)
+        if old_field == new_field or not office_id:
+            return
+        cls.objects.filter(office_id=office_id, date=timezone.localdate(entry.timestamp)).update(**{
+            old_field: Greatest(F(old_field) - 1, 0),
+            new_field: F(new_field) + 1,
+        })
+
+    @classmethod
+    def bump(cls, office_id, date, increments):
+        updates = {field: F(field) + count for field, count in increments["counts"].items()}
+        updates.update(
+            documents_held=F("documents_held") + increments["held"],
+            stays_ended=F("stays_ended") + increments["ended"],
+            total_dwell_seconds=F("total_dwell_seconds") + increments["total"],
+            max_dwell_seconds=Greatest(F("max_dwell_seconds"), increments["max"]),
+        )
+        if cls.objects.filter(office_id=office_id, date=date).update(**updates):
+            return
+        row = cls(
+            office_id=office_id,
+            date=date,
+            department=UserProfile.objects.filter(user_id=office_id).values_list("department", flat=True).first() or "",
+            documents_held=increments["held"],
+            stays_ended=increments["ended"],
+            total_dwell_seconds=increments["total"],
+            max_dwell_seconds=increments["max"],
+            **increments["counts"],
+        )
+        try:
+            with transaction.atomic():
+                row.save(force_insert=True)
+        except IntegrityError:
+            # Another writer created the row first
+            cls.objects.filter(office_id=office_id, date=date).update(**updates)
+
+
+class DocumentSearch(models.Model):
+    """
+    The searchable text of one document: its own fields, its sender's name and
+    its history notes, kept in step by the signals below. Migration 0018 adds
+    the backend's full-text index over these columns (a weighted tsvector
+    column with a GIN index on PostgreSQL, an FTS5 table on SQLite); the
+    queries live in search.py.
+    """
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, primary_key=True, related_name="search")
+    tracking_id = models.CharField(max_length=15)
+    title = models.CharField(max_length=255)
+    sender_name = models.CharField(max_length=301, blank=True)
+    description = models.TextField(blank=True)
+    notes = models.TextField(blank=True)
+
+    SEARCH_FIELDS = ["tracking_id", "title", "sender_name", "description", "notes"]
+    # Document fields copied into the row (plus sender, for the name)
+    SOURCE_FIELDS = {"tracking_id", "title", "description", "sender"}
+
+    def __str__(self):
+        return f"Search text for {self.tracking_id}"
+
+    @staticmethod
+    def sender_name_of(first_name, last_name):
+        return f"{first_name} {last_name}".strip()
+
+    @classmethod
+    def refresh(cls, document_ids):
+        """Rebuild the rows of `document_ids` from the documents and their history."""
+        document_ids = list(document_ids)
+        notes = defaultdict(list)
+        for document_id, note in DocumentHistory.objects.filter(
+            document_id__in=document_ids
+        ).exclude(note__isnull=True).exclude(note="").order_by("pk").values_list("document_id", "note"):
+            notes[document_id].append(note)
+
+        rows = [
+            cls(
+                document_id=pk,
+                tracking_id=tracking_id,
+                title=title,
+                sender_name=cls.sender_name_of(first_name, last_name),
+                description=description or "",
+                notes="\n".join(notes[pk]),
+            )
+            for pk, tracking_id, title, description, first_name, last_name in Document.objects.filter(
+                pk__in=document_ids
+            ).values_list("pk", "tracking_id", "title", "description", "sender__first_name", "sender__last_name")
+        ]
+        cls.objects.bulk_create(
+            rows, update_conflicts=True, unique_fields=["document"], update_fields=cls.SEARCH_FIELDS, batch_size=500
+        )
+
+    @classmethod
+    def add_note(cls, document_id, note):
+        # History is append-only, so a new note is appended rather than rebuilding the row
+        cls.objects.filter(document_id=document_id).update(notes=Concat("notes", Value("\n" + note)))
+
+
+@receiver(post_save, sender=Document)
+def refresh_document_search(sender, instance, created, update_fields=None, **kwargs):
+    if created or update_fields is None or DocumentSearch.SOURCE_FIELDS & set(update_fields):
+        DocumentSearch.refresh([instance.pk])
@@ -0,0 +1,108 @@
+"""
+Notification fan-out.
+
+notify() and notify_many() only queue notifications; they are written once
+the current transaction commits, so the INSERTs never run while a routing
+transition still holds its row locks, and a transition that rolls back
+notifies nobody. Each batch is written with one bulk INSERT.
+
+Events with a `kind` are coalesced: an event goes into the recipient's newest
+unread notification of the same kind and url created within the last
+NOTIFICATION_COALESCE_WINDOW seconds. That row adds the event's count (the
+documents it is about) and moves back to the top of the list. "forwarded"
+and "returned" notifications all link to the receive page, so a busy office
+gets one running notification instead of dozens, re-worded from the running
+total ("12 documents were forwarded to you."); per-document links only merge
+repeats about the same document and keep the latest message.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import CharField, F, Value
+from django.db.models.functions import Cast, Concat
+from django.utils import timezone
+
+from .events import publish
+from .models import Notification
+from .unread import adjust_unread
+
+
+# Kinds whose notifications merge events about different documents: a row
+# holding more than one is re-worded as "<count><suffix>"
+SUMMARY_SUFFIXES = {
+    "forwarded": " documents were forwarded to you.",
+    "returned": " documents were returned to you.",
+}
+
+
+def coalesce_window():
+    return timedelta(seconds=getattr(settings, "NOTIFICATION_COALESCE_WINDOW", 600))
+
+
+def notify(user, message, url="", kind="", count=1):
+    """Queue one notification; `count` is how many documents the message is about."""
+    if user:
+        transaction.on_commit(lambda: deliver([(user.pk, message, url, count)], kind))
+
+
+def notify_many(notifications, kind=""):
+    """Bulk version of notify(): takes (user, message, url) tuples, written in one INSERT after commit."""
+    events = [(user.pk, message, url, 1) for user, message, url in notifications if user]
+    if events:
+        transaction.on_commit(lambda: deliver(events, kind))
+
+
+@transaction.atomic
+def deliver(events, kind=""):
+    """Write (recipient_id, message, url, count) events now, coalescing them if `kind` is set."""
+    window = coalesce_window()
+    coalesce = bool(kind) and window > timedelta(0)
+    suffix = SUMMARY_SUFFIXES.get(kind)
+
+    # Fold the batch itself first: {key: [recipient_id, url, message, count]}
+    pending = {}
+    for position, (recipient_id, message, url, count) in enumerate(events):
+        key = (recipient_id, url) if coalesce else position
+        if key in pending:
+            pending[key][3] += count
+            pending[key][2] = f"{pending[key][3]}{suffix}" if suffix else message
+        else:
+            pending[key] = [recipient_id, url, message, count]
+
+    now = timezone.now()
+    merged = set()
+    if coalesce:
+        # Oldest first, so the newest row per (recipient, url) wins
+        candidates = Notification.objects.filter(
+            recipient_id__in={recipient_id for recipient_id, _ in pending},
+            kind=kind,
+            is_read=False,
+            created_at__gte=now - window,
+        ).order_by("created_at").values_list("recipient_id", "url", "pk")
+        existing = {(recipient_id, url): pk for recipient_id, url, pk in candidates}
+
+        for key, (recipient_id, url, message, count) in list(pending.items()):
+            pk = existing.get(key)
+            if suffix:
+                # Worded from the merged total, computed in the same UPDATE
+                message = Concat(Cast(F("count") + count, CharField()), Value(suffix))
+            # Conditional, so a notification read in the meantime is left alone
+            if pk and Notification.objects.filter(pk=pk, is_read=False).update(
+                message=message, count=F("count") + count, created_at=now
+            ):
+                merged.add(recipient_id)
+                del pending[key]
+
+    created = Notification.objects.bulk_create([
+        Notification(recipient_id=recipient_id, message=message, url=url, kind=kind, count=count)
+        for recipient_id, url, message, count in pending.values()
+    ])
+
+    # bulk_create() and update() send no signals: count the new rows and wake
+    # the streams of users whose existing notification changed
+    adjust_unread(Counter(n.recipient_id for n in created))
+    if merged:
+        transaction.on_commit(lambda: publish(merged))
+    return created
@@ -0,0 +1,208 @@
+"""
+QR code rendering for documents.
+
+Rendering is slow (ERROR_CORRECT_H), so it never runs in Document.save().
+Images are served on demand by the ``document_qr`` view from an in-process
+LRU and a content-addressed disk cache (pruned by ``manage.py
+prune_qr_cache``). With ``QR_CODE_FILES`` enabled, the background worker
+(``manage.py process_qr_jobs``) also keeps a PNG per document in MEDIA_ROOT.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from functools import lru_cache
+from io import BytesIO
+
+import qrcode
+import qrcode.image.svg
+from django.conf import settings
+from django.core.files import File
+from PIL import Image
+
+
+# The logo is not shipped with the repository; codes render without one unless
+# the deployment puts the file here
+LOGO_PATH = os.path.join(settings.BASE_DIR, 'GovFlowApp', 'static', 'img', 'mharsmc.png')
+
+# Module size in pixels for each size the endpoint accepts
+QR_SIZES = {"small": 4, "medium": 10, "large": 16}
+
+# format -> (content type, file extension)
+QR_FORMATS = {
+    "png": ("image/png", "png"),
+    "png1": ("image/png", "png"),  # 1-bit PNG, smallest for printing
+    "svg": ("image/svg+xml", "svg"),
+}
+
+
+def build_qr_image(data, box_size=10):
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_H,
+        box_size=box_size,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white").convert('RGB')
+
+    # Optional: Add logo in the center
+    qr_width, qr_height = img.size
+    factor = 4  # logo size ratio
+    logo = load_logo(qr_width // factor)
+    if logo is not None:
+        # Center the logo
+        pos = ((qr_width - logo.width) // 2, (qr_height - logo.height) // 2)
+        img.paste(logo, pos, mask=logo if logo.mode == 'RGBA' else None)
+
+    return img
+
+
+@lru_cache(maxsize=8)
+def load_logo(logo_size):
+    """
+    Open and LANCZOS-resize the logo once per process and size, or None when
+    LOGO_PATH does not exist. The QR width only varies with the QR version, so
+    a handful of sizes cover every render.
+    """
+    if not os.path.exists(LOGO_PATH):
+        return None
+    with Image.open(LOGO_PATH) as logo:
+        logo.load()
+        resized = logo.copy()
+    resized.thumbnail((logo_size, logo_size), Image.Resampling.LANCZOS)
+    return resized
+
+
+def render_qr_bytes(data, fmt="png", size="medium"):
+    box_size = QR_SIZES[size]
+    buffer = BytesIO()
+    if fmt == "svg":
+        # Vector output has no logo overlay
+        qr = qrcode.QRCode(
+            error_correction=qrcode.constants.ERROR_CORRECT_H,
+            box_size=box_size,
+            border=4,
+        )
+        qr.add_data(data)
+        qr.make(fit=True)
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+    else:
+        img = build_qr_image(data, box_size=box_size)
+        if fmt == "png1":
+            img = img.convert("1", dither=Image.Dither.NONE)
+        img.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def qr_cache_key(data, fmt, size):
+    """Content address of a rendered QR; also used as its strong ETag."""
+    return hashlib.sha256(f"{fmt}:{size}:{data}".encode("utf-8")).hexdigest()
+
+
+def qr_cache_path(key, fmt):
+    return os.path.join(settings.QR_CACHE_DIR, key[:2], f"{key}.{QR_FORMATS[fmt][1]}")
+
+
+def store_cached_qr(data, fmt, size, content):
+    """Write a rendered QR into the content-addressed disk cache."""
+    path = qr_cache_path(qr_cache_key(data, fmt, size), fmt)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename so concurrent readers never see a partial file. The
+    # temp name is unique per call: threads of one worker share a pid.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def prune_qr_cache(max_age=None, max_bytes=None, now=None):
+    """
+    Delete disk cache files unused for more than `max_age` seconds, then the
+    least recently used ones until the cache fits in `max_bytes`. A file's
+    mtime is its last use. Returns (files deleted, bytes freed).
+    """
+    now = now or time.time()
+    entries = []
+    for root, _, names in os.walk(settings.QR_CACHE_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+
+    total = sum(size for _, size, _ in entries)
+    deleted = freed = 0
+    for used, size, path in entries:
+        expired = max_age is not None and now - used > max_age
+        if not expired and (max_bytes is None or total <= max_bytes):
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass  # pruned by a concurrent run
+        total -= size
+        deleted += 1
+        freed += size
+    return deleted, freed
+
+
+@lru_cache(maxsize=256)
+def get_qr_bytes(data, fmt="png", size="medium"):
+    """
+    Return the rendered QR for `data`, from the in-process LRU, then the
+    on-disk cache, rendering and storing it on a miss.
+    """
+    path = qr_cache_path(qr_cache_key(data, fmt, size), fmt)
+    try:
+        with open(path, "rb") as cached:
+            content = cached.read()
+    except FileNotFoundError:
+        pass
+    else:
+        # Mark it used for prune_qr_cache (atime is unreliable under noatime/relatime)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return content
+
+    content = render_qr_bytes(data, fmt, size)
+    store_cached_qr(data, fmt, size, content)
+    return content
+
+
+def render_document_qr(document):
+    """
+    Render the document's QR code, store it in MEDIA_ROOT and mark it ready.
+    Writes with a queryset update so no further QR job is enqueued.
+    """
+    from .models import Document
+
+    fingerprint = document.compute_qr_fingerprint()
+    img = build_qr_image(document.qr_payload())
+    buffer = BytesIO()
+    img.save(buffer, format="PNG")
+    file_name = f"QR_{document.tracking_id}.png"
+
+    # Delete old QR if exists
+    if document.qr_code:
+        document.qr_code.delete(save=False)
+
+    document.qr_code.save(file_name, File(buffer), save=False)
+    buffer.close()
+
+    Document.objects.filter(pk=document.pk).update(
+        qr_code=document.qr_code.name, qr_ready=True, qr_fingerprint=fingerprint
+    )
+    document.qr_ready = True
+    document.qr_fingerprint = fingerprint
+    document.remember_loaded_values(["qr_code", "qr_ready", "qr_fingerprint"])
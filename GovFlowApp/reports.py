@@ -0,0 +1,509 @@
+"""
+Document flow reports.
+
+The "days stayed" column is the time between a history entry and the next
+entry for the same document. It is computed in the same query as the rows,
+with a LEAD() window function, or with a single pass over rows sorted by
+document and timestamp on databases without window support.
+
+Rows are produced lazily from a chunked cursor, so the CSV and XLSX exports
+stream them out without holding the whole report in memory. PDFs are slow to
+render and are built by ``manage.py process_report_jobs`` from ReportJob rows.
+
+Reports over an explicit period are also kept as ReportArtifact files, so a
+repeated download is a plain file serve.
+"""
+import csv
+import hashlib
+import io
+import tempfile
+import threading
+import traceback
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import BooleanField, ExpressionWrapper, F, Max, Q, Sum, Value, Window
+from django.db.models.functions import Lead, TruncWeek
+from django.template.loader import render_to_string
+from django.utils import timezone
+from xhtml2pdf import pisa
+
+from .models import Document, DocumentHistory, OfficeDayRollup, ReportArtifact, ReportJob
+
+
+REPORT_TYPES = ("weekly", "monthly")
+
+# Request parameters that select a report's rows
+REPORT_PARAMS = ("start", "end", "month_year", "document_id")
+
+# Keys of report_row(), also used as the export column headers
+REPORT_COLUMNS = [
+    "tracking_id", "title", "action", "from_office", "to_office",
+    "performed_by", "timestamp", "days_stayed", "note",
+]
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# export parameter -> (artifact format / file extension, content type)
+REPORT_FORMATS = {
+    "csv": ("csv", "text/csv"),
+    "excel": ("xlsx", XLSX_CONTENT_TYPE),
+    "pdf": ("pdf", "application/pdf"),
+}
+
+
+def report_period(report_type, params, today=None):
+    """
+    Return the (start, end) range of a weekly or monthly report from the
+    request parameters. Raises ValueError for an unknown report type.
+    """
+    today = today or timezone.now()
+    if report_type == "weekly":
+        start_date = params.get("start")
+        end_date = params.get("end")
+        if start_date and end_date:
+            return (
+                _aware(datetime.fromisoformat(start_date)),
+                _aware(datetime.fromisoformat(end_date) + timedelta(days=1)),
+            )
+        return today - timedelta(days=7), today
+    if report_type == "monthly":
+        month_year = params.get("month_year")
+        if month_year:
+            year, month = map(int, month_year.split("-"))
+            start_date = datetime(year, month, 1)
+            if month == 12:
+                return _aware(start_date), _aware(datetime(year + 1, 1, 1))
+            return _aware(start_date), _aware(datetime(year, month + 1, 1))
+        return today - timedelta(days=30), today
+    raise ValueError(f"Invalid report type: {report_type}")
+
+
+def _aware(value):
+    # Dates picked in the UI are local dates
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+
+def report_access_q(user):
+    """History rows a user may see in their reports."""
+    return (
+        Q(document__sender=user) |
+        Q(document__current_office=user) |
+        Q(from_office=user) |
+        Q(to_office=user) |
+        Q(performed_by=user)
+    )
+
+
+class ReportError(Exception):
+    """An invalid report request; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class Report:
+    """A report request resolved to a single document or a date range."""
+
+    def __init__(self, user, report_type, params, now=None):
+        self.user = user
+        self.report_type = report_type
+        self.now = now or timezone.now()
+        self.document = None
+        self.start = self.end = None
+        self.period = None  # cache key part; None for the rolling default ranges
+
+        document_id = params.get("document_id")  # single document option
+        if document_id:
+            self.document = Document.objects.filter(
+                id=document_id
+            ).filter(
+                Q(sender=user) | Q(current_office=user)
+            ).first()
+            if not self.document:
+                raise ReportError("Document not found or access denied.", status=404)
+            self.period = f"document-{self.document.pk}"
+        else:
+            try:
+                self.start, self.end = report_period(report_type, params, self.now)
+            except ValueError:
+                raise ReportError("Invalid report type")
+            if params.get("month_year"):
+                self.period = self.start.strftime("%Y-%m")
+            elif params.get("start") and params.get("end"):
+                self.period = f"{self.start:%Y-%m-%d}..{self.end:%Y-%m-%d}"
+
+    @property
+    def closed(self):
+        """A period that has ended; its report only changes if late history lands."""
+        return self.end is not None and self.end <= timezone.now()
+
+    @property
+    def title(self):
+        return f"Document: {self.document.title}" if self.document else self.report_type
+
+    @property
+    def filename(self):
+        prefix = "single_document" if self.document else self.report_type
+        return f'{prefix}_report_{self.now.strftime("%Y%m%d")}'
+
+    def histories(self, use_window=None):
+        return report_histories(self.user, self.start, self.end, self.document, use_window=use_window)
+
+    def rows(self):
+        return iter_report_rows(self.histories(), self.now)
+
+    def count(self):
+        if self.document:
+            return DocumentHistory.objects.filter(document=self.document).count()
+        return DocumentHistory.objects.filter(
+            report_access_q(self.user), timestamp__gte=self.start, timestamp__lt=self.end
+        ).count()
+
+
+def report_histories(user=None, start=None, end=None, document=None, use_window=None):
+    """
+    Yield (history, next_timestamp) for every row of a report, ordered by
+    document and timestamp. `next_timestamp` is None for a document's latest entry.
+
+    The next entry may fall outside the report period or the user's rows, so the
+    scan covers every later entry of the documents in the report and rows that
+    are only there to supply a next timestamp are dropped while iterating.
+    """
+    if document is not None:
+        histories = DocumentHistory.objects.filter(document=document)
+        in_report = Value(True)
+    else:
+        report_q = Q(timestamp__gte=start, timestamp__lt=end) & report_access_q(user)
+        histories = DocumentHistory.objects.filter(
+            document_id__in=DocumentHistory.objects.filter(report_q).values("document_id"),
+            timestamp__gte=start,
+        )
+        in_report = ExpressionWrapper(report_q, output_field=BooleanField())
+
+    histories = histories.select_related(
+        "document", "from_office", "to_office", "performed_by"
+    ).annotate(in_report=in_report)
+
+    for h, next_timestamp in with_next_timestamps(histories, use_window=use_window):
+        if h.in_report:
+            yield h, next_timestamp
+
+
+def with_next_timestamps(histories, use_window=None, chunk_size=2000):
+    """
+    Yield (history, timestamp of the same document's next entry) for a
+    DocumentHistory queryset, in (document, timestamp) order. The next entry
+    must be part of the queryset.
+    """
+    histories = histories.order_by("document", "timestamp", "id")
+    if use_window is None:
+        use_window = connection.features.supports_over_clause
+
+    if use_window:
+        histories = histories.annotate(next_timestamp=Window(
+            Lead("timestamp"),
+            partition_by=[F("document_id")],
+            order_by=[F("timestamp").asc(), F("id").asc()],
+        ))
+        for h in histories.iterator(chunk_size=chunk_size):
+            yield h, h.next_timestamp
+        return
+
+    # Rows arrive sorted by (document, timestamp), so each row's successor is the next row
+    previous = None
+    for h in histories.iterator(chunk_size=chunk_size):
+        if previous is not None:
+            yield previous, h.timestamp if h.document_id == previous.document_id else None
+        previous = h
+    if previous is not None:
+        yield previous, None
+
+
+def office_dwell_summary(start_date, end_date, offices=None, group="day"):
+    """
+    Dwell times and action counts per office and day (or week) between two
+    dates, inclusive. Reads OfficeDayRollup, so the cost is days x offices
+    regardless of how much history there is.
+    """
+    rollups = OfficeDayRollup.objects.filter(date__gte=start_date, date__lte=end_date)
+    if offices is not None:
+        rollups = rollups.filter(office__in=offices)
+
+    totals = {field: Sum(field) for field in OfficeDayRollup.COUNT_FIELDS}
+    rows = rollups.annotate(
+        period=TruncWeek("date") if group == "week" else F("date")
+    ).values(
+        "period", "office_id", "office__first_name", "office__last_name", "department"
+    ).annotate(
+        held=Sum("documents_held"),
+        ended=Sum("stays_ended"),
+        total_dwell=Sum("total_dwell_seconds"),
+        max_dwell=Max("max_dwell_seconds"),
+        **totals,
+    ).order_by("period", "department", "office__last_name")
+
+    for row in rows:
+        yield {
+            "period": row["period"].isoformat(),
+            "office_id": row["office_id"],
+            "office": f'{row["office__first_name"]} {row["office__last_name"]}'.strip(),
+            "department": row["department"],
+            "documents_held": row["held"],
+            "average_dwell_seconds": row["total_dwell"] // row["ended"] if row["ended"] else None,
+            "max_dwell_seconds": row["max_dwell"],
+            **{field: row[field] for field in OfficeDayRollup.COUNT_FIELDS},
+        }
+
+
+def format_dwell(delta):
+    """Format a timedelta as days:hours:minutes:seconds."""
+    total_seconds = int(delta.total_seconds())
+    days, remainder = divmod(total_seconds, 86400)
+    hours, remainder = divmod(remainder, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{days}d {hours}h {minutes}m {seconds}s"
+
+
+def report_row(h, next_timestamp, now):
+    """One report line; an entry without a successor is still in progress at `now`."""
+    return {
+        "tracking_id": h.document.tracking_id,
+        "title": h.document.title,
+        "action": h.action,
+        "from_office": h.from_office.get_full_name() if h.from_office else "",
+        "to_office": h.to_office.get_full_name() if h.to_office else "",
+        "performed_by": h.performed_by.get_full_name() if h.performed_by else "",
+        "timestamp": h.timestamp.strftime("%b %d, %Y %H:%M"),
+        "days_stayed": format_dwell((next_timestamp or now) - h.timestamp),
+        "note": h.note or ""
+    }
+
+
+def iter_report_rows(histories, now):
+    return (report_row(h, next_timestamp, now) for h, next_timestamp in histories)
+
+
+class _Echo:
+    """File-like object whose write() hands the line back to the csv writer."""
+
+    def write(self, value):
+        return value
+
+
+def write_csv(rows, out):
+    """Write the report as CSV into the binary file `out`."""
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+    for line in iter_csv(rows):
+        text.write(line)
+    text.detach()
+
+
+def iter_csv(rows):
+    """Yield the report as CSV lines, one row at a time (for StreamingHttpResponse)."""
+    writer = csv.DictWriter(_Echo(), fieldnames=REPORT_COLUMNS)
+    yield writer.writerow(dict(zip(REPORT_COLUMNS, REPORT_COLUMNS)))
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_xlsx(rows, out=None):
+    """
+    Write the report with a write-only workbook, which streams rows to disk
+    instead of keeping the sheet in memory. Without `out`, returns an open
+    temporary file, positioned at the start, that is deleted when closed.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(REPORT_COLUMNS)
+    for row in rows:
+        sheet.append([row[column] for column in REPORT_COLUMNS])
+
+    if out is None:
+        out = tempfile.TemporaryFile()
+    workbook.save(out)
+    out.seek(0)
+    return out
+
+
+# Seconds between progress heartbeats while xhtml2pdf renders, well inside
+# process_report_jobs --stale-after
+PDF_HEARTBEAT_INTERVAL = 30
+
+
+@contextmanager
+def heartbeat(beat, interval):
+    """Call beat() every `interval` seconds from a background thread while the block runs."""
+    stop = threading.Event()
+
+    def run():
+        try:
+            while not stop.wait(interval):
+                beat()
+        finally:
+            connection.close()  # the thread's own connection
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def render_pdf(report, out, progress=None):
+    """
+    Render the report as a PDF into the binary file `out`. `progress`, if
+    given, is called with a percentage as rows are collected.
+    """
+    total = report.count() or 1
+    step = max(1, total // 20)
+    report_data = []
+    for number, row in enumerate(report.rows(), start=1):
+        report_data.append(row)
+        if progress and number % step == 0:
+            progress(min(60, 60 * number // total))
+
+    if progress:
+        progress(70)
+    html = render_to_string("report_pdf_template.html", {
+        "report_data": report_data,
+        "report_type": report.title,
+    })
+    # CreatePDF reports no progress of its own, so keep beating while it runs
+    # or a slow render looks abandoned to process_report_jobs
+    alive = heartbeat(lambda: progress(70), PDF_HEARTBEAT_INTERVAL) if progress else nullcontext()
+    with alive:
+        failed = pisa.CreatePDF(html, dest=out).err
+    if failed:
+        raise RuntimeError("Error generating PDF")
+
+
+# --- Artifact cache ------------------------------------------------------------
+
+def cached_artifact(report, fmt):
+    """The fresh cached file of `report` in format `fmt`, or None."""
+    if report.period is None:
+        return None
+    artifact = ReportArtifact.objects.filter(
+        user=report.user, report_type=report.report_type, period=report.period, format=fmt
+    ).first()
+    if artifact and artifact.is_fresh and artifact.file.storage.exists(artifact.file.name):
+        return artifact
+    return None
+
+
+def store_artifact(report, fmt, content):
+    """
+    Keep the rendered file `content` (a binary file positioned at the start)
+    for `report`. Closed periods are kept until invalidated, open ones for
+    REPORT_CACHE_TTL seconds.
+    """
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: content.read(1024 * 1024), b""):
+        digest.update(chunk)
+    content.seek(0)
+    etag = digest.hexdigest()
+
+    name = f"report_cache/{etag[:2]}/{etag}.{fmt}"
+    if not default_storage.exists(name):
+        name = default_storage.save(name, File(content))
+
+    expires_at = None if report.closed else timezone.now() + timedelta(seconds=settings.REPORT_CACHE_TTL)
+    previous = ReportArtifact.objects.filter(
+        user=report.user, report_type=report.report_type, period=report.period, format=fmt
+    ).values_list("file", flat=True).first()
+    artifact, _ = ReportArtifact.objects.update_or_create(
+        user=report.user, report_type=report.report_type, period=report.period, format=fmt,
+        defaults={
+            "file": name,
+            "period_start": report.start,
+            "period_end": report.end,
+            "document": report.document,
+            "expires_at": expires_at,
+        },
+    )
+    if previous and previous != name:
+        ReportArtifact.delete_unreferenced_files({previous})
+    return artifact
+
+
+def build_artifact(report, fmt):
+    """Render `report` in format `fmt` and store it in the artifact cache."""
+    with tempfile.TemporaryFile() as out:
+        if fmt == "csv":
+            write_csv(report.rows(), out)
+        elif fmt == "xlsx":
+            write_xlsx(report.rows(), out)
+        else:
+            render_pdf(report, out)
+        out.seek(0)
+        return store_artifact(report, fmt, out)
+
+
+def get_artifact(report, fmt):
+    return cached_artifact(report, fmt) or build_artifact(report, fmt)
+
+
+def artifact_etag(name):
+    """Strong ETag of a stored report file. Stored files never change, so the name identifies the content."""
+    return '"%s"' % hashlib.sha256(name.encode("utf-8")).hexdigest()[:32]
+
+
+def enqueue_report_job(user, report_type, data):
+    """
+    Queue a PDF report for `user`, or return their identical job still in the
+    queue. A cached PDF is handed back as an already finished job. Raises
+    ReportError for invalid requests and when the user already has
+    REPORT_JOBS_PER_USER jobs waiting.
+    """
+    params = {key: data[key] for key in REPORT_PARAMS if data.get(key)}
+    report = Report(user, report_type, params)  # validate now rather than in the worker
+
+    cached = cached_artifact(report, "pdf")
+    if cached:
+        return ReportJob.objects.create(
+            user=user, report_type=report_type, params=params, status="Done", progress=100,
+            artifact=cached.file.name, finished_at=timezone.now(),
+        )
+
+    with transaction.atomic():
+        # Lock the user row so concurrent requests can't both slip under the cap
+        User.objects.select_for_update().filter(pk=user.pk).first()
+        active = list(ReportJob.objects.filter(user=user, status__in=["Pending", "Running"]))
+        for job in active:
+            if job.report_type == report_type and job.params == params:
+                return job
+        if len(active) >= settings.REPORT_JOBS_PER_USER:
+            raise ReportError(
+                "You already have reports being generated. Please wait for them to finish.", status=429
+            )
+        return ReportJob.objects.create(user=user, report_type=report_type, params=params)
+
+
+def run_report_job(job_id):
+    """Render one claimed ReportJob; runs in a process_report_jobs worker process."""
+    job = ReportJob.objects.select_related("user").get(pk=job_id)
+    try:
+        report = Report(job.user, job.report_type, job.params, now=job.created_at)
+        with tempfile.TemporaryFile() as out:
+            render_pdf(report, out, progress=job.set_progress)
+            out.seek(0)
+            if report.period is None:
+                job.artifact.save(f"{report.filename}_{job.pk}.pdf", File(out), save=False)
+            else:
+                job.artifact.name = store_artifact(report, "pdf", out).file.name
+    except Exception:
+        job.fail(traceback.format_exc())
+        return job_id, False
+    job.finish()
+    return job_id, True
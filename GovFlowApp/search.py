@@ -0,0 +1,99 @@
+"""
+Full-text document search over DocumentSearch rows (see models.py and
+migration 0018 for how they are kept and indexed).
+
+Every word of the query has to match, each as a prefix, so results narrow as
+the user types. search_documents() only narrows a queryset, which keeps the
+list pages' summary aggregates cheap; rank_documents() then orders the page
+best match first:
+  - PostgreSQL: the weighted tsvector column is matched through its GIN index
+    and ranked with ts_rank (tracking ID and title A, sender B, description C,
+    history notes D).
+  - SQLite: the FTS5 table is matched and ranked with bm25() using the same
+    column weighting.
+  - Anything else: the old icontains filters, newest first.
+"""
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from .models import Document, DocumentSearch
+
+
+FTS_TABLE = "document_search_fts"
+# bm25() weights, in FTS5 column order: tracking_id, title, sender_name, description, notes
+BM25_WEIGHTS = "10.0, 10.0, 4.0, 2.0, 1.0"
+
+
+def search_terms(query):
+    return re.findall(r"\w+", query.lower())
+
+
+def _tables():
+    quote = connection.ops.quote_name
+    return quote(DocumentSearch._meta.db_table), f"{quote(Document._meta.db_table)}.{quote('id')}"
+
+
+def _tsquery(words):
+    return " & ".join(f"{word}:*" for word in words)
+
+
+def _fts_query(words):
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search_documents(queryset, query):
+    """Narrow a Document queryset to the documents matching every word of `query`."""
+    words = search_terms(query)
+    if not words:
+        return queryset.none()
+
+    if connection.vendor == "postgresql":
+        table, _ = _tables()
+        return queryset.filter(pk__in=RawSQL(
+            f"SELECT document_id FROM {table} WHERE vector @@ to_tsquery('simple', %s)", [_tsquery(words)]
+        ))
+    if connection.vendor == "sqlite":
+        return queryset.filter(pk__in=RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [_fts_query(words)]
+        ))
+
+    match = Q()
+    for word in words:
+        match &= (
+            Q(tracking_id__icontains=word) |
+            Q(title__icontains=word) |
+            Q(sender__first_name__icontains=word) |
+            Q(sender__last_name__icontains=word)
+        )
+    return queryset.filter(match)
+
+
+def rank_documents(queryset, query):
+    """
+    Order a queryset narrowed by search_documents() best match first (newest
+    first among equals), annotating each document with `search_rank`.
+    """
+    words = search_terms(query)
+    table, document_id = _tables()
+
+    if words and connection.vendor == "postgresql":
+        rank = RawSQL(
+            f"SELECT ts_rank(vector, to_tsquery('simple', %s)) FROM {table} WHERE document_id = {document_id}",
+            [_tsquery(words)],
+            output_field=FloatField(),
+        )
+    elif words and connection.vendor == "sqlite":
+        # bm25() is lower for better matches
+        rank = RawSQL(
+            f"SELECT -bm25({FTS_TABLE}, {BM25_WEIGHTS}) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND rowid = {document_id}",
+            [_fts_query(words)],
+            output_field=FloatField(),
+        )
+    else:
+        return queryset.order_by("-created_at")
+
+    return queryset.annotate(search_rank=rank).order_by("-search_rank", "-created_at")
@@ -0,0 +1,43 @@
+"""
+Summary counts for the list pages.
+
+Every bucket is a conditional COUNT in a single aggregate() over the page's
+already filtered queryset, so the summary cards cost one query however many
+buckets a page shows.
+"""
+from django.db.models import Count, Q
+
+
+DOCUMENT_BUCKETS = {
+    "pending": Q(status="Pending"),
+    "in_transit": Q(status="In Transit"),
+    "received": Q(status="Received"),
+    "returned": Q(status="Returned"),
+    "completed": Q(status="Completed"),
+    "in_progress": Q(status__in=["Pending", "In Transit", "Returned"]),
+    "high_priority": Q(priority="High"),
+    "medium_priority": Q(priority="Medium"),
+    "low_priority": Q(priority="Low"),
+}
+
+USER_BUCKETS = {
+    "active": Q(is_active=True),
+    "inactive": Q(is_active=False),
+    "admins": Q(is_staff=True),
+}
+
+
+def summarize(queryset, buckets):
+    """Return {"total": n, <bucket>: n, ...} for `queryset` in one query."""
+    return queryset.order_by().aggregate(
+        total=Count("pk"),
+        **{name: Count("pk", filter=condition) for name, condition in buckets.items()},
+    )
+
+
+def document_summary(queryset):
+    return summarize(queryset, DOCUMENT_BUCKETS)
+
+
+def user_summary(queryset):
+    return summarize(queryset, USER_BUCKETS)
@@ -1,3 +1,1905 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO, StringIO
+from statistics import mean, median
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import events, importer, reports, views
+from .directory import directory_version, office_directory
+from .notifications import notify, notify_many
+from .unread import unread_count
+from .models import (
+    Document, DocumentHistory, Notification, OfficeDayRollup, QRCodeJob, ReportArtifact, ReportJob,
+    TrackingSequence,
+)
+from .search import rank_documents, search_documents
+from .reports import iter_csv, iter_report_rows, report_histories, write_xlsx
+from .management.commands import precompute_reports, process_qr_jobs
+from .management.commands.process_report_jobs import Command as ReportWorker
+from .qr import (
+    build_qr_image, get_qr_bytes, load_logo, prune_qr_cache, qr_cache_key, qr_cache_path, render_document_qr,
+    render_qr_bytes, store_cached_qr,
+)
+
+
+# Benchmarks run against the test database and print their numbers; they are
+# slow, so only with GOVFLOW_BENCHMARKS=1 in the environment
+benchmark = skipUnless(os.environ.get("GOVFLOW_BENCHMARKS") == "1", "set GOVFLOW_BENCHMARKS=1 to run benchmarks")
+
+
+def report_timings(title, rows):
+    """Print benchmark results as `label  value` lines under a title."""
+    sys.stderr.write(f"\n{title}\n")
+    for label, value in rows:
+        sys.stderr.write(f"  {label:<48} {value}\n")
+
+
+def make_user(username, department="Records", **fields):
+    user = User.objects.create_user(
+        username=username, password="pass", first_name=username.title(), last_name="Office", **fields
+    )
+    user.userprofile.department = department
+    user.userprofile.save()
+    return user
+
+
+def seed_history(size, per_document=8, offices=20, seed=0):
+    """
+    Bulk-insert about `size` history rows across size // per_document documents
+    and `offices` users. Returns (user, start, end) for a 30-day report that cuts
+    through the middle of every document's history.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    users = User.objects.bulk_create([
+        User(username=f"dwell-seed-{i}", first_name="Seed", last_name=str(i)) for i in range(offices)
+    ])
+    documents = Document.objects.bulk_create([
+        Document(
+            tracking_id=f"DWELL-{i:06d}",  # tracking_id is at most 15 characters
+            sender=rng.choice(users),
+            current_office=rng.choice(users),
+            title=f"Seeded document {i}",
+            description="",
+        )
+        for i in range(max(1, size // per_document))
+    ], batch_size=5000)
+
+    # Each document's history spans ~60 days
+    entries, timestamps = [], []
+    for document in documents:
+        timestamp = now - timedelta(days=rng.uniform(30, 60))
+        for _ in range(per_document):
+            timestamp += timedelta(hours=rng.uniform(1, 120))
+            timestamps.append(timestamp)
+            entries.append(DocumentHistory(
+                document=document,
+                action=rng.choice(["Forwarded", "Received", "Returned", "Status Update"]),
+                from_office=rng.choice(users),
+                to_office=rng.choice(users),
+                performed_by=rng.choice(users),
+            ))
+    DocumentHistory.objects.bulk_create(entries, batch_size=5000)
+    # auto_now_add stamps every row with "now"; put the spread-out timestamps back
+    for entry, timestamp in zip(entries, timestamps):
+        entry.timestamp = timestamp
+    DocumentHistory.objects.bulk_update(entries, ["timestamp"], batch_size=100)
+    return users[0], now - timedelta(days=30), now
+
+
+class GovFlowTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sender = make_user("sender")
+        cls.office_a = make_user("alpha")
+        cls.office_b = make_user("bravo")
+
+    def make_document(self, title="Budget request", **fields):
+        fields.setdefault("sender", self.sender)
+        fields.setdefault("description", "Office supplies for Q3")
+        return Document.objects.create(title=title, **fields)
+
+    def reload(self, document):
+        return Document.objects.get(pk=document.pk)
+
+    def assert_routing_state_rebuilds(self, document):
+        document = self.reload(document)
+        rebuilt = self.reload(document)
+        rebuilt.refresh_routing_state()
+        for name in Document.ROUTING_FIELDS:
+            attname = Document._meta.get_field(name).attname
+            self.assertEqual(getattr(rebuilt, attname), getattr(document, attname), name)
+
+
+class RoutingStateTests(GovFlowTestCase):
+    def test_new_document_has_no_recipient(self):
+        document = self.reload(self.make_document())
+        self.assertIsNone(document.intended_recipient_id)
+        self.assertIsNone(document.last_forward_id)
+        self.assertFalse(document.is_retractable)
+        self.assertEqual(document.history.get().action, "Pending")
+
+    def test_forward_receive_return(self):
+        document = self.make_document()
+        document.forward_to(self.office_a, forwarded_by=self.sender)
+        document = self.reload(document)
+        forward = document.history.get(action="Forwarded")
+        self.assertEqual(document.intended_recipient_id, self.office_a.pk)
+        self.assertEqual(document.last_forward_id, forward.pk)
+        self.assertEqual(document.last_forwarded_at, forward.timestamp)
+        self.assertTrue(document.is_retractable)
+
+        document.mark_received(self.office_a, received_by=self.office_a)
+        document = self.reload(document)
+        self.assertFalse(document.is_retractable)
+        self.assertEqual(document.current_office_id, self.office_a.pk)
+        self.assertEqual(document.previous_offices, [self.sender.pk])
+
+        document.return_document(self.sender, returned_by=self.office_a)
+        document = self.reload(document)
+        self.assertEqual(document.intended_recipient_id, self.sender.pk)
+        self.assertEqual(document.previous_offices, [self.sender.pk, self.office_a.pk])
+
+    def test_incremental_state_matches_rebuild(self):
+        document = self.make_document()
+        document.forward_to(self.office_a, forwarded_by=self.sender)
+        document.mark_received(self.office_a, received_by=self.office_a)
+        document.forward_to(self.office_b, forwarded_by=self.office_a)
+        self.assert_routing_state_rebuilds(document)
+
+    def test_rebuild_drops_a_stale_receipt(self):
+        document = self.make_document()
+        document.forward_to(self.office_a, forwarded_by=self.sender)
+        Document.objects.filter(pk=document.pk).update(received_at=timezone.now())
+
+        document = self.reload(document)
+        document.refresh_routing_state()
+        self.assertIsNone(document.received_at)
+        self.assertTrue(document.is_retractable)
+
+    def test_retract_clears_recipient(self):
+        document = self.make_document()
+        document.forward_to(self.office_a, forwarded_by=self.sender)
+        document = self.reload(document)
+
+        document.retract_document(retracted_by=self.sender)
+        document = self.reload(document)
+        self.assertEqual(document.status, "Pending")
+        self.assertEqual(document.current_office_id, self.sender.pk)
+        self.assertIsNone(document.intended_recipient_id)
+        self.assertFalse(document.is_retractable)
+        self.assertFalse(document.history.filter(action="Forwarded").exists())
+        self.assertEqual(document.history.get(action="Retracted").note, "Retracted by Sender Office")
+
+    def test_retract_after_receive_is_refused(self):
+        document = self.make_document()
+        document.forward_to(self.office_a, forwarded_by=self.sender)
+        document.mark_received(self.office_a, received_by=self.office_a)
+        with self.assertRaises(ValueError):
+            self.reload(document).retract_document(retracted_by=self.office_a)
+
+    def test_retract_then_receive_is_refused(self):
+        document = self.make_document()
+        document.forward_to(self.office_a, forwarded_by=self.sender)
+        document.mark_received(self.office_a, received_by=self.office_a)
+        self.reload(document).forward_to(self.office_b, forwarded_by=self.office_a)
+
+        self.client.force_login(self.office_a)
+        self.client.post(reverse("retract_document", args=[document.pk]))
+        # Neither the withdrawn recipient nor an earlier one can receive it now
+        for office in (self.office_b, self.office_a):
+            self.client.force_login(office)
+            self.client.post(reverse("receive_document"), {"tracking_id": document.tracking_id})
+
+        document = self.reload(document)
+        self.assertIsNone(document.intended_recipient_id)
+        self.assertEqual(document.current_office_id, self.office_a.pk)
+        self.assertEqual(document.status, "Pending")
+        self.assertEqual(document.history.filter(action="Received").count(), 1)
+
+    def test_forward_again_after_retract(self):
+        document = self.make_document()
+        document.forward_to(self.office_a, forwarded_by=self.sender)
+        self.reload(document).retract_document(retracted_by=self.sender)
+
+        document = self.reload(document)
+        document.forward_to(self.office_b, forwarded_by=self.sender)
+        document = self.reload(document)
+        self.assertEqual(document.intended_recipient_id, self.office_b.pk)
+        self.assertTrue(document.is_retractable)
+        self.assertEqual(
+            list(DocumentHistory.objects.filter(document=document).order_by("pk").values_list("action", flat=True)),
+            ["Pending", "Retracted", "Forwarded"],
+        )
+
+
+class BatchReceiveTests(GovFlowTestCase):
+    def setUp(self):
+        self.incoming = [self.make_document(title=f"Incoming {i}") for i in range(3)]
+        for document in self.incoming:
+            document.forward_to(self.office_a, forwarded_by=self.sender)
+        self.elsewhere = self.make_document(title="For bravo")
+        self.elsewhere.forward_to(self.office_b, forwarded_by=self.sender)
+        self.unrouted = self.make_document(title="Not routed")
+        self.client.force_login(self.office_a)
+
+    def receive(self, *tracking_ids):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("receive_batch"), {"tracking_ids": "\n".join(tracking_ids)})
+        return response.json()
+
+    def test_receives_valid_ids_and_reports_the_rest(self):
+        scanned = [d.tracking_id for d in self.incoming] + [
+            self.elsewhere.tracking_id, self.unrouted.tracking_id, "TRK-1999-00001",
+        ]
+        data = self.receive(*scanned)
+        self.assertEqual((data["received"], data["failed"]), (3, 3))
+        self.assertEqual([row["tracking_id"] for row in data["results"]], scanned)
+        self.assertEqual(
+            [row["message"] for row in data["results"][3:]],
+            [
+                "You are not authorized to receive this document.",
+                "This document has not been routed to any office yet.",
+                "Document not found with this tracking ID.",
+            ],
+        )
+
+        for document in self.incoming:
+            document = self.reload(document)
+            self.assertEqual((document.status, document.current_office_id), ("Received", self.office_a.pk))
+            self.assertIsNotNone(document.received_at)
+            self.assertEqual(document.history.filter(action="Received").get().note, "Received via batch scan")
+            self.assert_routing_state_rebuilds(document)
+        self.assertEqual(self.reload(self.elsewhere).status, "In Transit")
+        # One notification per document: each links to its own detail page
+        self.assertEqual(Notification.objects.filter(recipient=self.sender, kind="received").count(), 3)
+
+    def test_scanning_twice_is_reported_not_repeated(self):
+        tracking_id = self.incoming[0].tracking_id
+        self.receive(tracking_id)
+        data = self.receive(tracking_id.lower(), tracking_id)  # duplicates collapse
+        self.assertEqual(len(data["results"]), 1)
+        self.assertEqual(data["results"][0]["message"], "Already received by your office.")
+        self.assertEqual(self.incoming[0].history.filter(action="Received").count(), 1)
+
+    def test_rejects_empty_and_oversized_batches(self):
+        self.assertEqual(self.client.post(reverse("receive_batch"), {"tracking_ids": " "}).status_code, 400)
+        too_many = " ".join(f"TRK-2026-{i:05d}" for i in range(1000))
+        self.assertEqual(self.client.post(reverse("receive_batch"), {"tracking_ids": too_many}).status_code, 400)
+
+
+class ConcurrentReceiveTests(TransactionTestCase):
+    """Two scanners receiving the same IDs at once: each document is received once."""
+
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("needs PostgreSQL or a file-backed SQLite test database")
+
+    def test_same_ids_received_twice_concurrently(self):
+        sender, office = make_user("sender"), make_user("alpha")
+        documents = [
+            Document.objects.create(sender=sender, title=f"Incoming {i}", description="") for i in range(20)
+        ]
+        for document in documents:
+            document.forward_to(office, forwarded_by=sender)
+        tracking_ids = "\n".join(document.tracking_id for document in documents)
+
+        clients = [Client(), Client()]
+        for client in clients:
+            client.force_login(office)
+
+        def receive(client):
+            try:
+                return client.post(reverse("receive_batch"), {"tracking_ids": tracking_ids}).json()
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            results = list(pool.map(receive, clients))
+
+        self.assertEqual(sum(data["received"] for data in results), len(documents))
+        self.assertEqual(
+            DocumentHistory.objects.filter(action="Received", document__in=documents).count(), len(documents)
+        )
+        self.assertEqual(Notification.objects.filter(recipient=sender, kind="received").count(), len(documents))
+
+
+class BulkRouteTests(GovFlowTestCase):
+    def route(self, user, action, documents, office, note=""):
+        self.client.force_login(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse("bulk_route_documents"), {
+                "action": action,
+                "office": office.pk,
+                "note": note,
+                "document_ids": [document.pk for document in documents],
+            })
+
+    def test_bulk_forward(self):
+        documents = [self.make_document(title=f"Memo {i}") for i in range(3)]
+        awaiting = self.make_document(title="Already sent")
+        awaiting.forward_to(self.office_b, forwarded_by=self.sender)
+        not_held = self.make_document(title="Someone else's", sender=self.office_b)
+
+        self.route(self.sender, "forward", documents + [awaiting, not_held], self.office_a, note="For review")
+
+        for document in documents:
+            document = self.reload(document)
+            self.assertEqual(document.status, "In Transit")
+            self.assertEqual(document.intended_recipient_id, self.office_a.pk)
+            self.assertEqual(document.history.get(action="Forwarded").note, "For review")
+            self.assert_routing_state_rebuilds(document)
+        self.assertEqual(self.reload(awaiting).intended_recipient_id, self.office_b.pk)
+        self.assertEqual(self.reload(not_held).status, "Pending")
+
+        notification = Notification.objects.get(recipient=self.office_a)
+        self.assertEqual(notification.message, "3 documents were forwarded to you by Sender Office.")
+        self.assertEqual(notification.url, reverse("receive_page"))
+
+    def test_bulk_return_only_to_previous_offices(self):
+        documents = [self.make_document(title=f"Memo {i}") for i in range(2)]
+        for document in documents:
+            document.forward_to(self.office_a, forwarded_by=self.sender)
+            self.reload(document).mark_received(self.office_a, received_by=self.office_a)
+
+        self.route(self.office_a, "return", documents, self.office_b)
+        self.assertEqual({self.reload(d).status for d in documents}, {"Received"})
+
+        self.route(self.office_a, "return", documents, self.sender)
+        for document in documents:
+            document = self.reload(document)
+            # Same as the single return view: back in transit to the chosen office
+            self.assertEqual((document.status, document.current_office_id), ("In Transit", self.sender.pk))
+            self.assertEqual(document.intended_recipient_id, self.sender.pk)
+            self.assert_routing_state_rebuilds(document)
+        self.assertEqual(
+            Notification.objects.get(recipient=self.sender, kind="returned").message,
+            "2 documents were returned to you by Alpha Office.",
+        )
+
+    def test_cannot_route_to_yourself(self):
+        document = self.make_document()
+        self.route(self.sender, "forward", [document], self.sender)
+        self.assertEqual(self.reload(document).status, "Pending")
+
+
+class DocumentSearchTests(GovFlowTestCase):
+    def search(self, query, queryset=None):
+        queryset = Document.objects.all() if queryset is None else queryset
+        return list(rank_documents(search_documents(queryset, query), query).values_list("title", flat=True))
+
+    def test_every_word_matches_as_a_prefix(self):
+        self.make_document(title="Budget request", description="Office supplies")
+        self.make_document(title="Budget review", description="Travel")
+        self.assertEqual(self.search("budg req"), ["Budget request"])
+        self.assertEqual(sorted(self.search("BUDGET")), ["Budget request", "Budget review"])
+        self.assertEqual(self.search("budget  -- "), self.search("budget"))
+        self.assertEqual(self.search("!!"), [])
+
+    def test_title_outranks_description_and_notes(self):
+        in_note = self.make_document(title="Memo one", description="Circular")
+        in_note.forward_to(self.office_a, forwarded_by=self.sender, note="Please check the laptop specs")
+        self.make_document(title="Memo two", description="Replacement laptop for records")
+        self.make_document(title="Laptop purchase", description="For records")
+        self.assertEqual(self.search("laptop"), ["Laptop purchase", "Memo two", "Memo one"])
+
+    def test_finds_tracking_id_and_sender(self):
+        document = self.make_document(title="Budget request")
+        self.make_document(title="Travel order", sender=self.office_a)
+        self.assertEqual(self.search(document.tracking_id), ["Budget request"])
+        self.assertEqual(self.search("sender office"), ["Budget request"])
+
+    def test_search_after_document_edit(self):
+        document = self.reload(self.make_document(title="Budget request"))
+        document.title = "Procurement request"
+        document.save()
+        self.assertEqual(self.search("procurement"), ["Procurement request"])
+        self.assertEqual(self.search("budget"), [])
+
+    def test_search_after_sender_rename(self):
+        self.make_document(title="Budget request", description="Annual")
+        self.sender.last_name = "Registry"
+        self.sender.save()
+        self.assertEqual(self.search("registry"), ["Budget request"])
+        self.assertEqual(self.search("sender office"), [])
+
+    def test_search_after_history_notes(self):
+        document = self.make_document(title="Budget request")
+        document.forward_to(self.office_a, forwarded_by=self.sender, note="Urgent signature")
+        self.assertEqual(self.search("signature"), ["Budget request"])
+
+        # Retract rewrites the forward's note in place
+        self.reload(document).retract_document(retracted_by=self.sender, note="Wrong office")
+        self.assertEqual(self.search("signature"), [])
+        self.assertEqual(self.search("wrong office"), ["Budget request"])
+
+    def test_deleted_documents_leave_the_index(self):
+        document = self.make_document(title="Budget request")
+        document.delete()
+        self.make_document(title="Budget review")
+        self.assertEqual(self.search("budget"), ["Budget review"])
+
+    def test_listing_is_narrowed_and_ranked(self):
+        self.make_document(title="Memo", description="About the laptop")
+        self.make_document(title="Laptop purchase")
+        self.make_document(title="Travel order")
+        self.client.force_login(self.sender)
+        response = self.client.get(reverse("all_documents"), {"q": "laptop"})
+        self.assertEqual([d.title for d in response.context["documents"]], ["Laptop purchase", "Memo"])
+        self.assertEqual(response.context["total_count"], 2)
+
+
+class DocumentTypeaheadTests(GovFlowTestCase):
+    def search(self, **params):
+        self.client.force_login(self.sender)
+        return self.client.get(reverse("document_search_api"), params).json()
+
+    def texts(self, **params):
+        return [row["text"] for row in self.search(**params)["results"]]
+
+    def test_matches_prefixes_of_own_documents(self):
+        budget = self.make_document(title="Budget request")
+        self.make_document(title="Travel order")
+        held = self.make_document(title="Budget review", sender=self.office_a, current_office=self.sender)
+        self.make_document(title="Budget elsewhere", sender=self.office_a)
+
+        self.assertEqual(
+            sorted(self.texts(q="budget")),
+            [f"{budget.tracking_id} - Budget request", f"{held.tracking_id} - Budget review"],
+        )
+        self.assertEqual(self.texts(q="request"), [])  # prefixes only
+        self.assertEqual(self.texts(q=budget.tracking_id.lower()), [f"{budget.tracking_id} - Budget request"])
+        # The TRK- prefix can be left out
+        self.assertEqual(
+            self.texts(q=budget.tracking_id.removeprefix("TRK-")), [f"{budget.tracking_id} - Budget request"]
+        )
+
+    def test_pages_newest_first(self):
+        documents = [self.make_document(title=f"Memo {i:02d}") for i in range(25)]
+        now = timezone.now()
+        for offset, document in enumerate(documents):
+            Document.objects.filter(pk=document.pk).update(created_at=now - timedelta(minutes=offset))
+
+        first = self.search(q="memo")
+        self.assertTrue(first["more"])
+        self.assertEqual([row["id"] for row in first["results"]], [d.pk for d in documents[:20]])
+        second = self.search(q="memo", page=2)
+        self.assertFalse(second["more"])
+        self.assertEqual([row["id"] for row in second["results"]], [d.pk for d in documents[20:]])
+        self.assertEqual(len(self.search(q="memo", page="x")["results"]), 20)
+
+    def test_requires_login(self):
+        response = self.client.get(reverse("document_search_api"), {"q": "budget"})
+        self.assertEqual(response.status_code, 302)
+
+
+class OfficeDirectoryTests(GovFlowTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_groups_offices_by_department(self):
+        make_user("charlie", department="Finance Service")
+        User.objects.create_user(username="no-department")
+        directory = office_directory()
+        self.assertEqual(
+            {department: sorted(u.username for u in users) for department, users in directory.items()},
+            {"Records": ["alpha", "bravo", "sender"], "Finance Service": ["charlie"]},
+        )
+        with self.assertNumQueries(0):
+            self.assertIs(office_directory(), directory)
+
+    def test_profile_change_bumps_version_on_commit(self):
+        office_directory()
+        version = directory_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = self.office_a.userprofile
+            profile.department = "Finance Service"
+            profile.save()
+        self.assertNotEqual(directory_version(), version)
+        self.assertEqual([u.username for u in office_directory()["Finance Service"]], ["alpha"])
+
+    def test_rolled_back_change_keeps_version(self):
+        version = directory_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.office_b.first_name = "Renamed"
+                self.office_b.save()
+                transaction.set_rollback(True)
+        self.assertEqual(directory_version(), version)
+
+    def test_login_does_not_bump_version(self):
+        version = directory_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.login(username="alpha", password="pass")
+        self.assertEqual(directory_version(), version)
+
+
+class SummaryQueryTests(GovFlowTestCase):
+    """List pages count their summary cards in one aggregate, whatever the data."""
+
+    PAGES = ["dashboard", "all_documents", "completed_documents", "user_management"]
+
+    def setUp(self):
+        cache.clear()
+        self.admin = make_user("admin", is_staff=True)
+        self.client.force_login(self.admin)
+        self.seed(0)
+
+    def seed(self, first):
+        statuses = [choice for choice, _ in Document.STATUS_CHOICES]
+        priorities = [choice for choice, _ in Document.PRIORITY_CHOICES]
+        users = User.objects.bulk_create([
+            User(username=f"summary-{i}", first_name="Summary", last_name=str(i)) for i in range(first, first + 20)
+        ])
+        Document.objects.bulk_create([
+            Document(
+                tracking_id=f"SUM-{i:06d}", sender=users[i % 20], current_office=users[(i + 1) % 20],
+                title=f"Summary document {i}", description="",
+                status=statuses[i % len(statuses)], priority=priorities[i % len(priorities)],
+            )
+            for i in range(first, first + 40)
+        ])
+
+    def get(self, page):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse(page)).status_code, 200)
+        return [query["sql"] for query in queries]
+
+    def summary_queries(self, page, sql):
+        # The aggregate names every bucket as a column alias
+        bucket = "admins" if page == "user_management" else "high_priority"
+        return [query for query in sql if f'AS "{bucket}"' in query]
+
+    def test_one_summary_query_per_page(self):
+        for page in self.PAGES:
+            self.get(page)  # user_management creates missing profiles on first view
+            with self.subTest(page):
+                self.assertEqual(len(self.summary_queries(page, self.get(page))), 1)
+
+    def test_query_count_does_not_grow_with_the_data(self):
+        counts = {}
+        for page in self.PAGES:
+            self.get(page)
+            counts[page] = len(self.get(page))
+
+        self.seed(40)
+        for page in self.PAGES:
+            self.get(page)
+            with self.subTest(page), self.assertNumQueries(counts[page]):
+                self.client.get(reverse(page))
+
+    def test_summary_counts(self):
+        response = self.client.get(reverse("all_documents"))
+        self.assertEqual(response.context["total_count"], Document.objects.count())
+        self.assertEqual(response.context["pending_count"], Document.objects.filter(status="Pending").count())
+        self.assertEqual(
+            response.context["high_priority_count"], Document.objects.filter(priority="High").count()
+        )
+
+        response = self.client.get(reverse("user_management"))
+        self.assertEqual(response.context["total_users"], User.objects.count())
+        self.assertEqual(response.context["admin_users"], User.objects.filter(is_staff=True).count())
+
+
+class UnreadCountTests(GovFlowTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def notify(self, user, count=1):
+        with self.captureOnCommitCallbacks(execute=True):
+            return [
+                Notification.objects.create(recipient=user, message=f"Notice {i}") for i in range(count)
+            ]
+
+    def test_counts_once_then_serves_from_cache(self):
+        Notification.objects.create(recipient=self.office_a, message="Before caching")
+        with self.assertNumQueries(1):
+            self.assertEqual(unread_count(self.office_a), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(unread_count(self.office_a), 1)
+
+    def test_create_and_delete_adjust_the_cached_count(self):
+        unread_count(self.office_a)
+        first, second = self.notify(self.office_a, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(unread_count(self.office_a), 1)
+
+    def test_rolled_back_create_is_not_counted(self):
+        unread_count(self.office_a)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Notification.objects.create(recipient=self.office_a, message="Rolled back")
+                transaction.set_rollback(True)
+        self.assertEqual(unread_count(self.office_a), 0)
+
+    def test_mark_read_uncounts_once(self):
+        notification, _ = self.notify(self.office_a, 2)
+        unread_count(self.office_a)
+        self.client.force_login(self.office_a)
+        for _ in range(2):  # a double click
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.get(reverse("mark_notification_read", args=[notification.pk]))
+        self.assertEqual(unread_count(self.office_a), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("mark_all_notifications_read"))
+        with self.assertNumQueries(0):
+            self.assertEqual(unread_count(self.office_a), 0)
+
+    def test_drift_is_repaired(self):
+        self.notify(self.office_a, 3)
+        unread_count(self.office_a)
+        # A raw update the counter never heard about
+        Notification.objects.filter(recipient=self.office_a).update(is_read=True)
+        self.assertEqual(unread_count(self.office_a), 3)
+
+        call_command("reconcile_unread_counts", stdout=StringIO())
+        self.assertEqual(unread_count(self.office_a), 0)
+
+    def test_going_negative_drops_the_entry(self):
+        self.assertEqual(unread_count(self.office_a), 0)
+        # bulk_create() sends no signal, so the cached count never saw this row
+        uncounted, = Notification.objects.bulk_create([Notification(recipient=self.office_a, message="Uncounted")])
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.get(pk=uncounted.pk).delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(unread_count(self.office_a), 0)
+
+    def test_adjusting_keeps_the_count_ttl(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        file_cache = {"default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": cache_dir,
+        }}
+        with override_settings(CACHES=file_cache, NOTIFICATION_COUNT_TTL=900):
+            unread_count(self.office_a)
+            self.notify(self.office_a)
+            later = time.time() + 600  # past the backend's default timeout, inside ours
+            with mock.patch("time.time", return_value=later), self.assertNumQueries(0):
+                self.assertEqual(unread_count(self.office_a), 1)
+
+
+class NotificationFanOutTests(GovFlowTestCase):
+    def forward(self, *documents):
+        """Forward through the views, so the notifications are the ones users get."""
+        self.client.force_login(self.sender)
+        with self.captureOnCommitCallbacks(execute=True):
+            if len(documents) == 1:
+                self.client.post(reverse("forward_document", args=[documents[0].pk]), {"new_office": self.office_a.pk})
+            else:
+                self.client.post(reverse("bulk_route_documents"), {
+                    "action": "forward", "office": self.office_a.pk, "document_ids": [d.pk for d in documents],
+                })
+
+    def test_written_only_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            notify(self.office_a, "Queued", kind="forwarded")
+            self.assertFalse(Notification.objects.exists())
+        self.assertEqual(len(callbacks), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                notify(self.office_a, "Rolled back")
+                transaction.set_rollback(True)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_notify_many_is_one_insert(self):
+        users = [self.sender, self.office_a, self.office_b]
+        with self.captureOnCommitCallbacks() as callbacks:
+            notify_many([(user, f"Hello {user.username}", "") for user in users])
+        with CaptureQueriesContext(connection) as queries:
+            for callback in callbacks:
+                callback()
+        table = Notification._meta.db_table
+        self.assertEqual(sum(q["sql"].startswith(f'INSERT INTO "{table}"') for q in queries.captured_queries), 1)
+        self.assertEqual(Notification.objects.count(), 3)
+
+    def test_forwards_coalesce_into_a_running_total(self):
+        self.forward(self.make_document(title="First"))
+        self.forward(*[self.make_document(title=f"Batch {i}") for i in range(3)])
+        notification = Notification.objects.get(recipient=self.office_a)
+        self.assertEqual(notification.count, 4)
+        self.assertEqual(notification.message, "4 documents were forwarded to you.")
+
+    def test_batch_fold_uses_the_total(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            notify(self.office_a, "Document A was forwarded to you.", url="/receive/", kind="forwarded")
+            notify(self.office_a, "3 documents were forwarded to you.", url="/receive/", kind="forwarded", count=3)
+        notification = Notification.objects.get()
+        self.assertEqual((notification.count, notification.message), (4, "4 documents were forwarded to you."))
+
+    def test_read_and_old_notifications_are_not_merged(self):
+        self.forward(self.make_document(title="First"))
+        Notification.objects.update(is_read=True)
+        self.forward(self.make_document(title="Second"))
+        Notification.objects.filter(is_read=False).update(created_at=timezone.now() - timedelta(hours=1))
+        self.forward(self.make_document(title="Third"))
+        self.assertEqual(list(Notification.objects.values_list("count", flat=True)), [1, 1, 1])
+
+    def test_per_document_links_keep_the_latest_message(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            notify(self.sender, "Memo was received by Alpha Office.", url="/documents/1/", kind="received")
+        with self.captureOnCommitCallbacks(execute=True):
+            notify(self.sender, "Memo was received by Bravo Office.", url="/documents/1/", kind="received")
+            notify(self.sender, "Budget was received by Bravo Office.", url="/documents/2/", kind="received")
+        self.assertEqual(
+            sorted(Notification.objects.values_list("url", "count", "message")),
+            [("/documents/1/", 2, "Memo was received by Bravo Office."),
+             ("/documents/2/", 1, "Budget was received by Bravo Office.")],
+        )
+
+    @override_settings(NOTIFICATION_COALESCE_WINDOW=0)
+    def test_window_of_zero_disables_coalescing(self):
+        self.forward(self.make_document(title="First"))
+        self.forward(self.make_document(title="Second"))
+        self.assertEqual(Notification.objects.filter(recipient=self.office_a).count(), 2)
+
+
+class PurgeNotificationsTests(GovFlowTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def purge(self, *args):
+        call_command("purge_notifications", "--days", "90", "--sleep", "0", *args, stdout=StringIO())
+
+    def old_notification(self, is_read=True):
+        notification = Notification.objects.create(recipient=self.office_b, message="Old", is_read=is_read)
+        Notification.objects.filter(pk=notification.pk).update(created_at=timezone.now() - timedelta(days=200))
+        return notification
+
+    def test_purges_after_a_merge_into_an_older_row(self):
+        before = self.old_notification()
+        with self.captureOnCommitCallbacks(execute=True):
+            notify(self.office_a, "Forwarded", url="/receive/", kind="forwarded")
+        merged = Notification.objects.get(recipient=self.office_a)
+        after = [self.old_notification() for _ in range(3)]
+        unread = self.old_notification(is_read=False)
+
+        # A later event moves the lower-id row's created_at forward
+        with self.captureOnCommitCallbacks(execute=True):
+            notify(self.office_a, "Forwarded", url="/receive/", kind="forwarded")
+        Notification.objects.filter(pk=merged.pk).update(is_read=True)
+
+        self.purge("--batch-size", "2")
+        self.assertLess(merged.pk, after[0].pk)
+        # Old read rows on both sides of the merged one are gone
+        self.assertEqual(sorted(Notification.objects.values_list("pk", flat=True)), [merged.pk, unread.pk])
+        self.assertLess(before.pk, merged.pk)
+
+    def test_resumes_from_checkpoint(self):
+        notifications = [self.old_notification() for _ in range(4)]
+        self.purge("--batch-size", "2", "--max-batches", "1")
+        self.assertEqual(Notification.objects.count(), 2)
+        self.purge("--batch-size", "2")
+        self.assertFalse(Notification.objects.filter(pk__in=[n.pk for n in notifications]).exists())
+
+    def test_archive_before_delete(self):
+        notification = self.old_notification()
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir, ignore_errors=True)
+        self.purge("--archive", archive_dir)
+
+        (name,) = os.listdir(archive_dir)
+        with gzip.open(os.path.join(archive_dir, name), "rt", encoding="utf-8") as archived:
+            self.assertEqual([json.loads(line)["id"] for line in archived], [notification.pk])
+        self.assertFalse(Notification.objects.exists())
+
+
+class ConditionalPollTests(GovFlowTestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.office_a)
+
+    def poll(self, etag=None, interval=None):
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if interval is not None:
+            headers["X-Poll-Interval"] = str(interval)
+        return self.client.get(reverse("notifications_api"), headers=headers)
+
+    def test_unchanged_poll_is_304_and_backs_off(self):
+        first = self.poll()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first["X-Poll-Interval"], "5")
+        self.assertEqual(first["Cache-Control"], "private, no-cache")
+
+        interval, seen = 5, []
+        for _ in range(5):
+            response = self.poll(first["ETag"], interval)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response["ETag"], first["ETag"])
+            interval = int(response["X-Poll-Interval"])
+            seen.append(interval)
+        self.assertEqual(seen, [10, 20, 40, 60, 60])
+        self.assertEqual(self.poll(first["ETag"], "soon")["X-Poll-Interval"], "10")
+
+    def test_change_answers_200_and_resets_interval(self):
+        etag = self.poll()["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            notification = Notification.objects.create(recipient=self.office_a, message="New")
+        response = self.poll(etag, 40)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Poll-Interval"], "5")
+        self.assertEqual(response.json()["count"], 1)
+        self.assertNotEqual(response["ETag"], etag)
+
+        # Reading it changes the state again
+        etag = response["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse("mark_notification_read", args=[notification.pk]))
+        self.assertEqual(self.poll(etag).status_code, 200)
+
+    def test_edit_modal_revalidates_after_an_edit(self):
+        document = self.make_document()
+        self.client.force_login(self.sender)
+        url = reverse("edit_document_modal", args=[document.pk])
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, headers={"If-None-Match": etag}).status_code, 304)
+
+        Document.objects.filter(pk=document.pk).update(title="Budget request (revised)")
+        self.assertEqual(self.client.get(url, headers={"If-None-Match": etag}).status_code, 200)
+
+    def test_error_responses_are_not_tagged(self):
+        document = self.make_document()
+        forbidden = self.client.get(reverse("edit_document_modal", args=[document.pk]))
+        self.assertEqual(forbidden.status_code, 403)
+        self.assertFalse(forbidden.has_header("ETag"))
+        self.assertEqual(self.client.get(reverse("routing_slip_partial", args=[0])).status_code, 404)
+
+
+class NotificationStreamTests(GovFlowTestCase):
+    """The server-sent notification stream, woken by events.publish() after commit."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_wsgi_gets_no_content(self):
+        self.client.force_login(self.office_a)
+        self.assertEqual(self.client.get(reverse("notification_stream")).status_code, 204)
+
+    def notify(self, message):
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(recipient=self.office_a, message=message)
+
+    async def next_event(self, stream):
+        chunk = await asyncio.wait_for(anext(stream), timeout=5)
+        return chunk.decode() if isinstance(chunk, bytes) else chunk
+
+    def event_data(self, chunk):
+        self.assertIn("event: notifications\n", chunk)
+        return json.loads(chunk.split("data: ", 1)[1])
+
+    async def test_publish_after_commit_sends_an_event(self):
+        await self.async_client.aforce_login(self.office_a)
+        response = await self.async_client.get(reverse("notification_stream"))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = aiter(response.streaming_content)
+        try:
+            self.assertEqual(await self.next_event(stream), "retry: 3000\n\n")
+            self.assertEqual(self.event_data(await self.next_event(stream))["count"], 0)
+
+            # Well inside the 15 s poll: only publish() can have woken the stream
+            await sync_to_async(self.notify)("Budget request forwarded")
+            payload = self.event_data(await self.next_event(stream))
+            self.assertEqual(payload["count"], 1)
+            self.assertIn("Budget request forwarded", payload["html"])
+        finally:
+            await stream.aclose()
+
+    async def open_events(self):
+        request = RequestFactory().get(reverse("notification_stream"))
+        request.user = self.office_a
+        stream = views.notification_events(request, self.office_a)
+        self.assertEqual(await self.next_event(stream), "retry: 3000\n\n")
+        self.event_data(await self.next_event(stream))
+        return stream
+
+    async def test_keepalive_when_nothing_changed(self):
+        with mock.patch.object(views, "NOTIFICATION_STREAM_POLL", 0.01):
+            stream = await self.open_events()
+            try:
+                self.assertEqual(await self.next_event(stream), ": keepalive\n\n")
+            finally:
+                await stream.aclose()
+
+    async def test_closing_the_stream_unsubscribes(self):
+        stream = await self.open_events()
+        self.assertIn(self.office_a.pk, events._subscribers)
+        await stream.aclose()
+        self.assertNotIn(self.office_a.pk, events._subscribers)
+
+
+class DirtyFieldTests(GovFlowTestCase):
+    def test_loaded_instance_is_clean(self):
+        document = self.reload(self.make_document())
+        self.assertEqual(document.get_dirty_fields(), [])
+        self.assertIsNone(Document(title="Unsaved").get_dirty_fields())
+
+    def test_noop_save_runs_no_queries(self):
+        document = self.reload(self.make_document())
+        document.title = document.title
+        with self.assertNumQueries(0):
+            document.save()
+
+    def test_bare_save_only_writes_changed_fields(self):
+        document = self.reload(self.make_document())
+        # Someone else edits another field in the meantime
+        Document.objects.filter(pk=document.pk).update(description="Edited elsewhere")
+
+        document.title = "Budget request (revised)"
+        self.assertEqual(document.get_dirty_fields(), ["title"])
+        document.save()
+        document = self.reload(document)
+        self.assertEqual(document.title, "Budget request (revised)")
+        self.assertEqual(document.description, "Edited elsewhere")
+
+    def test_in_place_json_change_is_dirty(self):
+        document = self.reload(self.make_document())
+        document.previous_offices.append(self.office_a.pk)
+        self.assertEqual(document.get_dirty_fields(), ["previous_offices"])
+        document.save()
+        self.assertEqual(self.reload(document).previous_offices, [self.office_a.pk])
+        self.assertEqual(document.get_dirty_fields(), [])
+
+    @override_settings(QR_CODE_FILES=True)
+    def test_save_does_not_refetch_the_row(self):
+        document = self.reload(self.make_document())
+        document.priority = "High"
+        with CaptureQueriesContext(connection) as queries:
+            document.save()
+        table = Document._meta.db_table
+        self.assertFalse([
+            q["sql"] for q in queries.captured_queries
+            if q["sql"].startswith("SELECT") and f'FROM "{table}"' in q["sql"]
+        ])
+
+
+class QRRenderTests(GovFlowTestCase):
+    """Stored QR files are only re-rendered when the encoded payload changes."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(
+            QR_CODE_FILES=True, MEDIA_ROOT=media_root, QR_CACHE_DIR=os.path.join(media_root, "qr_cache")
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def make_rendered_document(self):
+        document = self.make_document()
+        self.assertTrue(QRCodeJob.objects.filter(document=document).exists())
+        render_document_qr(self.reload(document))
+        QRCodeJob.objects.all().delete()
+        return self.reload(document)
+
+    def test_render_records_fingerprint(self):
+        document = self.make_rendered_document()
+        self.assertTrue(document.qr_ready)
+        self.assertTrue(document.qr_code.name.endswith(f"QR_{document.tracking_id}.png"))
+        self.assertFalse(document.qr_is_stale())
+
+    def test_saves_that_keep_the_payload_do_not_rerender(self):
+        document = self.make_rendered_document()
+        document.save()
+        document.received_at = timezone.now()
+        document.save(update_fields=["received_at"])
+        document.title = document.title  # assigned but unchanged
+        document.save(update_fields=["title"])
+        self.assertFalse(QRCodeJob.objects.exists())
+
+    def test_payload_edit_rerenders(self):
+        document = self.make_rendered_document()
+        document.title = "Budget request (revised)"
+        document.save()
+        self.assertEqual(QRCodeJob.objects.filter(document=document).count(), 1)
+
+    def test_transitions_still_rerender(self):
+        # Status and current office are part of the payload
+        document = self.make_rendered_document()
+        document.forward_to(self.office_a, forwarded_by=self.sender)
+        self.assertEqual(QRCodeJob.objects.filter(document=document).count(), 1)
+
+    def test_renders_without_logo_file(self):
+        for fmt in ("png", "png1", "svg"):
+            with self.subTest(fmt):
+                self.assertTrue(render_qr_bytes("TRK-2026-00001", fmt, "small"))
+
+    def test_concurrent_cache_writes_from_one_process(self):
+        data, content = "TRK-2026-00001", render_qr_bytes("TRK-2026-00001", "png", "small")
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda _: store_cached_qr(data, "png", "small", content), range(32)))
+
+        path = qr_cache_path(qr_cache_key(data, "png", "small"), "png")
+        with open(path, "rb") as cached:
+            self.assertEqual(cached.read(), content)
+        self.assertEqual(os.listdir(os.path.dirname(path)), [os.path.basename(path)])
+
+
+    def cache_qr(self, data, days_unused):
+        content = render_qr_bytes(data, "png", "small")
+        store_cached_qr(data, "png", "small", content)
+        path = qr_cache_path(qr_cache_key(data, "png", "small"), "png")
+        used = time.time() - days_unused * 24 * 3600
+        os.utime(path, (used, used))
+        return path, len(content)
+
+    def test_prune_drops_unused_then_least_recently_used(self):
+        stale, _ = self.cache_qr("TRK-2026-00001", days_unused=40)
+        older, older_size = self.cache_qr("TRK-2026-00002", days_unused=5)
+        newer, newer_size = self.cache_qr("TRK-2026-00003", days_unused=1)
+
+        self.assertEqual(prune_qr_cache(max_age=30 * 24 * 3600)[0], 1)
+        self.assertFalse(os.path.exists(stale))
+
+        self.assertEqual(prune_qr_cache(max_bytes=newer_size), (1, older_size))
+        self.assertEqual((os.path.exists(older), os.path.exists(newer)), (False, True))
+
+    def test_serving_from_disk_marks_the_file_used(self):
+        path, _ = self.cache_qr("TRK-2026-00001", days_unused=40)
+        get_qr_bytes.cache_clear()
+        get_qr_bytes("TRK-2026-00001", "png", "small")
+        call_command("prune_qr_cache", days=30, stdout=StringIO())
+        self.assertTrue(os.path.exists(path))
+
+
+class QRWorkerTests(GovFlowTestCase):
+    """process_qr_jobs: claim, render, and retry with backoff."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(QR_CODE_FILES=True, MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.document = self.make_document()
+        self.job = QRCodeJob.objects.get(document=self.document)
+
+    def worker(self):
+        return process_qr_jobs.Command(stdout=StringIO(), stderr=StringIO())
+
+    def test_rendered_job_is_deleted(self):
+        self.assertEqual(self.worker().run_batch(10), 1)
+        self.assertFalse(QRCodeJob.objects.exists())
+        document = self.reload(self.document)
+        self.assertTrue(document.qr_ready)
+        self.assertFalse(document.qr_is_stale())
+
+    def test_failed_render_backs_off(self):
+        worker = self.worker()
+        with mock.patch.object(process_qr_jobs, "render_document_qr", side_effect=RuntimeError("disk full")):
+            for attempt, backoff in ((1, 30), (2, 60), (3, 120)):
+                started = timezone.now()
+                self.assertEqual(worker.run_batch(10), 1)
+                self.job.refresh_from_db()
+                self.assertEqual((self.job.status, self.job.attempts), ("Pending", attempt))
+                self.assertIn("disk full", self.job.last_error)
+                self.assertAlmostEqual(
+                    (self.job.run_after - started).total_seconds(), backoff, delta=5
+                )
+                self.assertEqual(worker.run_batch(10), 0)  # not due yet
+                QRCodeJob.objects.update(run_after=timezone.now())
+
+            QRCodeJob.objects.update(attempts=QRCodeJob.MAX_ATTEMPTS - 1)
+            worker.run_batch(10)
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.attempts), ("Failed", QRCodeJob.MAX_ATTEMPTS))
+        self.assertEqual(worker.run_batch(10), 0)
+
+    def test_claim_skips_a_job_taken_by_another_worker(self):
+        filter_jobs = QRCodeJob.objects.filter
+
+        def listing(*args, **kwargs):
+            queryset = filter_jobs(*args, **kwargs)
+            if "run_after__lte" in kwargs:
+                # Another worker claims the job right after this one listed it
+                pending = list(queryset.values_list("pk", flat=True))
+                filter_jobs(pk__in=pending).update(status="Running", attempts=1)
+                return filter_jobs(pk__in=pending)
+            return queryset
+
+        with mock.patch.object(QRCodeJob.objects, "filter", side_effect=listing), \
+                mock.patch.object(process_qr_jobs, "render_document_qr") as render:
+            self.assertEqual(self.worker().run_batch(10), 0)
+        render.assert_not_called()
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.attempts), ("Running", 1))
+
+    def test_stale_running_job_is_requeued(self):
+        fresh = QRCodeJob.objects.create(document=self.make_document(title="Fresh"), status="Running")
+        QRCodeJob.objects.filter(pk=self.job.pk).update(
+            status="Running", updated_at=timezone.now() - timedelta(hours=1)
+        )
+
+        self.worker().requeue_stale(600)
+        self.assertEqual(
+            dict(QRCodeJob.objects.filter(pk__in=[self.job.pk, fresh.pk]).values_list("pk", "status")),
+            {self.job.pk: "Pending", fresh.pk: "Running"},
+        )
+
+
+@benchmark
+class QRTransitionBenchmark(GovFlowTestCase):
+    """
+    Per-transition latency with a QR render on every save (the old behaviour,
+    cold logo) against fingerprint-gated renders. Status and current office
+    are in the payload, so forward and receive still render in both modes;
+    only saves that keep the payload get cheaper.
+    """
+
+    ROUNDS = 20
+
+    def run_rounds(self, document, always_render):
+        timings = {"forward": [], "receive": [], "save, payload unchanged": []}
+        renders = 0
+        for _ in range(self.ROUNDS):
+            steps = [
+                ("forward", lambda: document.forward_to(self.office_a, forwarded_by=self.sender)),
+                ("receive", lambda: document.mark_received(self.office_a, received_by=self.office_a)),
+                ("save, payload unchanged", lambda: document.save()),
+            ]
+            for label, step in steps:
+                started = time.perf_counter()
+                step()
+                if always_render:
+                    load_logo.cache_clear()
+                if always_render or document.qr_is_stale():
+                    # The worker's work minus the file write
+                    build_qr_image(document.qr_payload()).save(BytesIO(), format="PNG")
+                    document.qr_fingerprint = document.compute_qr_fingerprint()
+                    renders += 1
+                timings[label].append(time.perf_counter() - started)
+
+            # Hand the document back so the next round starts from the same state
+            document.current_office = self.sender
+            document.status = "Pending"
+            document.save(update_fields=["current_office", "status"])
+        return timings, renders
+
+    def test_transition_latency(self):
+        document = self.make_document(title="QR benchmark")
+        results = {
+            "before (render every save)": self.run_rounds(document, always_render=True),
+            "after (fingerprint-gated)": self.run_rounds(document, always_render=False),
+        }
+        for mode, (timings, renders) in results.items():
+            report_timings(f"{mode}: {renders} renders", [
+                (step, f"mean {mean(samples) * 1000:8.2f} ms   median {median(samples) * 1000:8.2f} ms")
+                for step, samples in timings.items()
+            ])
+
+        (before, _), (after, after_renders) = results.values()
+        self.assertEqual(after_renders, 2 * self.ROUNDS)  # forward and receive change the payload
+        self.assertLess(median(after["save, payload unchanged"]), median(before["save, payload unchanged"]))
+
+
+class ImportTests(GovFlowTestCase):
+    CSV = (
+        "title,priority,description\n"
+        "Budget request,High,Office supplies\n"
+        ",Low,Missing title\n"
+        "Travel order,routine,Seminar in Manila\n"
+    )
+
+    def upload(self, content, name="documents.csv"):
+        self.client.force_login(self.sender)
+        return self.client.post(reverse("import_documents"), {"file": SimpleUploadedFile(name, content)})
+
+    def test_valid_rows_are_imported_and_invalid_rows_reported(self):
+        response = self.upload(self.CSV.encode("utf-8"))
+        self.assertEqual(response.status_code, 200)
+        documents = Document.objects.filter(sender=self.sender).order_by("tracking_id")
+        self.assertEqual([(d.title, d.priority) for d in documents], [("Budget request", "High"), ("Travel order", "Low")])
+        self.assertEqual(DocumentHistory.objects.filter(document__in=documents, action="Pending").count(), 2)
+
+        report = self.client.get(reverse("import_error_report"))
+        self.assertEqual(report.status_code, 200)
+        self.assertIn("private", report["Cache-Control"])
+        self.assertEqual(report.content.decode().splitlines()[1], "3,title is required,,Low,Missing title")
+
+    def test_error_report_is_only_served_to_the_importer(self):
+        self.upload(self.CSV.encode("utf-8"))
+        self.client.force_login(self.office_a)
+        self.assertEqual(self.client.get(reverse("import_error_report")).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("import_error_report")).status_code, 302)
+
+    def test_clean_import_drops_the_previous_report(self):
+        self.upload(self.CSV.encode("utf-8"))
+        self.upload(b"title,priority,description\nMemo,Low,Circular\n")
+        self.assertEqual(self.client.get(reverse("import_error_report")).status_code, 404)
+
+    def test_non_utf8_csv_imports_nothing(self):
+        content = ("title,priority,description\n" + "Memo,Low,Circular\n" * 3 + "Caf\u00e9 order,Low,x\n").encode("latin-1")
+        with self.assertRaises(importer.ImportFileError):
+            importer.import_documents(BytesIO(content), "documents.csv", self.sender, batch_size=1)
+        # The batches inserted before the bad row are rolled back with their tracking IDs
+        self.assertFalse(Document.objects.exists())
+        self.assertFalse(TrackingSequence.objects.filter(last_number__gt=0).exists())
+
+        response = self.upload(content)
+        self.assertRedirects(response, reverse("new_document"), fetch_redirect_response=False)
+        self.assertFalse(Document.objects.exists())
+
+    def test_corrupt_workbook_imports_nothing(self):
+        response = self.upload(b"not a zip file", name="documents.xlsx")
+        self.assertRedirects(response, reverse("new_document"), fetch_redirect_response=False)
+        self.assertFalse(Document.objects.exists())
+
+    def test_xlsx_import(self):
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(["Title", "Priority", "Description"])
+        sheet.append(["Budget request", "Urgent", "Office supplies"])
+        sheet.append([None, None, None])
+        sheet.append(["Travel order", None, "Seminar"])
+        content = BytesIO()
+        workbook.save(content)
+
+        result = importer.import_documents(BytesIO(content.getvalue()), "documents.xlsx", self.sender)
+        self.assertEqual((result.created, result.failed), (2, 0))
+        self.assertEqual(
+            set(Document.objects.values_list("title", "priority")),
+            {("Budget request", "High"), ("Travel order", "Medium")},
+        )
+
+
+    def test_rows_are_inserted_batch_by_batch(self):
+        read_rows = importer.iter_rows
+        stored_while_reading = []
+
+        def rows(*args):
+            for number, row in read_rows(*args):
+                stored_while_reading.append(Document.objects.count())
+                yield number, row
+
+        content = ("title,priority,description\n" + "Memo,Low,Circular\n" * 6).encode("utf-8")
+        with mock.patch.object(importer, "iter_rows", rows):
+            result = importer.import_documents(BytesIO(content), "documents.csv", self.sender, batch_size=2)
+        self.assertEqual(result.created, 6)
+        self.assertEqual(stored_while_reading, [0, 0, 2, 2, 4, 4])
+
+    def test_error_report_keeps_the_first_rows(self):
+        content = ("title,priority,description\n" + ",Low,Missing title\n" * 4).encode("utf-8")
+        result = importer.import_documents(BytesIO(content), "documents.csv", self.sender, max_errors=2)
+        self.assertEqual(result.failed, 4)
+        self.assertEqual([number for number, _, _ in result.errors], [2, 3])
+
+
+class RetractReportTests(GovFlowTestCase):
+    """Retract rewrites a history entry in place; what was derived from it must follow."""
+
+    def forwarded_document(self):
+        document = self.make_document()
+        document.forward_to(self.office_a, forwarded_by=self.sender)
+        return self.reload(document)
+
+    def test_retract_drops_cached_reports(self):
+        document = self.forwarded_document()
+        now = timezone.now()
+        ReportArtifact.objects.create(
+            user=self.sender, report_type="monthly", period="this-month", format="csv",
+            period_start=now - timedelta(days=1), period_end=now + timedelta(days=1), file="report_cache/month.csv",
+        )
+        ReportArtifact.objects.create(
+            user=self.sender, report_type="document", period=str(document.pk), format="csv",
+            document=document, file="report_cache/document.csv",
+        )
+        ReportArtifact.objects.create(
+            user=self.sender, report_type="monthly", period="last-year", format="csv",
+            period_start=now - timedelta(days=400), period_end=now - timedelta(days=300),
+            file="report_cache/last-year.csv",
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            document.retract_document(retracted_by=self.sender)
+        self.assertEqual(list(ReportArtifact.objects.values_list("period", flat=True)), ["last-year"])
+
+    def rollup(self):
+        fields = ["office_id", "date"] + OfficeDayRollup.COUNT_FIELDS + [
+            "documents_held", "stays_ended", "total_dwell_seconds", "max_dwell_seconds",
+        ]
+        return sorted(OfficeDayRollup.objects.values_list(*fields))
+
+    def test_retract_keeps_rollup_in_step_with_rebuild(self):
+        document = self.forwarded_document()
+        other = self.make_document(title="Still forwarded")
+        other.forward_to(self.office_a, forwarded_by=self.sender)
+        document.retract_document(retracted_by=self.sender)
+        self.reload(document).forward_to(self.office_b, forwarded_by=self.sender)
+
+        row = OfficeDayRollup.objects.get(office=self.office_a)
+        self.assertEqual((row.forwarded_count, row.other_count), (1, 1))
+
+        incremental = self.rollup()
+        call_command("rebuild_dwell_rollup", stdout=StringIO())
+        self.assertEqual(incremental, self.rollup())
+
+
+class ReportJobTests(GovFlowTestCase):
+    """PDF reports are queued per user and rendered by process_report_jobs."""
+
+    MONTH = {"month_year": "2024-01"}
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def enqueue(self, month):
+        return reports.enqueue_report_job(self.sender, "monthly", {"month_year": f"2024-{month:02d}"})
+
+    def test_identical_request_returns_the_queued_job(self):
+        job = reports.enqueue_report_job(self.sender, "monthly", self.MONTH)
+        self.assertEqual(reports.enqueue_report_job(self.sender, "monthly", self.MONTH), job)
+        self.assertEqual(ReportJob.objects.count(), 1)
+
+    def test_per_user_cap(self):
+        for month in (1, 2, 3):
+            self.enqueue(month)
+        with self.assertRaises(reports.ReportError) as raised:
+            self.enqueue(4)
+        self.assertEqual(raised.exception.status, 429)
+
+        # Another user's queue is separate, and a finished job frees a slot
+        reports.enqueue_report_job(self.office_a, "monthly", self.MONTH)
+        ReportJob.objects.filter(user=self.sender).first().fail("boom")
+        self.enqueue(4)
+
+    def test_cap_is_reported_by_the_view(self):
+        self.client.force_login(self.sender)
+        url = reverse("create_report_job", args=["monthly"])
+        for month in (1, 2, 3):
+            self.assertEqual(self.client.post(url, {"month_year": f"2024-{month:02d}"}).status_code, 202)
+        self.assertEqual(self.client.post(url, {"month_year": "2024-04"}).status_code, 429)
+
+    def test_cached_pdf_is_returned_as_a_finished_job(self):
+        job = reports.enqueue_report_job(self.sender, "monthly", self.MONTH)
+        self.assertEqual(reports.run_report_job(job.pk), (job.pk, True))
+        job.refresh_from_db()
+
+        again = reports.enqueue_report_job(self.sender, "monthly", self.MONTH)
+        self.assertNotEqual(again.pk, job.pk)
+        self.assertEqual((again.status, again.progress), ("Done", 100))
+        self.assertEqual(again.artifact.name, job.artifact.name)
+
+    def test_run_renders_the_pdf(self):
+        document = self.make_document()
+        document.forward_to(self.office_a, forwarded_by=self.sender)
+        job = reports.enqueue_report_job(self.sender, "weekly", {})
+
+        self.assertEqual(reports.run_report_job(job.pk), (job.pk, True))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress, job.error), ("Done", 100, ""))
+        with job.artifact.open("rb") as pdf:
+            self.assertEqual(pdf.read(5), b"%PDF-")
+
+    def test_run_records_a_failed_render(self):
+        job = reports.enqueue_report_job(self.sender, "monthly", self.MONTH)
+        with mock.patch.object(reports, "render_pdf", side_effect=RuntimeError("Error generating PDF")):
+            self.assertEqual(reports.run_report_job(job.pk), (job.pk, False))
+        job.refresh_from_db()
+        self.assertEqual(job.status, "Failed")
+        self.assertIn("Error generating PDF", job.error)
+
+    def test_pdf_render_keeps_the_heartbeat_going(self):
+        def slow_render(html, dest):
+            time.sleep(0.3)
+            return mock.Mock(err=0)
+
+        beats = []
+        report = reports.Report(self.sender, "monthly", self.MONTH)
+        with mock.patch.object(reports, "PDF_HEARTBEAT_INTERVAL", 0.05), \
+                mock.patch.object(reports.pisa, "CreatePDF", slow_render):
+            reports.render_pdf(report, BytesIO(), progress=beats.append)
+        self.assertGreater(beats.count(70), 2)
+
+    def test_claim_takes_each_job_once(self):
+        first = self.enqueue(1)
+        second = self.enqueue(2)
+        worker = ReportWorker()
+        self.assertEqual(worker.claim(1), [first.pk])
+        self.assertEqual(worker.claim(5), [second.pk])
+        self.assertEqual(worker.claim(5), [])
+        self.assertEqual(set(ReportJob.objects.values_list("status", flat=True)), {"Running"})
+
+    def test_claim_skips_a_job_taken_by_another_worker(self):
+        job = self.enqueue(1)
+        filter_jobs = ReportJob.objects.filter
+
+        def listing(*args, **kwargs):
+            if kwargs == {"status": "Pending"}:
+                # Another worker claims the job right after this one listed it
+                pending = list(filter_jobs(**kwargs).values_list("pk", flat=True))
+                filter_jobs(pk__in=pending).update(status="Running")
+                return filter_jobs(pk__in=pending)
+            return filter_jobs(*args, **kwargs)
+
+        with mock.patch.object(ReportJob.objects, "filter", side_effect=listing):
+            self.assertEqual(ReportWorker().claim(5), [])
+        self.assertEqual(ReportJob.objects.get(pk=job.pk).status, "Running")
+
+    def test_requeue_stale_running_jobs(self):
+        stale, busy, fresh = self.enqueue(1), self.enqueue(2), self.enqueue(3)
+        ReportJob.objects.update(status="Running", progress=70)
+        ReportJob.objects.filter(pk__in=[stale.pk, busy.pk]).update(
+            updated_at=timezone.now() - timedelta(hours=1)
+        )
+
+        ReportWorker().requeue_stale(900, exclude=[busy.pk])
+        statuses = dict(ReportJob.objects.values_list("pk", "status"))
+        self.assertEqual(statuses, {stale.pk: "Pending", busy.pk: "Running", fresh.pk: "Running"})
+        self.assertEqual(ReportJob.objects.get(pk=stale.pk).progress, 0)
+
+    def test_status_and_download_are_owner_only(self):
+        job = reports.enqueue_report_job(self.sender, "monthly", self.MONTH)
+        status_url = reverse("report_job_status", args=[job.pk])
+        download_url = reverse("report_job_download", args=[job.pk])
+
+        self.client.force_login(self.sender)
+        self.assertEqual(self.client.get(status_url).json()["status"], "Pending")
+        self.assertEqual(self.client.get(download_url).status_code, 404)  # not rendered yet
+
+        reports.run_report_job(job.pk)
+        payload = self.client.get(status_url).json()
+        self.assertEqual(payload["download_url"], download_url)
+        response = self.client.get(download_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content)[:5], b"%PDF-")
+
+        self.client.force_login(self.office_a)
+        self.assertEqual(self.client.get(status_url).status_code, 404)
+        self.assertEqual(self.client.get(download_url).status_code, 404)
+
+
+class InlineExecutor:
+    """Stands in for ProcessPoolExecutor: runs each task on submit, in this process and transaction."""
+
+    def __init__(self, **options):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+class PrecomputeReportsTests(GovFlowTestCase):
+    MONTH = "2024-01"
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Workers close their connections when done; that would end the test transaction
+        connections = mock.patch.object(precompute_reports, "connections")
+        connections.start()
+        self.addCleanup(connections.stop)
+
+    def precompute(self, force=False):
+        return precompute_reports.precompute_user(self.sender.pk, self.MONTH, ["csv", "xlsx"], force)
+
+    def test_only_closed_months(self):
+        this_month = f"{timezone.localdate():%Y-%m}"
+        for month in (this_month, "2024-13", "January"):
+            with self.subTest(month), self.assertRaises(CommandError):
+                call_command("precompute_reports", month=month, stdout=StringIO())
+
+    def test_stored_reports_are_skipped(self):
+        user_id, timings, error = self.precompute()
+        self.assertEqual((user_id, error), (self.sender.pk, None))
+        self.assertTrue(all(seconds is not None for seconds in timings.values()), timings)
+        stored = set(ReportArtifact.objects.values_list("format", "file"))
+        self.assertEqual({fmt for fmt, _ in stored}, {"csv", "xlsx"})
+
+        # A re-run (e.g. after an interruption) renders nothing again
+        self.assertEqual(self.precompute(), (self.sender.pk, {"csv": None, "xlsx": None}, None))
+        self.assertEqual(set(ReportArtifact.objects.values_list("format", "file")), stored)
+
+    def test_force_rerenders(self):
+        self.precompute()
+        _, timings, error = self.precompute(force=True)
+        self.assertIsNone(error)
+        self.assertTrue(all(seconds is not None for seconds in timings.values()), timings)
+        self.assertEqual(ReportArtifact.objects.filter(user=self.sender).count(), 2)
+
+    def test_prints_per_user_timings(self):
+        def run():
+            out = StringIO()
+            with mock.patch.object(precompute_reports, "ProcessPoolExecutor", InlineExecutor):
+                call_command("precompute_reports", month=self.MONTH, formats=["csv"], stdout=out)
+            return out.getvalue()
+
+        users = User.objects.filter(is_active=True).count()
+        output = run()
+        self.assertRegex(output, rf"user {self.sender.pk}: csv \d+\.\d\ds")
+        self.assertIn(f"{users} rendered, 0 already stored, 0 failed", output)
+
+        output = run()
+        self.assertIn(f"user {self.sender.pk}: csv cached", output)
+        self.assertIn(f"0 rendered, {users} already stored, 0 failed", output)
+
+
+class ReportDwellTests(TestCase):
+    """Each report row's next timestamp, computed in one scan instead of one query per row."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.start, cls.end = seed_history(4000)
+
+    def next_timestamps(self, use_window):
+        return [
+            (h.pk, next_timestamp)
+            for h, next_timestamp in report_histories(self.user, self.start, self.end, use_window=use_window)
+        ]
+
+    def test_window_and_fallback_agree(self):
+        if not connection.features.supports_over_clause:
+            self.skipTest("database has no window functions")
+        rows = self.next_timestamps(use_window=True)
+        self.assertTrue(rows)
+        self.assertEqual(rows, self.next_timestamps(use_window=False))
+
+    def test_matches_the_per_row_query(self):
+        rows = self.next_timestamps(use_window=None)
+        histories = DocumentHistory.objects.in_bulk([pk for pk, _ in rows])
+        for pk, next_timestamp in rows[:300]:
+            h = histories[pk]
+            following = DocumentHistory.objects.filter(
+                document=h.document_id, timestamp__gt=h.timestamp
+            ).order_by("timestamp").first()
+            self.assertEqual(next_timestamp, following.timestamp if following else None, pk)
+
+    def test_one_query_for_the_whole_report(self):
+        for use_window in (True, False):
+            if use_window and not connection.features.supports_over_clause:
+                continue
+            with self.subTest(use_window=use_window), self.assertNumQueries(1):
+                self.next_timestamps(use_window)
+
+
+@benchmark
+class ReportDwellBenchmark(TestCase):
+    """
+    Time the days-stayed scan with the LEAD() window and with the sorted-pass
+    fallback over seeded histories of each size in GOVFLOW_DWELL_SIZES.
+    """
+
+    SIZES = [int(size) for size in os.environ.get("GOVFLOW_DWELL_SIZES", "10000,100000,1000000").split(",")]
+
+    def time_scan(self, user, start, end, use_window):
+        best = None
+        for _ in range(2):  # the first pass also warms the database cache
+            started = time.perf_counter()
+            rows = sum(1 for _ in report_histories(user, start, end, use_window=use_window))
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return rows, best
+
+    def test_window_against_fallback(self):
+        modes = [False]
+        if connection.features.supports_over_clause:
+            modes.insert(0, True)
+        timings = []
+        for size in self.SIZES:
+            sid = transaction.savepoint()
+            user, start, end = seed_history(size)
+            counts = set()
+            for use_window in modes:
+                rows, elapsed = self.time_scan(user, start, end, use_window)
+                counts.add(rows)
+                timings.append((
+                    f"{size:>9} history rows, {'window' if use_window else 'fallback'}",
+                    f"{rows:>8} report rows in {elapsed:7.2f} s",
+                ))
+            self.assertEqual(len(counts), 1, f"modes disagree at {size} rows")
+            transaction.savepoint_rollback(sid)
+        report_timings(f"days-stayed scan on {connection.vendor}", timings)
+
+
+class ReportExportMemoryTests(TestCase):
+    """
+    The CSV and XLSX report exports stream rows, so their memory use stops
+    growing once the first chunks are in flight. Peak traced allocations are
+    compared rather than RSS, which in a test process includes memory that
+    earlier tests freed.
+    """
+
+    ROWS = 16_000
+    CHECKPOINT = 2500  # past the first 2000-row fetch from the cursor
+    MAX_GROWTH = 512 * 1024  # keeping the rows costs ~1.5 MB by the end of this report
+
+    @classmethod
+    def setUpTestData(cls):
+        # A single office, so every seeded row in the period is in its report
+        cls.user, cls.start, cls.end = seed_history(cls.ROWS, offices=1)
+
+    def assert_flat(self, export):
+        """Run `export` over the report; the peak must not grow after CHECKPOINT rows."""
+        checkpoint_peak = None
+
+        def rows():
+            nonlocal checkpoint_peak
+            report = iter_report_rows(report_histories(self.user, self.start, self.end), timezone.now())
+            for number, row in enumerate(report, start=1):
+                if number == self.CHECKPOINT:
+                    checkpoint_peak = tracemalloc.get_traced_memory()[1]
+                yield row
+
+        tracemalloc.start()
+        try:
+            export(rows())
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        self.assertIsNotNone(checkpoint_peak, "report is shorter than the checkpoint")
+        growth = peak - checkpoint_peak
+        self.assertLess(growth, self.MAX_GROWTH, f"peak grew by {growth / 2 ** 20:.1f} MB after the checkpoint")
+
+    def test_csv_export(self):
+        self.assert_flat(lambda rows: sum(1 for _ in iter_csv(rows)))
+
+    def test_xlsx_export(self):
+        self.assert_flat(lambda rows: write_xlsx(rows).close())
+
+
+# Runs one export in a fresh interpreter against the test database and prints
+# the process's peak RSS, so nothing earlier tests allocated is counted
+EXPORT_RSS_SCRIPT = """
+import itertools, json, os, resource, sys
+import django
+django.setup()
+from django.db import connection
+connection.settings_dict["NAME"] = os.environ["GOVFLOW_TEST_DB"]
+from datetime import datetime
+from django.contrib.auth.models import User
+from django.utils import timezone
+from GovFlowApp.reports import iter_csv, iter_report_rows, report_histories, write_xlsx
+
+user = User.objects.get(pk=int(sys.argv[1]))
+start, end = datetime.fromisoformat(sys.argv[2]), datetime.fromisoformat(sys.argv[3])
+rows = itertools.islice(
+    iter_report_rows(report_histories(user, start, end), timezone.now()), int(sys.argv[5])
+)
+exported = 0
+
+def counted(rows):
+    global exported
+    for exported, row in enumerate(rows, start=1):
+        yield row
+
+if sys.argv[4] == "csv":
+    for _ in iter_csv(counted(rows)):
+        pass
+else:
+    write_xlsx(counted(rows)).close()
+try:
+    # Linux: ru_maxrss of a forked child starts from the parent's peak; VmHWM is reset by exec
+    with open("/proc/self/status") as status:
+        peak = next(int(line.split()[1]) * 1024 for line in status if line.startswith("VmHWM:"))
+except OSError:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # bytes on macOS
+print(json.dumps({"rows": exported, "peak_rss": peak}))
+"""
+
+
+@benchmark
+class ReportExportRSSBenchmark(TransactionTestCase):
+    """
+    Peak RSS of a full-size export, measured in a subprocess: a
+    GOVFLOW_EXPORT_ROWS-row report (default 1M) must peak within MAX_GROWTH of
+    a 10k-row one. Needs a database a second process can open.
+    """
+
+    ROWS = int(os.environ.get("GOVFLOW_EXPORT_ROWS", 1_000_000))
+    BASELINE_ROWS = 10_000
+    MAX_GROWTH = 64 * 2 ** 20  # holding 1M rows in lists would take well over 1 GB
+
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("needs PostgreSQL or a file-backed SQLite test database")
+
+    def export(self, user, fmt, rows):
+        # A window around all seeded history, so the report has every row
+        start, end = timezone.now() - timedelta(days=90), timezone.now() + timedelta(days=30)
+        result = subprocess.run(
+            [sys.executable, "-c", EXPORT_RSS_SCRIPT, str(user.pk), start.isoformat(), end.isoformat(), fmt, str(rows)],
+            cwd=settings.BASE_DIR, env={**os.environ, "GOVFLOW_TEST_DB": connection.settings_dict["NAME"]},
+            capture_output=True, text=True, check=True,
+        )
+        return json.loads(result.stdout.splitlines()[-1])
+
+    def test_csv_and_xlsx_exports(self):
+        # One office, so every seeded row is in its report
+        user, _, _ = seed_history(self.ROWS, offices=1)
+        for fmt in ("csv", "xlsx"):
+            with self.subTest(fmt):
+                baseline = self.export(user, fmt, self.BASELINE_ROWS)
+                full = self.export(user, fmt, self.ROWS)
+                report_timings(f"{fmt} export peak RSS", [
+                    (f"{result['rows']} rows", f"{result['peak_rss'] / 2 ** 20:8.1f} MiB")
+                    for result in (baseline, full)
+                ])
+                self.assertEqual(full["rows"], self.ROWS)
+                growth = full["peak_rss"] - baseline["peak_rss"]
+                self.assertLess(growth, self.MAX_GROWTH, f"peak RSS grew by {growth / 2 ** 20:.1f} MiB")
+
+class QueryPlanTests(TestCase):
+    """EXPLAIN the filters the views and context processors run on every request."""
+
+    @classmethod
+    def setUpTestData(cls):
+        random.seed(2)
+        now = timezone.now()
+        users = User.objects.bulk_create([
+            User(username=f"plan-seed-{i}", first_name="Seed", last_name=str(i)) for i in range(20)
+        ])
+        statuses = [choice for choice, _ in Document.STATUS_CHOICES]
+        priorities = [choice for choice, _ in Document.PRIORITY_CHOICES]
+        documents = Document.objects.bulk_create([
+            Document(
+                tracking_id=f"SEED-{i:06d}",
+                sender=random.choice(users),
+                current_office=random.choice(users),
+                title=f"Seeded document {i}",
+                description="",
+                status=random.choice(statuses),
+                priority=random.choice(priorities),
+            )
+            for i in range(1000)
+        ])
+        DocumentHistory.objects.bulk_create([
+            DocumentHistory(
+                document=document,
+                action=random.choice(["Forwarded", "Received", "Returned", "Status Update"]),
+                from_office=random.choice(users),
+                to_office=random.choice(users),
+                performed_by=document.sender,
+            )
+            for document in documents for _ in range(4)
+        ], batch_size=1000)
+        Notification.objects.bulk_create([
+            Notification(
+                recipient=random.choice(users),
+                message=f"Document {document.tracking_id} was forwarded to you.",
+                is_read=random.random() < 0.8,
+            )
+            for document in documents
+        ], batch_size=1000)
+        # auto_now_add stamps everything with "now"; spread the rows out a little
+        Document.objects.filter(pk__in=[d.pk for d in documents[::2]]).update(created_at=now - timedelta(days=30))
+        cls.user, cls.document = users[0], documents[0]
+
+    def hot_queries(self):
+        user, document = self.user, self.document
+        return [
+            ("history by document/action", DocumentHistory.objects.filter(
+                document=document, action="Forwarded").order_by("-timestamp")),
+            ("incoming routing for office", DocumentHistory.objects.filter(
+                to_office=user, action__in=["Forwarded", "Returned"]).order_by("-timestamp")),
+            ("documents by status", Document.objects.filter(
+                status="Completed").order_by("-created_at")),
+            ("documents held by office", Document.objects.filter(
+                current_office=user, status="In Transit")),
+            ("documents by priority", Document.objects.filter(
+                priority="High").order_by("-created_at")),
+            ("unread notifications", Notification.objects.filter(
+                recipient=user, is_read=False).order_by("-created_at")[:5]),
+        ]
+
+    @staticmethod
+    def has_seq_scan(plan, table):
+        table = re.escape(table)
+        if connection.vendor == "postgresql":
+            return re.search(rf'Seq Scan on "?{table}"?', plan) is not None
+        # SQLite: "SCAN table" without "USING [COVERING] INDEX" is a full table scan
+        return any(
+            re.search(rf"\bSCAN {table}\b", line) and "USING" not in line for line in plan.splitlines()
+        )
+
+    def test_hot_queries_use_an_index(self):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+                # Ask "is there an index that can serve this?" independent of table size
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        for label, queryset in self.hot_queries():
+            with self.subTest(label):
+                plan = queryset.explain()
+                self.assertFalse(self.has_seq_scan(plan, queryset.model._meta.db_table), plan)
+
+
+class TrackingIdConcurrencyTests(TransactionTestCase):
+    """Register documents from many threads at once: no gaps, no collisions."""
+
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            # Shared-cache in-memory SQLite fails concurrent writers instead of queueing them
+            self.skipTest("needs PostgreSQL or a file-backed SQLite test database")
+        self.year = timezone.localdate().year
+        self.sender = make_user("sender")
+
+    def register_concurrently(self, tasks, threads=8):
+        def run(task):
+            try:
+                task()
+            finally:
+                connection.close()  # each worker thread has its own connection
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(run, tasks))
+
+    def register_one(self):
+        Document.objects.create(sender=self.sender, title="Registered concurrently", description="")
+
+    def register_block(self, size):
+        # As bulk registration does: reserve a block, then insert it in one go
+        Document.objects.bulk_create([
+            Document(
+                tracking_id=tracking_id, sender=self.sender, current_office=self.sender,
+                title="Registered in a block", description="",
+            )
+            for tracking_id in TrackingSequence.next_tracking_ids(size)
+        ])
+
+    def assert_stored_contiguous(self, first, last):
+        stored = list(Document.objects.values_list("tracking_id", flat=True))
+        self.assertEqual(len(stored), len(set(stored)), "duplicate tracking IDs")
+        self.assertEqual(sorted(stored), [f"TRK-{self.year}-{number:05d}" for number in range(first, last + 1)])
+
+    def test_single_registrations(self):
+        self.register_concurrently([self.register_one] * 200)
+        self.assert_stored_contiguous(1, 200)
+
+    def test_single_and_block_registrations_interleave(self):
+        tasks = [self.register_one, lambda: self.register_block(20)] * 25
+        self.register_concurrently(tasks)
+        self.assert_stored_contiguous(1, 25 * 21)
+
+    def test_counter_continues_after_existing_ids(self):
+        Document.objects.create(
+            tracking_id=f"TRK-{self.year}-00041", sender=self.sender, title="Registered before the counter",
+            description="",
+        )
+        self.register_concurrently([self.register_one] * 20)
+        self.assert_stored_contiguous(41, 61)
@@ -0,0 +1,70 @@
+"""
+Per-user unread notification counts for the header badge.
+
+The count lives in the shared cache and is adjusted by +n/-n after each
+committed create, mark-read or delete, so rendering the badge normally costs
+no query at all. A missing entry is recounted from the database on the next
+read; every entry expires NOTIFICATION_COUNT_TTL seconds after it last
+changed, which bounds how long a missed adjustment (a crashed worker, a raw
+bulk insert) can show to a quiet user, and the reconcile_unread_counts command
+recounts everyone in one query.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .events import publish
+
+
+KEY = "govflow:unread:{}"
+
+
+def _key(user_id):
+    return KEY.format(user_id)
+
+
+def _timeout():
+    return getattr(settings, "NOTIFICATION_COUNT_TTL", 900)
+
+
+def unread_count(user):
+    """Return the user's unread count, counting in the database only on a cache miss."""
+    count = cache.get(_key(user.pk))
+    if count is None:
+        from .models import Notification
+
+        count = Notification.objects.filter(recipient=user, is_read=False).count()
+        # add(), not set(): don't overwrite a count another request cached meanwhile
+        cache.add(_key(user.pk), count, timeout=_timeout())
+    return count
+
+
+def _apply(deltas):
+    for user_id, delta in deltas.items():
+        try:
+            count = cache.incr(_key(user_id), delta)
+        except ValueError:
+            # Not cached: the next read counts from the database anyway
+            continue
+        if count < 0:
+            cache.delete(_key(user_id))
+        else:
+            # The file cache's incr() rewrites the entry with the default 300 s
+            # timeout; touch() restores ours without overwriting the value
+            cache.touch(_key(user_id), timeout=_timeout())
+
+
+def adjust_unread(deltas):
+    """
+    Apply {user_id: delta} to the cached counts once the current transaction
+    commits, and wake those users' open notification streams; nothing changes
+    if it rolls back.
+    """
+    deltas = {user_id: delta for user_id, delta in deltas.items() if user_id and delta}
+    if deltas:
+        transaction.on_commit(lambda: (_apply(deltas), publish(deltas)))
+
+
+def store_unread_counts(counts):
+    """Overwrite the cached counts with freshly counted {user_id: count} values."""
+    cache.set_many({_key(user_id): count for user_id, count in counts.items()}, timeout=_timeout())
@@ -11,15 +11,22 @@ urlpatterns = [
     path('dashboard/', views.dashboard, name='dashboard'),
     path('documents/', views.all_documents, name='all_documents'),
     path('documents/new/', views.new_document, name='new_document'),
+    path('documents/import/', views.import_documents, name='import_documents'),
+    path('documents/import/errors/', views.import_error_report, name='import_error_report'),
+    path('documents/search/', views.document_search_api, name='document_search_api'),
     path('documents/<int:pk>/', views.document_detail, name='document_detail'),
     path("delete/<int:pk>/", views.delete_document, name="delete_document"),
     path('documents/<int:pk>/forward/', views.forward_document, name='forward_document'),
+    path('documents/bulk-route/', views.bulk_route_documents, name='bulk_route_documents'),
     path('documents/receive/', views.receive_document, name='receive_document'),
     path("receive/", views.receive_page, name="receive_page"),
     path("receive/submit/", views.receive_document, name="receive_document"),
+    path("receive/batch/", views.receive_batch, name="receive_batch"),
     path('documents/routing-slip/<int:pk>/', views.routing_slip_partial, name='routing_slip_partial'),
+    path('documents/qr/<str:tracking_id>/', views.document_qr, name='document_qr'),
     path("notifications/read/<int:pk>/", views.mark_notification_read, name="mark_notification_read"),
     path("notifications/api/", views.notifications_api, name="notifications_api"),
+    path("notifications/stream/", views.notification_stream, name="notification_stream"),
     path("notifications/mark-all-read/", views.mark_all_notifications_read, name="mark_all_notifications_read"),
     path("documents/<int:pk>/return/", views.return_document, name="return_document"),
     path("documents/<int:pk>/complete/", views.complete_document, name="complete_document"),
@@ -30,6 +37,10 @@ urlpatterns = [
     path("document/<int:document_id>/add_status/", views.add_status, name="add_status"),
     # path("reports/api/<str:report_type>/", views.document_report_api, name="document_report_api"),
     path("reports/api/<str:report_type>/", views.document_report_api, name="document_report_api"),
+    path("reports/office-dwell/", views.office_dwell_api, name="office_dwell_api"),
+    path("reports/jobs/new/<str:report_type>/", views.create_report_job, name="create_report_job"),
+    path("reports/jobs/<int:pk>/", views.report_job_status, name="report_job_status"),
+    path("reports/jobs/<int:pk>/download/", views.report_job_download, name="report_job_download"),
     path('users/',                 views.user_management,        name='user_management'),
     path('users/add/',             views.user_management_add,    name='user_management_add'),
     path('users/<int:pk>/edit/',   views.user_management_edit,   name='user_management_edit'),
@@ -3,31 +3,34 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
 from django.core.paginator import Paginator
+from django.db import transaction
 from django.db.models import Q, OuterRef, Subquery
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
-from datetime import timedelta, datetime
-from collections import defaultdict
+from asgiref.sync import sync_to_async
+import asyncio
 import datetime as datetime_module
-import pandas as pd
-from io import BytesIO
-from xhtml2pdf import pisa
+from datetime import date, timedelta
+import json
+import re
+from io import StringIO
 from .forms import UserProfileForm
-from .models import Document, DocumentHistory, Notification, UserProfile
+from .models import Document, DocumentHistory, Notification, ReportJob, UserProfile
+from .qr import QR_FORMATS, QR_SIZES, get_qr_bytes, qr_cache_key
+from .conditional import conditional_poll
+from .directory import directory_version, office_directory
+from .notifications import notify, notify_many
+from .search import rank_documents, search_documents
+from .summaries import document_summary, user_summary
+from .unread import adjust_unread, unread_count
+from . import events, importer, reports
 
 # Create your views here.
 
-def notify(user, message, url=""):
-    if user:
-        Notification.objects.create(
-            recipient=user,
-            message=message,
-            url=url
-        )
-
 def create_user(request):
     if request.method == "POST":
         form = UserProfileForm(request.POST)
@@ -87,11 +90,12 @@ def user_management(request):
             Q(userprofile__position__icontains=search_query)
         )
 
-    # Stats (from filtered queryset)
-    total_users    = users_qs.count()
-    active_users   = users_qs.filter(is_active=True).count()
-    inactive_users = users_qs.filter(is_active=False).count()
-    admin_users    = users_qs.filter(is_staff=True).count()
+    # Stats (from filtered queryset, one aggregate query)
+    summary = user_summary(users_qs)
+    total_users    = summary['total']
+    active_users   = summary['active']
+    inactive_users = summary['inactive']
+    admin_users    = summary['admins']
 
     # Pagination
     paginator = Paginator(users_qs, per_page)
@@ -363,18 +367,9 @@ def homepage(request):
     # Redirect admins to create_user
     if request.user.is_staff:
         return redirect('create_user')
-    
-    # Fetch unread notifications for the current user
-    notifications = Notification.objects.filter(
-        recipient=request.user,
-        is_read=False
-    ).order_by("-created_at")[:5]
-    
-    context = {
-        'notifications': notifications
-    }
 
-    return render(request, 'homepage.html', context)
+    # The notification dropdown comes from the notifications context processor
+    return render(request, 'homepage.html')
 
 # @login_required(login_url='loginpage')
 # def dashboard(request):
@@ -424,33 +419,25 @@ def dashboard(request):
 
     # Only apply search if query is 3 or more characters
     if len(search_query) >= 3:
-        user_documents = user_documents.filter(
-            Q(tracking_id__icontains=search_query) |
-            Q(title__icontains=search_query) |
-            Q(sender__first_name__icontains=search_query) |
-            Q(sender__last_name__icontains=search_query)
-        )
+        user_documents = search_documents(user_documents, search_query)
     else:
         search_query = ""
 
-    # Summary counts
-    total_documents = user_documents.count()
-    in_progress = user_documents.filter(status__in=['Pending', 'In Transit', 'Returned']).count()
-    received = user_documents.filter(status='Received').count()
-    high_priority = user_documents.filter(priority='High').count()
+    # Summary counts (one aggregate query)
+    summary = document_summary(user_documents)
+    total_documents = summary['total']
+    in_progress = summary['in_progress']
+    received = summary['received']
+    high_priority = summary['high_priority']
 
     # Recent documents
     if search_query:
-        recent_documents = user_documents.order_by('-created_at')
+        recent_documents = rank_documents(user_documents, search_query)
     else:
         recent_documents = user_documents.order_by('-created_at')[:6]
 
-    # Departments for forwarding modal
-    departments = defaultdict(list)
-    all_users = User.objects.select_related("userprofile").all()
-    for u in all_users:
-        if hasattr(u, "userprofile") and u.userprofile.department:
-            departments[u.userprofile.department].append(u)
+    # Departments for forwarding modal (cached per process, see directory.py)
+    departments = office_directory()
 
     context = {
         "total_documents": total_documents,
@@ -458,7 +445,7 @@ def dashboard(request):
         "received": received,
         "high_priority": high_priority,
         "recent_documents": recent_documents,
-        "departments": dict(departments),
+        "departments": departments,
         "search_query": search_query,
     }
 
@@ -496,52 +483,46 @@ def all_documents(request):
 
     # Apply search only if >=3 characters
     if len(search_query) >= 3:
-        documents = documents.filter(
-            Q(tracking_id__icontains=search_query) |
-            Q(title__icontains=search_query) |
-            Q(sender__first_name__icontains=search_query) |
-            Q(sender__last_name__icontains=search_query)
-        )
+        documents = search_documents(documents, search_query)
     elif search_query and len(search_query) < 3:
         search_query = ""
 
     # Store original queryset for summary stats (before pagination)
     all_documents_queryset = documents
     
-    # Get all status counts for summary cards
-    total_count = all_documents_queryset.count()
-    pending_count = all_documents_queryset.filter(status='Pending').count()
-    in_transit_count = all_documents_queryset.filter(status='In Transit').count()
-    received_count = all_documents_queryset.filter(status='Received').count()
-    returned_count = all_documents_queryset.filter(status='Returned').count()
-    completed_count = all_documents_queryset.filter(status='Completed').count()
-    high_priority_count = all_documents_queryset.filter(priority='High').count()
+    # Get all status counts for summary cards (one aggregate query)
+    summary = document_summary(all_documents_queryset)
+    total_count = summary['total']
+    pending_count = summary['pending']
+    in_transit_count = summary['in_transit']
+    received_count = summary['received']
+    returned_count = summary['returned']
+    completed_count = summary['completed']
+    high_priority_count = summary['high_priority']
     
     # For alert panels (get recent items)
     high_priority_docs = all_documents_queryset.filter(priority='High').order_by('-created_at')[:5]
     pending_docs = all_documents_queryset.filter(status='Pending').order_by('-created_at')[:5]
     in_transit_docs = all_documents_queryset.filter(status='In Transit').order_by('-created_at')[:5]
 
+    # Best matches first when searching
+    if search_query:
+        documents = rank_documents(documents, search_query)
+
     # Pagination
     page_number = request.GET.get('page', 1)
     paginator = Paginator(documents, per_page)
     page_obj = paginator.get_page(page_number)
 
-    # GROUP USERS BY DEPARTMENT
-    from collections import defaultdict
-    departments = defaultdict(list)
-
-    all_users = User.objects.select_related("userprofile").all()
-    for u in all_users:
-        if hasattr(u, "userprofile") and u.userprofile.department:
-            departments[u.userprofile.department].append(u)
+    # GROUP USERS BY DEPARTMENT (cached per process, see directory.py)
+    departments = office_directory()
 
     context = {
         'documents': page_obj,
         'status_filter': status_filter,
         'priority_filter': priority_filter,
         'paginator': paginator,
-        'departments': dict(departments),
+        'departments': departments,
         'search_query': search_query,
         'per_page': per_page,
         
@@ -580,7 +561,8 @@ def complete_document(request, pk):
             notify(
                 document.sender,
                 f"Your document {document.title} with tracking ID {document.tracking_id} was finalized by {request.user.get_full_name()}.",
-                url=reverse("document_detail", kwargs={"pk": document.pk})
+                url=reverse("document_detail", kwargs={"pk": document.pk}),
+                kind="finalized"
             )
 
         messages.success(request, f"Document {document.title} with tracking ID {document.tracking_id} has been finalized.")
@@ -595,7 +577,7 @@ def completed_documents(request):
     user = request.user
     priority_filter = request.GET.get('priority', 'All')
     sender_filter = request.GET.get('sender', 'All')
-    search_query = request.GET.get('q', '')
+    search_query = request.GET.get('q', '').strip()
 
     # Admins/superusers see ALL completed documents
     if user.is_staff or user.is_superuser:
@@ -623,17 +605,15 @@ def completed_documents(request):
 
     # Apply search filter
     if search_query:
-        documents_qs = documents_qs.filter(
-            Q(tracking_id__icontains=search_query) |
-            Q(title__icontains=search_query) |
-            Q(sender__first_name__icontains=search_query) |
-            Q(sender__last_name__icontains=search_query)
-        )
+        documents_qs = rank_documents(search_documents(documents_qs, search_query), search_query)
 
-    paginator = Paginator(documents_qs, 15)
+    # The table shows each row's sender and current office
+    paginator = Paginator(documents_qs.select_related('sender', 'current_office'), 15)
     page_number = request.GET.get('page')
     documents = paginator.get_page(page_number)
 
+    summary = document_summary(base_qs)
+
     if user.is_staff or user.is_superuser:
         all_senders = User.objects.filter(document__status='Completed').distinct()
     else:
@@ -645,9 +625,9 @@ def completed_documents(request):
         'search_query': search_query,
         'sender_filter': sender_filter,
         'all_senders': all_senders,
-        'high_count': base_qs.filter(priority='High').count(),
-        'medium_count': base_qs.filter(priority='Medium').count(),
-        'low_count': base_qs.filter(priority='Low').count(),
+        'high_count': summary['high_priority'],
+        'medium_count': summary['medium_priority'],
+        'low_count': summary['low_priority'],
     }
     return render(request, 'completed_documents.html', context)
 
@@ -673,6 +653,102 @@ def new_document(request):
     # No need to pass 'users' if they are not used in the form
     return render(request, 'new_document.html')
 
+
+IMPORT_ERROR_REPORT_KEY = "import_error_report"
+IMPORT_ERROR_REPORT_ROWS = 5000  # keeps the session row small
+
+
+@login_required(login_url='loginpage')
+def import_documents(request):
+    """Bulk registration from an uploaded CSV/Excel file (title, priority, description)."""
+    upload = request.FILES.get("file")
+    if request.method != "POST" or not upload:
+        messages.error(request, "Please choose a CSV or Excel file to import.")
+        return redirect("new_document")
+
+    if not upload.name.lower().endswith(importer.IMPORT_EXTENSIONS):
+        messages.error(request, "Only .csv and .xlsx files can be imported.")
+        return redirect("new_document")
+
+    try:
+        result = importer.import_documents(
+            upload, upload.name, request.user, max_errors=IMPORT_ERROR_REPORT_ROWS
+        )
+    except importer.ImportFileError as error:
+        messages.error(request, f"{error} Nothing was imported.")
+        return redirect("new_document")
+
+    # The report holds row contents, so it stays in the user's session (replaced
+    # by the next import, gone at logout) instead of a public media URL
+    request.session.pop(IMPORT_ERROR_REPORT_KEY, None)
+    if result.errors:
+        report = StringIO()
+        importer.write_error_report(result.errors, report)
+        request.session[IMPORT_ERROR_REPORT_KEY] = report.getvalue()
+
+    if result.created:
+        messages.success(request, f"{result.created} documents registered successfully.")
+    if result.errors:
+        messages.warning(request, f"{result.failed} rows could not be imported.")
+        if result.failed > IMPORT_ERROR_REPORT_ROWS:
+            messages.warning(request, f"The error report lists the first {IMPORT_ERROR_REPORT_ROWS} of them.")
+
+    context = {
+        "import_result": result,
+        "error_file_url": reverse("import_error_report") if result.errors else None,
+    }
+    return render(request, 'new_document.html', context)
+
+
+@login_required(login_url='loginpage')
+def import_error_report(request):
+    """Download the error report of the current user's last import."""
+    report = request.session.get(IMPORT_ERROR_REPORT_KEY)
+    if report is None:
+        raise Http404("No import error report.")
+    response = HttpResponse(report, content_type="text/csv")
+    response["Content-Disposition"] = "attachment; filename=import_errors.csv"
+    response["Cache-Control"] = "private, no-store"
+    return response
+
+DOCUMENT_SEARCH_PAGE_SIZE = 20
+
+
+@login_required
+def document_search_api(request):
+    """
+    Typeahead for the per-document report picker: the user's documents whose
+    tracking ID or title starts with `q`, newest first, one page at a time.
+    """
+    query = request.GET.get("q", "").strip()
+    try:
+        page = max(1, int(request.GET.get("page", 1)))
+    except ValueError:
+        page = 1
+
+    documents = Document.objects.filter(Q(sender=request.user) | Q(current_office=request.user))
+    if query:
+        # Prefix matches only, so the tracking_id and title indexes can serve them
+        prefix = query.upper()
+        match = Q(tracking_id__startswith=prefix) | Q(title__istartswith=query)
+        if not prefix.startswith("TRK-"):
+            match |= Q(tracking_id__startswith=f"TRK-{prefix}")  # "2026-00012" finds TRK-2026-00012
+        documents = documents.filter(match)
+
+    offset = (page - 1) * DOCUMENT_SEARCH_PAGE_SIZE
+    rows = list(
+        documents.order_by("-created_at")
+        .values("id", "tracking_id", "title")[offset:offset + DOCUMENT_SEARCH_PAGE_SIZE + 1]
+    )
+    return JsonResponse({
+        "results": [
+            {"id": row["id"], "text": f'{row["tracking_id"]} - {row["title"]}'}
+            for row in rows[:DOCUMENT_SEARCH_PAGE_SIZE]
+        ],
+        "more": len(rows) > DOCUMENT_SEARCH_PAGE_SIZE,
+    })
+
+
 @login_required
 def edit_document(request, pk):
     document = get_object_or_404(Document, pk=pk)
@@ -706,7 +782,14 @@ def edit_document(request, pk):
         return redirect("document_detail", pk=pk)
 
 
+def edit_document_state(request, pk):
+    row = Document.objects.filter(pk=pk).values_list(
+        "title", "description", "priority", "status", "sender_id"
+    ).first()
+    return None if row is None else ((request.user.pk, row), None)
+
 @login_required
+@conditional_poll(edit_document_state)
 def edit_document_modal(request, pk):
     if request.method != "GET":
         return HttpResponse(status=405)
@@ -755,45 +838,29 @@ def document_detail(request, pk):
             messages.error(request, "You are not authorized to view this document.")
             return redirect("all_documents")
         
-    departments = defaultdict(list)
-    all_users = User.objects.select_related("userprofile").all()
-    for u in all_users:
-        if hasattr(u, "userprofile") and u.userprofile.department:
-            departments[u.userprofile.department].append(u)
+    departments = office_directory()
 
-    forwards = document.history.filter(action="Forwarded").order_by("-timestamp")
-    prev_forward = forwards[1] if forwards.count() > 1 else None
-    return_target = prev_forward.to_office if prev_forward else document.sender if forwards.exists() else None
+    # Routing pointers are kept on the document itself (see Document.apply_routing_entry)
+    return_target = document.sender if document.last_forward_id else None
 
     history = document.history.order_by("-timestamp")
 
     # Can retract if last forward exists and has not been received
-    last_forward = document.history.filter(action="Forwarded").order_by('-timestamp').first()
-    can_retract = last_forward and not document.history.filter(
-        action="Received", timestamp__gte=last_forward.timestamp
-    ).exists() and document.current_office == request.user
+    can_retract = document.is_retractable and document.current_office_id == request.user.id
 
     # Can forward if user is current holder, not completed, and not retractable
-    can_forward = document.current_office == request.user and document.status != "Completed" and not can_retract
+    can_forward = document.current_office_id == request.user.id and document.status != "Completed" and not can_retract
 
     # 🔹 Offices that previously handled the document (for return dropdown)
-    previous_offices = (
-        document.history
-        .filter(action__in=["Forwarded", "Returned", "Received"])
-        .exclude(from_office__isnull=True)
-        .values_list("from_office", flat=True)
-        .distinct()
-    )
-
     return_offices = User.objects.filter(
-        id__in=previous_offices
+        id__in=document.previous_offices
     ).exclude(id=document.current_office_id)
 
 
     context = {
         "document": document,
         "history": history,
-        "departments": dict(departments),
+        "departments": departments,
         "return_target": return_target,
         "can_retract": can_retract,
         "can_forward": can_forward,
@@ -830,7 +897,8 @@ def forward_document(request, pk):
             notify(
                 new_office_user,
                 f"Document {document.title} with tracking ID {document.tracking_id} was forwarded to you by {request.user.get_full_name()}.",
-                url=reverse("receive_page")
+                url=reverse("receive_page"),
+                kind="forwarded"
             )
 
         # Notify sender if it's not the same as the new office
@@ -857,29 +925,17 @@ def retract_document(request, pk):
         messages.error(request, "Only the current document holder can retract this document.")
         return redirect("document_detail", pk=pk)
 
-    # Find the last forward action
-    last_forward = document.history.filter(action="Forwarded").order_by('-timestamp').first()
-    if not last_forward:
+    if not document.last_forward_id:
         messages.error(request, "This document has not been forwarded yet, so it cannot be retracted.")
         return redirect("document_detail", pk=pk)
 
     # Check if the document has been received by the wrong recipient
-    received_after_forward = document.history.filter(
-        action="Received", timestamp__gte=last_forward.timestamp
-    ).exists()
-    if received_after_forward:
+    if not document.is_retractable:
         messages.error(request, "This document has already been received and cannot be retracted.")
         return redirect("document_detail", pk=pk)
 
-    # Mark the last forward as retracted (instead of deleting it)
-    last_forward.action = "Retracted"
-    last_forward.note = f"Retracted by {request.user.get_full_name()}"
-    last_forward.save()
-
-    # Keep document with current holder and reset status so it can be forwarded again
-    document.current_office = request.user
-    document.status = "Pending"  # or whatever status indicates ready to forward
-    document.save()
+    # Marks the last forward as retracted and keeps the document with the current holder
+    document.retract_document(retracted_by=request.user)
 
     messages.success(request, f"The last forward of document '{document.title}' has been successfully retracted.")
     return redirect("document_detail", pk=pk)
@@ -902,18 +958,11 @@ def return_document(request, pk):
     note = request.POST.get("note", "").strip()
     return_office_id = request.POST.get("return_to")
 
-    # 🔹 Get all previous offices from history (safe options)
-    previous_offices = (
-        document.history
-        .filter(action__in=["Forwarded", "Returned", "Received"])
-        .exclude(from_office__isnull=True)
-        .values_list("from_office", flat=True)
-        .distinct()
-    )
-
-    allowed_offices = User.objects.filter(
-        id__in=previous_offices
-    ).exclude(id=request.user.id)
+    # 🔹 Previous offices are tracked on the document (safe options)
+    allowed_offices = [
+        office_id for office_id in document.previous_offices
+        if office_id != request.user.id
+    ]
 
     if not return_office_id:
         messages.error(request, "Please select an office to return the document to.")
@@ -923,30 +972,32 @@ def return_document(request, pk):
     return_office = get_object_or_404(
         User,
         id=return_office_id,
-        id__in=allowed_offices.values_list("id", flat=True)
+        id__in=allowed_offices
     )
 
-    # ✅ Update document
-    document.current_office = return_office
-    document.status = "In Transit"
-    document.save()
-
-    # 🧾 Log history
-    DocumentHistory.objects.create(
-        document=document,
-        action="Returned",
-        from_office=request.user,
-        to_office=return_office,
-        performed_by=request.user,
-        note=note or "Returned to selected office"
-    )
+    with transaction.atomic():
+        # ✅ Update document
+        document.current_office = return_office
+        document.status = "In Transit"
+        document.save()
+
+        # 🧾 Log history
+        DocumentHistory.objects.create(
+            document=document,
+            action="Returned",
+            from_office=request.user,
+            to_office=return_office,
+            performed_by=request.user,
+            note=note or "Returned to selected office"
+        )
 
     # 🔔 Notify receiving office
     notify(
         return_office,
         f"Document {document.title} with tracking ID {document.tracking_id} "
         f"was returned to you by {request.user.get_full_name()}.",
-        url=reverse("receive_page")
+        url=reverse("receive_page"),
+        kind="returned"
     )
 
     messages.success(
@@ -959,6 +1010,87 @@ def return_document(request, pk):
 
 
 
+BULK_ROUTE_LIMIT = 500
+
+
+@login_required
+def bulk_route_documents(request):
+    """Forward or return a batch of selected documents to one office."""
+    if request.method != "POST":
+        messages.error(request, "Invalid request.")
+        return redirect("all_documents")
+
+    action = request.POST.get("action")
+    note = request.POST.get("note", "").strip()
+    document_ids = [value for value in request.POST.getlist("document_ids") if value.isdigit()]
+
+    if action not in ("forward", "return"):
+        messages.error(request, "Invalid request.")
+        return redirect("all_documents")
+    if not document_ids:
+        messages.error(request, "Please select at least one document.")
+        return redirect("all_documents")
+    if len(document_ids) > BULK_ROUTE_LIMIT:
+        messages.error(request, f"Please select at most {BULK_ROUTE_LIMIT} documents at a time.")
+        return redirect("all_documents")
+
+    office = get_object_or_404(User, id=request.POST.get("office") or 0)
+    if office == request.user:
+        messages.error(request, f"You cannot {action} documents to yourself.")
+        return redirect("all_documents")
+
+    # One query for the whole selection; only the current holder may route a document
+    with transaction.atomic():
+        selected = list(
+            Document.objects.select_for_update()
+            .filter(pk__in=document_ids, current_office=request.user)
+            .exclude(status="Completed")
+            .order_by("pk")
+        )
+        if action == "forward":
+            # Documents already forwarded and not yet received must be retracted first
+            allowed = [document for document in selected if not document.is_retractable]
+        else:
+            allowed = [document for document in selected if office.id in document.previous_offices]
+
+        if allowed:
+            if action == "forward":
+                Document.bulk_forward(allowed, office, forwarded_by=request.user, note=note or None)
+            else:
+                Document.bulk_return(
+                    allowed, office, returned_by=request.user, note=note or "Returned to selected office"
+                )
+
+    skipped = len(set(document_ids)) - len(allowed)
+    verb = "forwarded" if action == "forward" else "returned"
+
+    if allowed:
+        # One notification for the whole selection instead of one per document
+        if len(allowed) == 1:
+            message = (
+                f"Document {allowed[0].title} with tracking ID {allowed[0].tracking_id} "
+                f"was {verb} to you by {request.user.get_full_name()}."
+            )
+        else:
+            message = f"{len(allowed)} documents were {verb} to you by {request.user.get_full_name()}."
+        notify(
+            office, message, url=reverse("receive_page"),
+            kind="forwarded" if action == "forward" else "returned", count=len(allowed),
+        )
+
+        messages.success(request, f"{len(allowed)} document(s) {verb} to {office.get_full_name()}.")
+    if skipped:
+        messages.warning(
+            request,
+            f"{skipped} selected document(s) could not be {verb}: you must be the current holder, "
+            + ("and they must not be awaiting receipt." if action == "forward"
+               else f"and {office.get_full_name()} must have handled them before.")
+        )
+
+    return redirect("all_documents")
+
+
+
 
 @login_required
 def receive_page(request):
@@ -991,11 +1123,52 @@ def receive_page(request):
     return render(request, "receive.html", context)
 
 
+def routing_slip_state(request, pk):
+    row = Document.objects.filter(pk=pk).values_list(
+        "title", "description", "status", "qr_ready", "qr_fingerprint"
+    ).first()
+    if row is None:
+        return None
+    # Every transition and edit appends history; names come from the office directory
+    latest = DocumentHistory.objects.filter(document_id=pk).order_by("-pk").values_list("pk", flat=True).first()
+    return (row, latest, directory_version()), None
+
+@conditional_poll(routing_slip_state)
 def routing_slip_partial(request, pk):
     doc = get_object_or_404(Document, pk=pk)
     return render(request, 'documents/partials/routing_slip.html', {'document': doc})
 
 
+@login_required
+def document_qr(request, tracking_id):
+    """
+    Render a document's QR code on demand (?format=png|png1|svg, ?size=small|medium|large).
+    Requests carrying the current ?v= version are cacheable forever.
+    """
+    fmt = request.GET.get("format", "png")
+    size = request.GET.get("size", "medium")
+    if fmt not in QR_FORMATS or size not in QR_SIZES:
+        return HttpResponse("Unsupported QR format or size.", status=400)
+
+    document = get_object_or_404(
+        Document.objects.select_related("sender", "current_office"), tracking_id=tracking_id
+    )
+    payload = document.qr_payload()
+    etag = f'"{qr_cache_key(payload, fmt, size)}"'
+
+    if request.headers.get("If-None-Match") == etag:
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(get_qr_bytes(payload, fmt, size), content_type=QR_FORMATS[fmt][0])
+
+    response["ETag"] = etag
+    if request.GET.get("v") == document.compute_qr_fingerprint()[:16]:
+        response["Cache-Control"] = "private, max-age=31536000, immutable"
+    else:
+        response["Cache-Control"] = "private, no-cache"
+    return response
+
+
 @login_required
 def receive_document(request):
     if request.method != "POST":
@@ -1019,36 +1192,22 @@ def receive_document(request):
         messages.warning(request, f"Document {document.tracking_id} has already been received by your office.")
         return redirect("receive_page")
 
-   # Get the last routing action (Forwarded OR Returned)
-    last_routing = document.history.filter(
-        action__in=["Forwarded", "Returned"]
-    ).order_by("-timestamp").first()
-
-    if not last_routing:
+    # The intended recipient of the last routing action (Forwarded OR Returned)
+    if not document.intended_recipient_id:
         messages.error(request, "This document has not been routed to any office yet.")
         return redirect("receive_page")
 
     # Check if the logged-in user is the intended receiver
-    if request.user != last_routing.to_office:
+    if request.user.id != document.intended_recipient_id:
         messages.error(
             request,
             f"You are not authorized to receive this document. "
-            f"This document is assigned to {last_routing.to_office.get_full_name()}."
+            f"This document is assigned to {document.intended_recipient.get_full_name()}."
         )
         return redirect("receive_page")
 
-    
-    # Suppose this is after receiving the document
     document_detail_url = reverse('document_detail', kwargs={'pk': document.pk})
 
-    # Get who forwarded the document here
-    last_action = document.history.filter(
-        to_office=request.user,
-        action__in=["Forwarded", "Returned"]
-    ).order_by("-timestamp").first()
-
-    from_office = last_action.from_office if last_action else None
-
     # Update the document and log history via model method
     document.mark_received(
         receiving_office=request.user,
@@ -1060,21 +1219,108 @@ def receive_document(request):
     notify(
         document.sender,
         f"Document {document.title} with tracking ID {document.tracking_id} was received by {request.user.get_full_name()}.",
-        url=document_detail_url
+        url=document_detail_url,
+        kind="received"
     )
 
     messages.success(request, f"Document {document.title} with tracking ID {document.tracking_id} received successfully.")
     return redirect("receive_page")
 
 
+RECEIVE_BATCH_LIMIT = 500
+
+
+def parse_tracking_ids(values):
+    """Split scanned/pasted input into unique tracking IDs, keeping scan order."""
+    tracking_ids = []
+    for value in values:
+        for token in re.split(r"[\s,;]+", value.upper()):
+            if token and token not in tracking_ids:
+                tracking_ids.append(token)
+    return tracking_ids
+
+
+@login_required
+def receive_batch(request):
+    """
+    Receive many scanned documents at once. All IDs are validated against the
+    intended recipient in one locking query and received in the same transaction.
+    Returns a per-ID result list as JSON.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid method"}, status=405)
+
+    tracking_ids = parse_tracking_ids(request.POST.getlist("tracking_ids"))
+    if not tracking_ids:
+        return JsonResponse({"error": "At least one tracking ID is required."}, status=400)
+    if len(tracking_ids) > RECEIVE_BATCH_LIMIT:
+        return JsonResponse({"error": f"At most {RECEIVE_BATCH_LIMIT} documents can be received at once."}, status=400)
+
+    # Validate under the row locks, so two scans of the same IDs can't both receive them
+    with transaction.atomic():
+        documents = {
+            doc.tracking_id: doc
+            for doc in Document.objects.select_related("sender").select_for_update(of=("self",))
+            .filter(tracking_id__in=tracking_ids)
+            .order_by("pk")
+        }
+
+        results = []
+        to_receive = []
+        for tracking_id in tracking_ids:
+            document = documents.get(tracking_id)
+            if document is None:
+                error = "Document not found with this tracking ID."
+            elif document.status == "Received" and document.current_office_id == request.user.id:
+                error = "Already received by your office."
+            elif not document.intended_recipient_id:
+                error = "This document has not been routed to any office yet."
+            elif document.intended_recipient_id != request.user.id:
+                error = "You are not authorized to receive this document."
+            else:
+                error = None
+                to_receive.append(document)
+            results.append({
+                "tracking_id": tracking_id,
+                "title": document.title if document else "",
+                "ok": error is None,
+                "message": error or "Received",
+            })
+
+        if to_receive:
+            Document.bulk_mark_received(
+                to_receive,
+                receiving_office=request.user,
+                received_by=request.user,
+                note="Received via batch scan"
+            )
+
+    if to_receive:
+        notify_many([
+            (
+                document.sender,
+                f"Document {document.title} with tracking ID {document.tracking_id} was received by {request.user.get_full_name()}.",
+                reverse('document_detail', kwargs={'pk': document.pk})
+            )
+            for document in to_receive
+        ], kind="received")
+
+    return JsonResponse({
+        "received": len(to_receive),
+        "failed": len(results) - len(to_receive),
+        "results": results,
+    })
+
+
 # notification starts here
 @login_required
 def mark_notification_read(request, pk):
     notification = get_object_or_404(
         Notification, pk=pk, recipient=request.user
     )
-    notification.is_read = True
-    notification.save()
+    # Conditional update, so a double click only uncounts the notification once
+    if Notification.objects.filter(pk=notification.pk, is_read=False).update(is_read=True):
+        adjust_unread({request.user.pk: -1})
 
     if notification.url:
         return redirect(notification.url)
@@ -1084,16 +1330,17 @@ def mark_notification_read(request, pk):
 @login_required
 def mark_all_notifications_read(request):
     if request.method == 'POST':
-        Notification.objects.filter(recipient=request.user, is_read=False).update(is_read=True)
+        marked = Notification.objects.filter(recipient=request.user, is_read=False).update(is_read=True)
+        adjust_unread({request.user.pk: -marked})
         return JsonResponse({'success': True})
     return JsonResponse({'error': 'Invalid method'}, status=405)
 
-@login_required
-def notifications_api(request):
+def notification_payload(request, count):
+    """The badge count and rendered dropdown items, as sent by the API and the stream."""
     notifications = Notification.objects.filter(
         recipient=request.user,
         is_read=False
-    ).order_by("-created_at")[:5]
+    ).order_by("-created_at")[:5] if count else []
 
     html = render_to_string(
         "partials/notification_items.html",
@@ -1101,10 +1348,71 @@ def notifications_api(request):
         request=request
     )
 
-    return JsonResponse({
-        "count": notifications.count(),
+    return {
+        "count": count,
         "html": html
-    })
+    }
+
+def latest_unread_notification(user):
+    """Unread (pk, created_at) pairs, newest first; merging an event into a row moves its created_at."""
+    return Notification.objects.filter(recipient=user, is_read=False).order_by("-created_at").values_list(
+        "pk", "created_at"
+    )
+
+def notification_state(request):
+    latest = latest_unread_notification(request.user).first()
+    return (request.user.pk, latest, unread_count(request.user)), None
+
+@login_required
+@conditional_poll(notification_state, poll_interval=(5, 60))
+def notifications_api(request):
+    return JsonResponse(notification_payload(request, unread_count(request.user)))
+
+
+# Seconds between database checks while a stream sleeps: the fallback that
+# catches notifications committed by other worker processes
+NOTIFICATION_STREAM_POLL = 15
+# Streams are closed after this many seconds; EventSource reconnects on its own
+NOTIFICATION_STREAM_LIFETIME = 300
+
+async def notification_events(request, user):
+    """Server-sent events: a `notifications` event whenever the badge state changes."""
+    loop = asyncio.get_running_loop()
+    closes_at = loop.time() + NOTIFICATION_STREAM_LIFETIME
+    state = None
+
+    with events.Subscription(user.pk) as subscription:
+        yield "retry: 3000\n\n"
+        while True:
+            # The newest unread notification is the cursor; the count comes from the shared cache
+            latest = await latest_unread_notification(user).afirst()
+            count = await sync_to_async(unread_count)(user)
+            if (latest, count) != state:
+                state = (latest, count)
+                payload = await sync_to_async(notification_payload)(request, count)
+                yield f"id: {latest[0] if latest else 0}\nevent: notifications\ndata: {json.dumps(payload)}\n\n"
+            else:
+                yield ": keepalive\n\n"
+
+            remaining = closes_at - loop.time()
+            if remaining <= 0:
+                return
+            await subscription.wait(min(NOTIFICATION_STREAM_POLL, remaining))
+
+@login_required
+async def notification_stream(request):
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI an open stream would pin a worker thread. 204 tells
+        # EventSource not to reconnect, and the page falls back to polling.
+        return HttpResponse(status=204)
+
+    user = await request.auser()
+    response = StreamingHttpResponse(
+        notification_events(request, user), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
 
 @login_required
 def add_status(request, document_id):
@@ -1140,119 +1448,119 @@ def add_status(request, document_id):
 
 @login_required
 def document_report_api(request, report_type):
-    today = timezone.now()
-    report_data = []
-
-    user = request.user
-    document_id = request.GET.get("document_id")  # single document option
-
-    # --- SINGLE DOCUMENT LOGIC ---
-    if document_id:
-        document = Document.objects.filter(
-            id=document_id
-        ).filter(
-            Q(sender=user) | Q(current_office=user)
-        ).first()
-
-        if not document:
-            return JsonResponse({"error": "Document not found or access denied."}, status=404)
-
-        histories = DocumentHistory.objects.select_related(
-            "document", "from_office", "to_office", "performed_by"
-        ).filter(document=document).order_by("timestamp")
-
-    else:
-        # --- Determine date range ---
-        if report_type == "weekly":
-            start_date = request.GET.get("start")
-            end_date = request.GET.get("end")
-            if start_date and end_date:
-                start_date = datetime.fromisoformat(start_date)
-                end_date = datetime.fromisoformat(end_date) + timedelta(days=1)
-            else:
-                start_date = today - timedelta(days=7)
-                end_date = today
-        elif report_type == "monthly":
-            month_year = request.GET.get("month_year")
-            if month_year:
-                year, month = map(int, month_year.split("-"))
-                start_date = datetime(year, month, 1)
-                if month == 12:
-                    end_date = datetime(year + 1, 1, 1)
-                else:
-                    end_date = datetime(year, month + 1, 1)
-            else:
-                start_date = today - timedelta(days=30)
-                end_date = today
-        else:
-            return JsonResponse({"error": "Invalid report type"}, status=400)
-
-        histories = DocumentHistory.objects.select_related(
-            "document", "from_office", "to_office", "performed_by"
-        ).filter(
-            timestamp__gte=start_date,
-            timestamp__lt=end_date
-        ).filter(
-            Q(document__sender=user) |
-            Q(document__current_office=user) |
-            Q(from_office=user) |
-            Q(to_office=user) |
-            Q(performed_by=user)
-        ).order_by("document", "timestamp")
+    try:
+        report = reports.Report(request.user, report_type, request.GET)
+    except reports.ReportError as error:
+        return JsonResponse({"error": str(error)}, status=error.status)
 
     # --- Prepare report ---
-    for h in histories:
-        next_h = DocumentHistory.objects.filter(
-            document=h.document,
-            timestamp__gt=h.timestamp
-        ).order_by("timestamp").first()
-
-        # Calculate days:hours:minutes:seconds
-        delta = (next_h.timestamp - h.timestamp) if next_h else (timezone.now() - h.timestamp)
-        total_seconds = int(delta.total_seconds())
-        days, remainder = divmod(total_seconds, 86400)
-        hours, remainder = divmod(remainder, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        days_stayed_str = f"{days}d {hours}h {minutes}m {seconds}s"
-
-        report_data.append({
-            "tracking_id": h.document.tracking_id,
-            "title": h.document.title,
-            "action": h.action,
-            "from_office": h.from_office.get_full_name() if h.from_office else "",
-            "to_office": h.to_office.get_full_name() if h.to_office else "",
-            "performed_by": h.performed_by.get_full_name() if h.performed_by else "",
-            "timestamp": h.timestamp.strftime("%b %d, %Y %H:%M"),
-            "days_stayed": days_stayed_str,
-            "note": h.note or ""
-        })
+    # The next entry's timestamp comes from the same query (see reports.report_histories)
+    rows = report.rows()
 
     # --- Export handling ---
     export = request.GET.get("export")
-    filename_prefix = 'single_document' if document_id else report_type
 
-    if export == "excel":
-        df = pd.DataFrame(report_data)
-        buffer = BytesIO()
-        df.to_excel(buffer, index=False)
-        buffer.seek(0)
-        response = HttpResponse(
-            buffer,
-            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    # Explicit periods and single documents are served from the artifact cache
+    if export in ("csv", "excel") and report.period is not None:
+        fmt, content_type = reports.REPORT_FORMATS[export]
+        artifact = reports.get_artifact(report, fmt)
+        return serve_report_file(
+            request, artifact.file, f"{report.filename}.{fmt}", content_type, closed=report.closed
         )
-        response['Content-Disposition'] = f'attachment; filename={filename_prefix}_report_{today.strftime("%Y%m%d")}.xlsx'
+
+    # CSV and Excel stream rows as they come off the cursor, so memory stays flat
+    if export == "csv":
+        response = StreamingHttpResponse(reports.iter_csv(rows), content_type="text/csv")
+        response['Content-Disposition'] = f'attachment; filename={report.filename}.csv'
         return response
 
+    if export == "excel":
+        return FileResponse(
+            reports.write_xlsx(rows),
+            as_attachment=True,
+            filename=f"{report.filename}.xlsx",
+            content_type=reports.XLSX_CONTENT_TYPE,
+        )
+
+    # PDFs are rendered in the background; poll the returned status_url
     if export == "pdf":
-        html = render_to_string("reports/report_pdf_template.html", {
-            "report_data": report_data,
-            "report_type": f"Document: {document.title}" if document_id else report_type
-        })
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename={filename_prefix}_report_{today.strftime("%Y%m%d")}.pdf'
-        pisa_status = pisa.CreatePDF(html, dest=response)
-        if pisa_status.err:
-            return HttpResponse("Error generating PDF", status=500)
-        return response
+        return enqueue_report_job(request, report_type, request.GET)
+
+    return JsonResponse({"report_data": list(rows)})
+
+
+def serve_report_file(request, file, filename, content_type, closed=False):
+    """Serve a stored report file with an ETag, answering If-None-Match with 304."""
+    etag = reports.artifact_etag(file.name)
+    if request.headers.get("If-None-Match") == etag:
+        response = HttpResponse(status=304)
+    else:
+        response = FileResponse(file.open("rb"), as_attachment=True, filename=filename, content_type=content_type)
+
+    response["ETag"] = etag
+    # Closed periods only change when late history arrives; revalidate open ones every time
+    response["Cache-Control"] = "private, max-age=3600" if closed else "private, no-cache"
+    return response
 
-    return JsonResponse({"report_data": report_data})
\ No newline at end of file
+
+@login_required
+def office_dwell_api(request):
+    """Office dwell-time analytics from the daily rollup; staff see every office, others their own."""
+    today = timezone.localdate()
+    try:
+        start = date.fromisoformat(request.GET["start"]) if request.GET.get("start") else today - timedelta(days=30)
+        end = date.fromisoformat(request.GET["end"]) if request.GET.get("end") else today
+    except ValueError:
+        return JsonResponse({"error": "Dates must look like YYYY-MM-DD."}, status=400)
+    group = "week" if request.GET.get("group") == "week" else "day"
+
+    offices = None if request.user.is_superuser or request.user.is_staff else [request.user]
+    rows = list(reports.office_dwell_summary(start, end, offices=offices, group=group))
+    return JsonResponse({"start": start.isoformat(), "end": end.isoformat(), "group": group, "rows": rows})
+
+
+def report_job_payload(job):
+    payload = {
+        "job_id": job.pk,
+        "status": job.status,
+        "progress": job.progress,
+        "status_url": reverse("report_job_status", args=[job.pk]),
+    }
+    if job.status == "Done":
+        payload["download_url"] = reverse("report_job_download", args=[job.pk])
+    elif job.status == "Failed":
+        payload["error"] = "The report could not be generated."
+    return payload
+
+
+def enqueue_report_job(request, report_type, data):
+    try:
+        job = reports.enqueue_report_job(request.user, report_type, data)
+    except reports.ReportError as error:
+        return JsonResponse({"error": str(error)}, status=error.status)
+    return JsonResponse(report_job_payload(job), status=202)
+
+
+@login_required
+def create_report_job(request, report_type):
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request."}, status=405)
+    return enqueue_report_job(request, report_type, request.POST)
+
+
+@login_required
+def report_job_status(request, pk):
+    job = get_object_or_404(ReportJob, pk=pk, user=request.user)
+    return JsonResponse(report_job_payload(job))
+
+
+@login_required
+def report_job_download(request, pk):
+    job = get_object_or_404(ReportJob, pk=pk, user=request.user, status="Done")
+    # Cached files are removed when their report changes; export again in that case
+    if not job.artifact or not job.artifact.storage.exists(job.artifact.name):
+        raise Http404("Report file not found.")
+    prefix = "single_document" if job.params.get("document_id") else job.report_type
+    return serve_report_file(
+        request, job.artifact, f'{prefix}_report_{job.created_at.strftime("%Y%m%d")}.pdf', "application/pdf"
+    )